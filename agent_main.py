@@ -1,82 +1,206 @@
+import asyncio
+from pathlib import Path
+
 from langsmith import traceable
 from langgraph.graph.state import CompiledStateGraph
 
 from src.agents.report_graph import create_report_graph
+from src.agents.tools.python_interpreter import close_request_python_repl
+from src.agents.tools.python_kernel import get_kernel_pool
 from src.agents.utils.email_service import MailingService
-from src.agents.utils.output_utils import (
-    convert_markdown_to_pdf,
-    get_request_temp_dir,
-    move_file_to_storage,
-    store_response_with_timestamp,
-)
-from src.configuration.db_models import SalesReportRequest
+from src.configuration.checkpointer import get_checkpointer, get_report_thread_id
+from src.configuration.db_models import RecipientEmail, SalesReportRequest
 from src.configuration.db_service import default_db
 from src.configuration.logger import default_logger
 from src.configuration.settings import app_settings
+from src.data_engine.dataset_profile import (
+    InvalidRequestError,
+    validate_sales_report_request,
+)
+
+
+async def execute_sales_report_request(
+    request: SalesReportRequest,
+    recipient_lists: list[list[RecipientEmail]] | None = None,
+) -> None:
+    """
+    Generate the report for a request and email it to its recipients.
 
+    Args:
+        request (SalesReportRequest): The request to generate the report for.
+        recipient_lists (list[list[RecipientEmail]] | None): Recipients of each request
+            sharing this report; each list gets its own email. Defaults to the
+            request's recipients.
+    """
+    if recipient_lists is None:
+        recipient_lists = [request.recipients]
+
+    mailing = MailingService(env=app_settings)
+
+    # Check the grouping value against the data before spending any LLM calls on it
+    try:
+        request = await asyncio.to_thread(validate_sales_report_request, request)
+    except InvalidRequestError as e:
+        default_logger.error(f"Invalid request {request.name}: {str(e)}")
+        for recipients in recipient_lists:
+            await asyncio.to_thread(
+                mailing.send_email,
+                recipients=[recipient.email for recipient in recipients],
+                subject="AI Analyst Agent Run - Failed",
+                body=f"The AI Analyst agent could not generate your report: {str(e)}",
+            )
+        return
+    except Exception as e:
+        # E.g. the data is missing, can't be read or has unexpected values; the agents
+        # handle it themselves
+        default_logger.warning(f"Could not validate request {request.name}: {str(e)}")
 
-async def execute_sales_report_request(request: SalesReportRequest) -> None:
     default_logger.info(f"Starting research task for KPI: {request.name}")
     retry_count = 0
     result: dict | None = None
-    while retry_count < app_settings.retry_limit:
-        try:
-            research_graph: CompiledStateGraph = await create_report_graph()
-            result = await research_graph.ainvoke({"request": request})
-            default_logger.info(f"Completed research task for KPI: {request.name}")
-            break  # Exit loop if successful
-        except Exception as e:
-            if retry_count >= app_settings.retry_limit:
-                default_logger.error(f"Max retries reached for request {request.name}.")
-                break
-            retry_count += 1
-            default_logger.error(
-                f"Error processing request {request.name}: {str(e)}. Retry {retry_count}/{app_settings.retry_limit}."
-            )
-
-    email_list = [recipient.email for recipient in request.recipients]
-    email_names = [recipient.name for recipient in request.recipients]
-    email_names_str = ", ".join(email_names)
-    mailing = MailingService(env=app_settings)
+    thread_id = get_report_thread_id(request)
+    config = {"configurable": {"thread_id": thread_id}}
+
+    async with get_checkpointer() as checkpointer:
+        while retry_count < app_settings.retry_limit:
+            try:
+                research_graph: CompiledStateGraph = await create_report_graph(
+                    checkpointer=checkpointer
+                )
+                # Resume from the last completed node if a previous attempt
+                # (or a previous run that crashed) did not finish
+                snapshot = await research_graph.aget_state(config)
+                if snapshot.next:
+                    default_logger.info(
+                        f"Resuming research task for KPI: {request.name} from {', '.join(snapshot.next)}"
+                    )
+                    graph_input = None
+                else:
+                    graph_input = {"request": request}
+
+                result = await research_graph.ainvoke(graph_input, config)
+                default_logger.info(f"Completed research task for KPI: {request.name}")
+                break  # Exit loop if successful
+            except Exception as e:
+                if retry_count >= app_settings.retry_limit:
+                    default_logger.error(
+                        f"Max retries reached for request {request.name}."
+                    )
+                    break
+                retry_count += 1
+                default_logger.error(
+                    f"Error processing request {request.name}: {str(e)}. Retry {retry_count}/{app_settings.retry_limit}."
+                )
+
+        # Completed runs don't need to be resumed, so free up the space
+        if result:
+            await checkpointer.adelete_thread(thread_id)
+
+    # The agents of the request are done with its REPL, free its kernel and variables
+    await asyncio.to_thread(close_request_python_repl, request.task_id)
 
     if result:
-        temp_dir = get_request_temp_dir(request)
-        md_file_path = store_response_with_timestamp(
-            response=result["report"], folder=temp_dir, file_name=request.name
-        )
-
-        # Convert the Markdown report to PDF and move it to storage
-        pdf_path = convert_markdown_to_pdf(
-            markdown_path=md_file_path, root_dir=temp_dir
-        )
-        pdf_path = move_file_to_storage(pdf_path)
-
-        # Send email notification with the report
-        email_template: str = result["email_template"]
-        email_template = email_template.replace("RECIPIENT", email_names_str)
-        mailing.send_email(
-            recipients=email_list,
-            subject="AI Analyst - Sales Report Generated",
-            body=email_template,
-            attachments=[pdf_path],
-        )
+        # The report graph stores the PDF while it writes the email template
+        pdf_path = Path(result["report_pdf_path"])
+
+        # Send email notification with the report, once per set of recipients
+        for recipients in recipient_lists:
+            email_list = [recipient.email for recipient in recipients]
+            email_names_str = ", ".join(recipient.name for recipient in recipients)
+            email_template: str = result["email_template"]
+            email_template = email_template.replace("RECIPIENT", email_names_str)
+            await asyncio.to_thread(
+                mailing.send_email,
+                recipients=email_list,
+                subject="AI Analyst - Sales Report Generated",
+                body=email_template,
+                attachments=[pdf_path],
+            )
 
         default_logger.info(
             f"AI Analyst agent ran successfully. Report saved at {pdf_path}."
         )
     else:
-        mailing.send_email(
-            recipients=email_list,
-            subject="AI Analyst Agent Run - Failed",
-            body="The AI Analyst agent failed to generate your report.",
+        for recipients in recipient_lists:
+            await asyncio.to_thread(
+                mailing.send_email,
+                recipients=[recipient.email for recipient in recipients],
+                subject="AI Analyst Agent Run - Failed",
+                body="The AI Analyst agent failed to generate your report.",
+            )
+
+
+def group_requests_by_task(
+    requests: list[SalesReportRequest],
+) -> list[list[SalesReportRequest]]:
+    """
+    Group the requests that need the same data work, i.e. that share a task_id
+    (grouping, grouping value, period and currency) and only differ in their recipients.
+
+    Args:
+        requests (list[SalesReportRequest]): The requests to group.
+
+    Returns:
+        list[list[SalesReportRequest]]: The groups, in the order of their first request.
+    """
+    groups: dict[str, list[SalesReportRequest]] = {}
+    for request in requests:
+        groups.setdefault(request.task_id, []).append(request)
+
+    return list(groups.values())
+
+
+async def execute_sales_report_requests(
+    requests: list[SalesReportRequest], max_concurrent_requests: int
+) -> None:
+    """
+    Execute the sales report requests as concurrent tasks, generating the report
+    once for requests that only differ in their recipients.
+
+    The semaphore caps how many requests are in flight at once, while the
+    shared rate limiter in AppChatModels throttles the LLM calls across all of them.
+
+    Args:
+        requests (list[SalesReportRequest]): The requests to execute.
+        max_concurrent_requests (int): Maximum number of requests running at the same time.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrent_requests))
+
+    # Requests that share the same data work are only generated once
+    request_groups = group_requests_by_task(requests)
+    if len(request_groups) < len(requests):
+        default_logger.info(
+            f"Coalesced {len(requests)} requests into {len(request_groups)} reports."
         )
 
+    async def execute_with_limit(request_group: list[SalesReportRequest]) -> None:
+        async with semaphore:
+            request = request_group[0]
+            default_logger.info(f"Processing request: {request.name}")
+            await execute_sales_report_request(
+                request,
+                recipient_lists=[
+                    grouped_request.recipients for grouped_request in request_group
+                ],
+            )
+
+    results = await asyncio.gather(
+        *(execute_with_limit(request_group) for request_group in request_groups),
+        return_exceptions=True,
+    )
+
+    # A failing request should never cancel the others, just log it
+    for request_group, result in zip(request_groups, results):
+        if isinstance(result, Exception):
+            default_logger.error(
+                f"Unexpected error processing request {request_group[0].name}: {str(result)}"
+            )
+
 
 @traceable
 async def main():
     """
-    Main function to run the database agent.
-    This is a simple example of how to use the database agent.
+    Main function to run the sales report agent for all configured requests.
     """
 
     requests = default_db.get_all_sales_report_requests()
@@ -86,15 +210,17 @@ async def main():
 
     default_logger.info(f"Found {len(requests)} sales report requests.")
 
-    # Runs the tasks sequentially because of API rate limits
-    for request in requests:
-        default_logger.info(f"Processing request: {request.name}")
-        await execute_sales_report_request(request)
+    # Start the kernels of the code agents while the first steps run
+    if app_settings.repl_isolated_kernels:
+        get_kernel_pool()
+
+    # Runs the tasks concurrently, API rate limits are handled by the models' rate limiter
+    await execute_sales_report_requests(
+        requests, max_concurrent_requests=app_settings.max_concurrent_requests
+    )
 
     default_logger.info("All sales report requests processed.")
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
@@ -1,9 +1,23 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from src.frontend.routers import index, sales_report, cronjob
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Built in the background, the app can serve requests in the meantime
+    warm_up = asyncio.create_task(sales_report.warm_grouping_value_index())
+    yield
+    warm_up.cancel()
+
+
 app = FastAPI(
-    title="Sales Report Setup", description="FastAPI version of Sales Report Setup"
+    title="Sales Report Setup",
+    description="FastAPI version of Sales Report Setup",
+    lifespan=lifespan,
 )
 
 # Include routers
@@ -5,11 +5,13 @@ with a few key differences:
 
 1. It includes a code review step after executing code.
 2. It has a maximum number of iterations and errors to prevent infinite loops.
+3. It compacts old tool outputs once the history is over a token budget.
 
 This is useful for ensuring that the agent does not get stuck in an
 infinite loop or execute harmful code.
 """
 
+import asyncio
 from enum import Enum
 from pathlib import Path
 from typing import Annotated, Literal
@@ -20,16 +22,29 @@ from langgraph.graph.state import CompiledStateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode
 from langgraph.types import Command
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import AnyMessage, SystemMessage, ToolMessage
 
 from src.agents.models import AppChatModels
-from src.agents.tools.python_interpreter import create_python_repl_tool
+from src.agents.tools.code_preflight import is_preflight_error
+from src.agents.tools.execution_result import ExecutionResult
+from src.agents.tools.python_interpreter import (
+    PythonREPL,
+    create_python_repl,
+    create_python_repl_tool,
+    describe_repl_dataframes,
+    get_python_repl_config,
+)
 from src.agents.utils.output_utils import store_graph_as_png
 from src.agents.utils.prompt_utils import (
     MessageTypes,
     render_prompt_template,
 )
+from src.agents.utils.context_compaction import compact_messages
+from src.agents.utils.continue_classifier import ContinueDecision, classify_continue
+from src.agents.utils.runnable_registry import default_registry
 from src.configuration.logger import default_logger
+from src.configuration.settings import app_settings
 
 
 class CodeAgentState(BaseModel):
@@ -47,8 +62,25 @@ class CodeAgentState(BaseModel):
     iterations_counter: int = 0
 
 
+# Hints for failures whose cause is clear from the exception, without a code review
+MECHANICAL_ERROR_HINTS = {
+    "KeyError": (
+        "A key or column does not exist. Print the columns (or keys) of the object "
+        "and use one of them, checking the spelling and case."
+    ),
+    "FileNotFoundError": (
+        "The file does not exist. List the files of the directory with os.listdir "
+        "and use the exact path of one of them, or create the file first."
+    ),
+    "ModuleNotFoundError": (
+        "The module is not installed. Use pandas, numpy or matplotlib instead."
+    ),
+}
+
+
 class GraphNodeNames(Enum):
     AGENT = "agent"
+    COMPACT_CONTEXT = "compact_context"
     CODE_REVIEW = "code_review"
     TOOL_NODE = "tool_node"
     TOOL_RESULT_ASSESSMENT = "tool_result_assessment"
@@ -76,6 +108,19 @@ def is_invalid_code_tool_message(message: ToolMessage) -> bool:
         default_logger.debug("Received an error status in the tool message.")
         return True
 
+    # Results of the python tool say if the code failed, see ExecutionResult
+    if isinstance(message.artifact, ExecutionResult):
+        if not message.artifact.succeeded:
+            default_logger.debug(
+                f"The code failed with a {message.artifact.error_type}."
+            )
+            return True
+        if message.content == "" and not message.artifact.files:
+            default_logger.debug("The code produced no output nor files.")
+            return True
+        default_logger.debug("Received a valid tool call output.")
+        return False
+
     if message.content == "":
         default_logger.debug("Received an empty string as the last tool call output.")
         return True
@@ -88,6 +133,71 @@ def is_invalid_code_tool_message(message: ToolMessage) -> bool:
     return False
 
 
+def get_mechanical_error_hint(message: ToolMessage) -> AnyMessage | None:
+    """
+    Hint for a failure of the python tool whose cause is clear from its exception,
+    e.g. a KeyError, so it doesn't need a code review.
+
+    Returns:
+        AnyMessage | None: The hint, None if the failure is not mechanical.
+    """
+    result = message.artifact
+    if not isinstance(result, ExecutionResult):
+        return None
+    hint = MECHANICAL_ERROR_HINTS.get(result.error_type)
+    if hint is None:
+        return None
+    location = (
+        f" on line {result.error_line}: `{result.error_code}`"
+        if result.error_code
+        else ""
+    )
+    return render_prompt_template(
+        "code_agent/mechanical_error_prompt.md",
+        context={"error": f"{result.error}{location}", "hint": hint},
+        type=MessageTypes.HUMAN,
+    )
+
+
+async def assess_continue_condition(
+    last_message: str, model: BaseChatModel
+) -> ContinueDecision | None:
+    """
+    Decide if the agent continues working after a message without tool calls.
+
+    The decision is taken from the cues of the message (see
+    src/agents/utils/continue_classifier.py), and the model is only asked when
+    their confidence is under app_settings.continue_min_confidence.
+
+    Args:
+        last_message (str): The content of the last message of the agent.
+        model (BaseChatModel): The model asked in ambiguous cases.
+
+    Returns:
+        ContinueDecision | None: The decision, None if the model answered neither.
+    """
+    classification = classify_continue(last_message)
+    if classification.confidence >= app_settings.continue_min_confidence:
+        default_logger.debug(
+            f"Continue condition from cues {classification.cues}: "
+            f"{classification.decision.value} ({classification.confidence:.2f})"
+        )
+        return classification.decision
+
+    assessment_message = render_prompt_template(
+        "code_agent/continue_condition_prompt.md",
+        context={
+            "last_message": last_message,
+        },
+        type=MessageTypes.HUMAN,
+    )
+    review_response = await model.ainvoke([assessment_message])
+    try:
+        return ContinueDecision(review_response.content.strip(" `").upper())
+    except ValueError:
+        return None
+
+
 def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
     """
     Creates a code agent with review capabilities.
@@ -114,7 +224,7 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
 
     async def continue_condition(
         state: CodeAgentState,
-    ) -> Literal["agent", "tool_node", "__end__"]:
+    ) -> Literal["compact_context", "tool_node", "__end__"]:
         """
         Determines if the agent should continue based on the current state.
         """
@@ -125,25 +235,17 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
             default_logger.debug("Tool calls detected - routing to tool execution")
             return GraphNodeNames.TOOL_NODE.value
 
-        # Else, use an LLM to assess if we should continue
-        assessment_message = render_prompt_template(
-            "code_agent/continue_condition_prompt.md",
-            context={
-                "last_message": str(last_message.content),
-            },
-            type=MessageTypes.HUMAN,
-        )
-
-        review_response = await models.default_non_reasoning_model.ainvoke(
-            [assessment_message]
+        # Else, assess if we should continue, from the message or with an LLM
+        decision = await assess_continue_condition(
+            str(last_message.content), models.default_non_reasoning_model
         )
 
         # If the response is to continue, go to the agent node
-        if review_response.content.upper() == "CONTINUE":
+        if decision == ContinueDecision.CONTINUE:
             default_logger.debug("Continue condition: CONTINUE - routing back to agent")
-            return GraphNodeNames.AGENT.value
+            return GraphNodeNames.COMPACT_CONTEXT.value
         # If the response is to stop, end the graph
-        elif review_response.content.upper() == "RESPOND":
+        elif decision == ContinueDecision.RESPOND:
             default_logger.info(
                 "Continue condition: RESPOND - ending code agent execution"
             )
@@ -151,7 +253,7 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
 
     async def tool_result_assessment(
         state: CodeAgentState,
-    ) -> Command[Literal["agent", "code_review"]]:
+    ) -> Command[Literal["compact_context", "code_review"]]:
         """
         Uses an LLM to assess if progress is being made or if we're stuck in a loop.
         """
@@ -184,7 +286,20 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
             )
 
             # Jump directly to the agent node for the final output
-            goto = GraphNodeNames.AGENT.value
+            goto = GraphNodeNames.COMPACT_CONTEXT.value
+        elif is_error and (
+            not getattr(last_response.artifact, "executed", True)
+            or is_preflight_error(str(last_response.content))
+        ):
+            # The code was not executed, and the error says exactly what to fix,
+            # so there is nothing for the code review to add
+            default_logger.debug("Pre-flight check failed - routing back to agent")
+            goto = GraphNodeNames.COMPACT_CONTEXT.value
+        elif is_error and (hint_message := get_mechanical_error_hint(last_response)):
+            # The cause is clear from the exception, a hint replaces the code review
+            default_logger.debug("Mechanical error - routing back to agent with a hint")
+            state.messages.append(hint_message)
+            goto = GraphNodeNames.COMPACT_CONTEXT.value
         elif is_error:
             # Add message to let the agent know there was an error
             # Add message to diagnose the situation and stop calling tools
@@ -198,7 +313,7 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
             goto = GraphNodeNames.CODE_REVIEW.value
         else:
             # In any other case, we want to go to the agent for further action
-            goto = GraphNodeNames.AGENT.value
+            goto = GraphNodeNames.COMPACT_CONTEXT.value
 
         return Command(
             goto=goto,
@@ -209,6 +324,21 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
             },
         )
 
+    async def compact_context(state: CodeAgentState) -> dict:
+        """
+        Replace the oldest tool outputs by summaries once the history is over
+        its token budget, so each call of the agent stays about the same size.
+        """
+        compacted = compact_messages(
+            state.messages,
+            app_settings.code_agent_context_max_tokens,
+            app_settings.code_agent_keep_recent_messages,
+        )
+        if compacted:
+            default_logger.debug(f"Compacted {len(compacted)} old tool outputs.")
+        # Messages with the ids of existing ones replace them
+        return {"messages": compacted}
+
     async def code_review(state: CodeAgentState) -> dict:
         """
         Reviews the proposed code before execution using LLM.
@@ -238,6 +368,10 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
         GraphNodeNames.AGENT.value,
         agent,
     )
+    workflow.add_node(
+        GraphNodeNames.COMPACT_CONTEXT.value,
+        compact_context,
+    )
     workflow.add_node(
         GraphNodeNames.TOOL_NODE.value,
         tool_node,
@@ -251,7 +385,11 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
         code_review,
     )
 
-    workflow.add_edge(START, GraphNodeNames.AGENT.value)
+    workflow.add_edge(START, GraphNodeNames.COMPACT_CONTEXT.value)
+    workflow.add_edge(
+        GraphNodeNames.COMPACT_CONTEXT.value,
+        GraphNodeNames.AGENT.value,
+    )
     workflow.add_conditional_edges(GraphNodeNames.AGENT.value, continue_condition)
     workflow.add_edge(
         GraphNodeNames.TOOL_NODE.value,
@@ -259,12 +397,46 @@ def create_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
     )
     workflow.add_edge(
         GraphNodeNames.CODE_REVIEW.value,
-        GraphNodeNames.AGENT.value,
+        GraphNodeNames.COMPACT_CONTEXT.value,
     )
 
     return workflow.compile()
 
 
+def get_repl_dataframes_message(python_repl: PythonREPL) -> AnyMessage | None:
+    """
+    Message listing the dataframes already defined in a REPL, e.g. by the
+    previous agents of the request, so they are reused instead of read again.
+    """
+    dataframes = describe_repl_dataframes(python_repl)
+    if not dataframes:
+        return None
+    return render_prompt_template(
+        "code_agent/repl_dataframes_prompt.md",
+        context={"dataframes": dataframes},
+        type=MessageTypes.HUMAN,
+    )
+
+
+def get_code_agent_with_review(models: AppChatModels) -> CompiledStateGraph:
+    """
+    Get the code agent with review for the given models, compiling it only once per process.
+
+    The system prompt and limits are part of the state, and the REPL is provided
+    in the config, so the same compiled graph can serve every request.
+
+    Args:
+        models (AppChatModels): The models to use for the agent.
+
+    Returns:
+        CompiledStateGraph: The compiled state graph for the agent.
+    """
+    return default_registry.get_or_create(
+        ("code_agent_with_review", models),
+        lambda: create_code_agent_with_review(models),
+    )
+
+
 class PreConfiguredCodeAgent:
     """
     A preconfigured code agent that wraps the code agent with review functionality.
@@ -275,6 +447,7 @@ class PreConfiguredCodeAgent:
 
     _agent: CompiledStateGraph
     _preset_state: CodeAgentState
+    _python_repl: PythonREPL
     _nodes_count: int = 2
 
     def __init__(
@@ -282,6 +455,8 @@ class PreConfiguredCodeAgent:
         preset_state: CodeAgentState,
         models: AppChatModels,
         name: str = "pre_configured_code_agent",
+        output_dir: Path | None = None,
+        python_repl: PythonREPL | None = None,
     ):
         """
         Initialize the preconfigured code agent.
@@ -289,11 +464,37 @@ class PreConfiguredCodeAgent:
         Args:
             preset_state (CodeAgentState): The preset state configuration for the agent
             models (AppChatModels): The models to use for the agent
+            output_dir (Path | None): Directory for code outputs too long to return,
+                usually the temp dir of the request
+            python_repl (PythonREPL | None): REPL to execute code in, usually the
+                one shared by the agents of the request; a new one if None
         """
-        self._agent = create_code_agent_with_review(models)
+        self._agent = get_code_agent_with_review(models)
         self._preset_state = preset_state
+        # The compiled graph is shared, the REPL is the agent's or its request's
+        self._python_repl = python_repl or create_python_repl()
         self._nodes_count = len(self._agent.nodes)
         self._name = name
+        self._output_dir = output_dir
+
+    @property
+    def python_repl(self) -> PythonREPL:
+        """The REPL the agent executes code in."""
+        return self._python_repl
+
+    @staticmethod
+    def succeeded(result: dict) -> bool:
+        """
+        Whether a run of the agent ended on its own, rather than by reaching its
+        maximum number of errors or iterations.
+
+        Args:
+            result (dict): The result of the invocation.
+        """
+        return (
+            result["errors_counter"] < result["max_errors"]
+            and result["iterations_counter"] < result["max_iterations"]
+        )
 
     def store_graph_as_png(self) -> Path:
         return store_graph_as_png(graph=self._agent, file_name=self._name)
@@ -326,21 +527,28 @@ class PreConfiguredCodeAgent:
         self._preset_state.max_errors = max_errors
 
     def _prepare_state_and_config(
-        self, messages: list[AnyMessage]
+        self, messages: list[AnyMessage], repl_message: AnyMessage | None = None
     ) -> tuple[CodeAgentState, dict]:
         """
         Prepare the state copy and configuration for agent invocation.
 
         Args:
             messages (list[AnyMessage]): The messages to add to the preset state
+            repl_message (AnyMessage | None): Description of the dataframes of the
+                REPL, added before the messages
 
         Returns:
             tuple[CodeAgentState, dict]: The prepared state and configuration
         """
+        if repl_message is not None:
+            messages = [repl_message] + messages
         state_copy = self._preset_state.model_copy(
             deep=True, update={"messages": self._preset_state.messages + messages}
         )
-        config = {"recursion_limit": state_copy.max_iterations * self._nodes_count}
+        config = {
+            "recursion_limit": state_copy.max_iterations * self._nodes_count,
+            **get_python_repl_config(self._python_repl, self._output_dir),
+        }
         return state_copy, config
 
     async def ainvoke(self, messages: list[AnyMessage]) -> dict:
@@ -353,7 +561,9 @@ class PreConfiguredCodeAgent:
         Returns:
             dict: The result from the agent invocation
         """
-        state_copy, config = self._prepare_state_and_config(messages)
+        # Getting the names of a kernel waits for the executions of other agents
+        repl_message = await asyncio.to_thread(get_repl_dataframes_message, self._python_repl)
+        state_copy, config = self._prepare_state_and_config(messages, repl_message)
         return await self._agent.ainvoke(state_copy, config)
 
     def invoke(self, messages: list[AnyMessage]) -> dict:
@@ -366,5 +576,7 @@ class PreConfiguredCodeAgent:
         Returns:
             dict: The result from the agent invocation
         """
-        state_copy, config = self._prepare_state_and_config(messages)
+        state_copy, config = self._prepare_state_and_config(
+            messages, get_repl_dataframes_message(self._python_repl)
+        )
         return self._agent.invoke(state_copy, config)
@@ -1,11 +1,49 @@
+from langchain_core.messages import AnyMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import create_react_agent
 from langgraph.graph.state import CompiledStateGraph
 
 from src.agents.models import AppChatModels
-from src.agents.tools.python_interpreter import create_python_repl_tool
+from src.agents.tools.python_interpreter import (
+    INTERNAL_DATA_VARIABLE,
+    SALES_CUBE_VARIABLE,
+    create_python_repl_tool,
+    get_python_repl_config,
+    get_request_python_repl,
+)
 from src.agents.utils.output_utils import get_request_temp_dir
 from src.agents.utils.prompt_utils import MessageTypes, render_prompt_template
+from src.agents.utils.runnable_registry import default_registry
+from src.configuration.constants import INTERNAL_DATA
 from src.configuration.db_models import SalesReportRequest
+from src.data_engine.dataset_profile import describe_dataset_profile
+
+# Key under config["configurable"] holding the system prompt for a given run
+SYSTEM_PROMPT_CONFIG_KEY = "system_prompt"
+
+
+def _prompt_from_config(state: dict, config: RunnableConfig) -> list[AnyMessage]:
+    """Prepend the system prompt provided in the config to the messages."""
+    system_message = config.get("configurable", {}).get(SYSTEM_PROMPT_CONFIG_KEY)
+    messages = state["messages"]
+    return [system_message] + messages if system_message else messages
+
+
+def create_data_visualization_agent(models: AppChatModels) -> CompiledStateGraph:
+    """
+    Create the react agent used for data visualization, without any request specific values.
+
+    Args:
+        models (AppChatModels): The models to use for the agent.
+
+    Returns:
+        CompiledStateGraph: The compiled state graph for the agent.
+    """
+    return create_react_agent(
+        model=models.default_model,
+        tools=[create_python_repl_tool()],
+        prompt=_prompt_from_config,
+    )
 
 
 def get_data_visualization_agent(
@@ -14,22 +52,36 @@ def get_data_visualization_agent(
     """
     Very basic agent that can interact with a code interpreter.
 
+    The graph is compiled once per process; the system prompt and the REPL
+    of the request, shared with its other agents, are bound through the config.
+
     Args:
         models (AppChatModels): The models to use for the agent.
+        request (SalesReportRequest): The request the agent works on.
 
     Returns:
-        CompiledStateGraph: The compiled state graph for the agent.
+        CompiledStateGraph: The compiled agent bound to the request's configuration.
     """
+    temp_path = get_request_temp_dir(request)
     system_message = render_prompt_template(
         "data_visualization_agent_system_prompt.md",
         context={
-            "temp_path": str(get_request_temp_dir(request)),
+            "temp_path": str(temp_path),
+            "internal_data_file_name": INTERNAL_DATA.name,
+            "internal_data_variable": INTERNAL_DATA_VARIABLE,
+            "sales_cube_variable": SALES_CUBE_VARIABLE,
+            "dataset_profile": describe_dataset_profile(INTERNAL_DATA),
         },
         type=MessageTypes.SYSTEM,
     )
 
-    return create_react_agent(
-        model=models.default_model,
-        tools=[create_python_repl_tool()],
-        prompt=system_message,
+    agent: CompiledStateGraph = default_registry.get_or_create(
+        ("data_visualization_agent", models),
+        lambda: create_data_visualization_agent(models),
+    )
+    config = get_python_repl_config(
+        get_request_python_repl(request.task_id), output_dir=temp_path
     )
+    config["configurable"][SYSTEM_PROMPT_CONFIG_KEY] = system_message
+
+    return agent.with_config(config)
@@ -1,10 +1,16 @@
 from src.agents.code_agent_with_review import CodeAgentState, PreConfiguredCodeAgent
 from src.agents.models import AppChatModels
+from src.agents.tools.python_interpreter import (
+    INTERNAL_DATA_VARIABLE,
+    SALES_CUBE_VARIABLE,
+    get_request_python_repl,
+)
 from src.agents.utils.output_utils import get_request_temp_dir
 from src.agents.utils.prompt_utils import MessageTypes, render_prompt_template
 from src.configuration.constants import INTERNAL_DATA
 from src.configuration.db_models import SalesReportRequest
 from src.configuration.settings import app_settings
+from src.data_engine.dataset_profile import describe_dataset_profile
 
 
 def get_internal_data_agent(
@@ -27,6 +33,9 @@ def get_internal_data_agent(
             "internal_data_file_name": INTERNAL_DATA.name,
             "input_location": str(INTERNAL_DATA.path),
             "data_description": INTERNAL_DATA.description,
+            "internal_data_variable": INTERNAL_DATA_VARIABLE,
+            "sales_cube_variable": SALES_CUBE_VARIABLE,
+            "dataset_profile": describe_dataset_profile(INTERNAL_DATA),
             "temp_path": str(temp_path),
         },
         type=MessageTypes.SYSTEM,
@@ -38,6 +47,8 @@ def get_internal_data_agent(
             system_prompt=system_message,
         ),  # Default values for errors and iterations
         name="Internal Data Agent",
+        output_dir=temp_path,
+        python_repl=get_request_python_repl(request.task_id),
     )
 
     return agent
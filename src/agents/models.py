@@ -30,7 +30,8 @@ class AppChatModels:
         )
 
         azure_rate_limiter = InMemoryRateLimiter(
-            requests_per_second=10,  # Under max RPM (1K/min = ~16.6/sec)
+            # Shared by all Azure models, so concurrent requests are throttled together
+            requests_per_second=app_settings.azure_requests_per_second,
             check_every_n_seconds=0.2,  # Check every 200 ms
             max_bucket_size=10,  # Allow small bursts
         )
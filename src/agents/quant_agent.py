@@ -1,29 +1,51 @@
+from pathlib import Path
+
 from src.agents.code_agent_with_review import CodeAgentState, PreConfiguredCodeAgent
 from src.agents.models import AppChatModels
+from src.agents.tools.python_interpreter import (
+    INTERNAL_DATA_VARIABLE,
+    SALES_CUBE_VARIABLE,
+    PythonREPL,
+    get_request_python_repl,
+)
 from src.agents.utils.output_utils import get_request_temp_dir
 from src.agents.utils.prompt_utils import MessageTypes, render_prompt_template
+from src.configuration.constants import INTERNAL_DATA
 from src.configuration.db_models import SalesReportRequest
 from src.configuration.settings import app_settings
+from src.data_engine.dataset_profile import describe_dataset_profile
 
 
 def get_quantitative_agent(
-    models: AppChatModels, request: SalesReportRequest
+    models: AppChatModels,
+    request: SalesReportRequest,
+    python_repl: PythonREPL | None = None,
+    output_dir: Path | None = None,
 ) -> PreConfiguredCodeAgent:
     """
     Very basic agent that can interact with a code interpreter.
 
     Args:
         models (AppChatModels): The models to use for the agent.
+        request (SalesReportRequest): The request the agent works on.
+        python_repl (PythonREPL | None): The REPL to execute code in, the one
+            shared by the agents of the request if None.
+        output_dir (Path | None): The directory to save files in, the temporary
+            directory of the request if None.
 
     Returns:
         PreConfiguredCodeAgent: The configured agent for internal data retrieval.
     """
-    temp_path = get_request_temp_dir(request)
+    temp_path = output_dir or get_request_temp_dir(request)
     system_message = render_prompt_template(
         "quantitative_analyst_agent_system_prompt.md",
         context={
             "date": app_settings.analysis_date,
             "temp_path": str(temp_path),
+            "internal_data_file_name": INTERNAL_DATA.name,
+            "internal_data_variable": INTERNAL_DATA_VARIABLE,
+            "sales_cube_variable": SALES_CUBE_VARIABLE,
+            "dataset_profile": describe_dataset_profile(INTERNAL_DATA),
         },
         type=MessageTypes.SYSTEM,
     )
@@ -34,6 +56,8 @@ def get_quantitative_agent(
             system_prompt=system_message,
         ),  # Default values for errors and iterations
         name="Internal Data Agent",
+        output_dir=temp_path,
+        python_repl=python_repl or get_request_python_repl(request.task_id),
     )
 
     return agent
@@ -1,3 +1,4 @@
+import asyncio
 from enum import Enum
 from typing import Annotated, Literal
 from pydantic import BaseModel, Field
@@ -7,9 +8,12 @@ from langgraph.graph.message import add_messages
 from langgraph.types import Command
 
 from langchain_core.messages import AnyMessage, HumanMessage
+from langchain_core.runnables import Runnable
 
+from src.agents.code_agent_with_review import get_repl_dataframes_message
 from src.agents.models import default_models as models_client
 from src.agents.data_visualization_agent import get_data_visualization_agent
+from src.agents.tools.python_interpreter import get_request_python_repl
 from src.agents.utils.output_utils import (
     get_all_files_mentioned_in_response,
     get_all_temp_files,
@@ -21,6 +25,7 @@ from src.agents.utils.prompt_utils import (
     extract_graph_response_content,
     render_prompt_template,
 )
+from src.agents.utils.runnable_registry import default_registry
 from src.configuration.db_models import SalesReportRequest
 from src.configuration.logger import default_logger
 from src.configuration.settings import BASE_DIR
@@ -59,6 +64,40 @@ class GraphNodeNames(Enum):
     FILE_LOADING_AGENT = "file_loading_agent"
 
 
+NEXT_SPEAKER_OPTIONS = [
+    COMPLETE_VALUE,
+    GraphNodeNames.DATA_VISUALIZATION_AGENT.value,
+    GraphNodeNames.DOCUMENT_WRITING_AGENT.value,
+]
+
+
+class Router(BaseModel):
+    """Next speaker and task routing model.
+
+    Always fill the reasoning field with a brief explanation of why the next speaker was chosen.
+    Including the necessary changes to the report that trigger this choice.
+    """
+
+    reasoning: str = Field(
+        description="Reasoning for the next speaker choice. Explain why this speaker is chosen based on the current report state.",
+    )
+    next_speaker: str = Field(
+        description=f"The next speaker to handle the request. Choose from: {', '.join(NEXT_SPEAKER_OPTIONS)}; if the report is complete, use '{COMPLETE_VALUE}'",
+    )
+    next_speaker_task: str = Field(
+        description="The task to be performed by the next speaker. State the task as if you were talking directly to them, with as much detail as necessary.",
+    )
+
+
+def get_router_model() -> Runnable:
+    """Get the default model with the Router structured output, bound once per model."""
+    model = models_client.default_model
+    return default_registry.get_or_create(
+        ("structured_output", id(model), Router),
+        lambda: model.with_structured_output(Router),
+    )
+
+
 async def supervisor(
     state: ReportEditorGraphState,
 ) -> Command[Literal["__end__", "data_visualization_agent", "document_writing_agent"]]:
@@ -80,33 +119,8 @@ async def supervisor(
         type=MessageTypes.SYSTEM,
     )
 
-    next_speaker_options = [
-        COMPLETE_VALUE,
-        GraphNodeNames.DATA_VISUALIZATION_AGENT.value,
-        GraphNodeNames.DOCUMENT_WRITING_AGENT.value,
-    ]
-
-    class Router(BaseModel):
-        """Next speaker and task routing model.
-
-        Always fill the reasoning field with a brief explanation of why the next speaker was chosen.
-        Including the necessary changes to the report that trigger this choice.
-        """
-
-        reasoning: str = Field(
-            description="Reasoning for the next speaker choice. Explain why this speaker is chosen based on the current report state.",
-        )
-        next_speaker: str = Field(
-            description=f"The next speaker to handle the request. Choose from: {', '.join(next_speaker_options)}; if the report is complete, use '{COMPLETE_VALUE}'",
-        )
-        next_speaker_task: str = Field(
-            description="The task to be performed by the next speaker. State the task as if you were talking directly to them, with as much detail as necessary.",
-        )
-
     messages = [system_message] + state.messages + [state.current_report_message()]
-    response: Router = await models_client.default_model.with_structured_output(
-        Router
-    ).ainvoke(messages)
+    response: Router = await get_router_model().ainvoke(messages)
 
     goto = response.next_speaker
 
@@ -161,7 +175,12 @@ async def data_visualization_agent(
 
     # Call the data visualization agent to generate charts
     agent = get_data_visualization_agent(models_client, request=state.request)
-    response = await agent.ainvoke({"messages": state.messages})
+    # The agent shares the REPL of the request, so it can plot the dataframes already computed
+    repl_message = await asyncio.to_thread(
+        get_repl_dataframes_message, get_request_python_repl(state.request.task_id)
+    )
+    messages = [repl_message] + state.messages if repl_message else state.messages
+    response = await agent.ainvoke({"messages": messages})
 
     # Extract the content and files from the response
     response = extract_graph_response_content(response)
@@ -245,6 +264,24 @@ async def file_loading_agent(
 
 
 async def create_report_editor_graph(store_diagram: bool = False) -> CompiledStateGraph:
+    """
+    Get the report editor graph, compiling it only once per process.
+    """
+    chain: CompiledStateGraph = default_registry.get_or_create(
+        "report_editor_graph", compile_report_editor_graph
+    )
+
+    if store_diagram:
+        # Store the graph diagram as a PNG file
+        default_logger.info("Storing the report editor graph diagram as a PNG file.")
+        chain.get_graph().draw_mermaid_png(
+            output_file_path=(BASE_DIR / "documentation" / "report_editor_graph.png")
+        )
+
+    return chain
+
+
+def compile_report_editor_graph() -> CompiledStateGraph:
     """
     Create the report editor graph with the defined nodes and transitions.
     """
@@ -281,11 +318,4 @@ async def create_report_editor_graph(store_diagram: bool = False) -> CompiledSta
     chain = workflow.compile()
     default_logger.info("Report editor graph created successfully.")
 
-    if store_diagram:
-        # Store the graph diagram as a PNG file
-        default_logger.info("Storing the report editor graph diagram as a PNG file.")
-        chain.get_graph().draw_mermaid_png(
-            output_file_path=(BASE_DIR / "documentation" / "report_editor_graph.png")
-        )
-
     return chain
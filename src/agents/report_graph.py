@@ -1,6 +1,10 @@
+import asyncio
 from enum import Enum
+from pathlib import Path
 from typing import Literal
 from pydantic import BaseModel, Field
+from langchain_core.runnables import Runnable
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.state import CompiledStateGraph
 
@@ -12,7 +16,14 @@ from src.agents.report_editor_graph import (
     create_report_editor_graph,
 )
 from src.agents.research_graph import ResearchGraphState, create_research_graph
-from src.agents.utils.output_utils import get_sales_history_location
+from src.agents.tools.python_interpreter import PythonREPL, create_python_repl
+from src.agents.utils.output_utils import (
+    convert_markdown_to_pdf,
+    get_request_temp_dir,
+    get_sales_history_location,
+    move_file_to_storage,
+    store_response_with_timestamp,
+)
 from src.agents.utils.prompt_utils import (
     MessageTypes,
     create_human_message_from_parts,
@@ -20,10 +31,25 @@ from src.agents.utils.prompt_utils import (
     extract_graph_response_content,
     render_prompt_template,
 )
+from src.agents.utils.runnable_registry import default_registry
+from src.agents.utils.trajectory_replay import ainvoke_with_replay
 from src.configuration.constants import INTERNAL_DATA
 from src.configuration.db_models import SalesReportRequest
 from src.configuration.logger import default_logger
 from src.configuration.settings import BASE_DIR, app_settings
+from src.data_engine.grouped_sales import (
+    collect_sub_analysis_files,
+    describe_grouped_sales_history,
+    get_sales_summary_location,
+    get_sub_analysis_dir,
+    store_grouped_sales_history,
+    store_sub_analysis_histories,
+)
+from src.data_engine.operational_data import (
+    describe_operational_breakdowns,
+    store_operational_breakdowns,
+)
+from src.data_engine.sales_history import describe_sales_history, store_sales_history
 
 
 class SalesReportGraphState(BaseModel):
@@ -35,6 +61,7 @@ class SalesReportGraphState(BaseModel):
     special_case_reason: str = ""
     sales_in_depth_analysis: str = ""
     report: str = ""
+    report_pdf_path: str = ""
     email_template: str = ""
 
 
@@ -46,15 +73,69 @@ class GraphNodeNames(Enum):
     PROCESS_SPECIAL_CASE = "process_special_case"
     GENERATE_REPORT = "generate_report"
     GENERATE_EMAIL_TEMPLATE = "generate_email"
+    STORE_REPORT = "store_report"
+
+
+# Response format is a simple yes/no
+class ReviewResponse(BaseModel):
+    is_special_case: bool = Field(
+        description="Whether there is a special case to review; answer with True or False."
+    )
+    special_case_reason: str = Field(
+        description="Reason for the special case, providing context or explanation."
+    )
+
+
+def get_review_response_model() -> Runnable:
+    """Get the default model with the ReviewResponse structured output, bound once per model."""
+    model = models_client.default_model
+    return default_registry.get_or_create(
+        ("structured_output", id(model), ReviewResponse),
+        lambda: model.with_structured_output(ReviewResponse),
+    )
 
 
 async def retrieve_sales_history(state: SalesReportGraphState):
     """
-    First LLM call, retrieve the sales history for the last 3 years
-    from the database.
+    Retrieve the sales history for the last 3 years from the database.
+
+    The history is computed deterministically from the internal data; the
+    internal data agent is only used if that fails, e.g. if the data has an
+    unexpected format. The history of a request covering several grouping
+    values is extracted for all of them at once, with a summary per value.
     """
     default_logger.info(f"Retrieving sales history for {state.request.name}.")
     output_location = get_sales_history_location(state.request)
+    try:
+        if state.request.is_multi_value:
+            sales_history, summary = await asyncio.to_thread(
+                store_grouped_sales_history,
+                state.request,
+                app_settings.analysis_date,
+                output_location,
+            )
+            return {
+                "sales_history": describe_grouped_sales_history(
+                    state.request, sales_history, summary, output_location
+                ),
+            }
+        sales_history = await asyncio.to_thread(
+            store_sales_history,
+            state.request,
+            app_settings.analysis_date,
+            output_location,
+        )
+        return {
+            "sales_history": describe_sales_history(
+                state.request, sales_history, output_location
+            ),
+        }
+    except Exception as e:
+        default_logger.warning(
+            f"Could not compute the sales history for {state.request.name} "
+            f"directly, falling back to the internal data agent: {e}"
+        )
+
     task_prompt = render_prompt_template(
         template_name="retrieve_sales_step_prompt.md",
         context={
@@ -69,33 +150,148 @@ async def retrieve_sales_history(state: SalesReportGraphState):
     internal_data_agent = get_internal_data_agent(
         models=models_client, request=state.request
     )
-    response = await internal_data_agent.ainvoke(messages=[task_prompt])
-    internal_data_agent_response = extract_graph_response_content(response)
+    # The code of the previous run is replayed first, the agent only runs if it fails
+    internal_data_agent_response = await ainvoke_with_replay(
+        internal_data_agent,
+        messages=[task_prompt],
+        task_id=state.request.task_id,
+        node=GraphNodeNames.RETRIEVE_SALES_HISTORY.value,
+        output_dir=get_request_temp_dir(state.request),
+    )
     return {
         "sales_history": internal_data_agent_response,
     }
 
 
-async def process_sales_data(state: SalesReportGraphState):
+async def analyse_sales_history(
+    request: SalesReportRequest,
+    kpi_description: str,
+    input_location: Path,
+    python_repl: PythonREPL | None = None,
+    output_dir: Path | None = None,
+) -> str:
     """
-    Process the sales data retrieved from the database.
+    Have the quantitative agent analyse a sales history file, returning its analysis.
+
+    The agent saves its files in output_dir, the temporary directory of the
+    request if None.
+
+    The agent runs in the given REPL, or in a REPL of its own that is closed
+    afterwards: not in the REPL of the request, as the retrieval of the
+    operational data runs at the same time in it, and the agents would
+    overwrite each other's variables, e.g. df or sales.
     """
-    default_logger.info(f"Processing sales data for {state.request.name}.")
-    input_location = get_sales_history_location(state.request)
+    if python_repl is None:
+        python_repl = create_python_repl()
+        try:
+            return await analyse_sales_history(
+                request, kpi_description, input_location, python_repl, output_dir
+            )
+        finally:
+            await asyncio.to_thread(python_repl.close)
+
     task_prompt = render_prompt_template(
         template_name="analyse_sales_step_prompt.md",
         context={
             "date": app_settings.analysis_date,
-            "kpi_description": state.request.description,
+            "kpi_description": kpi_description,
             "input_location": str(input_location),
         },
         type=MessageTypes.HUMAN,
     )
 
-    quant_agent = get_quantitative_agent(models=models_client, request=state.request)
+    quant_agent = get_quantitative_agent(
+        models=models_client,
+        request=request,
+        python_repl=python_repl,
+        output_dir=output_dir,
+    )
     quant_agent_response = await quant_agent.ainvoke(messages=[task_prompt])
-    quant_agent_response_content = extract_graph_response_content(quant_agent_response)
-    return {"sales_analysis": quant_agent_response_content}
+    return extract_graph_response_content(quant_agent_response)
+
+
+async def process_sales_data(state: SalesReportGraphState):
+    """
+    Process the sales data retrieved from the database.
+    """
+    default_logger.info(f"Processing sales data for {state.request.name}.")
+    if state.request.is_multi_value:
+        return {"sales_analysis": await analyse_grouped_sales_history(state.request)}
+
+    sales_analysis = await analyse_sales_history(
+        state.request,
+        state.request.description,
+        get_sales_history_location(state.request),
+    )
+    return {"sales_analysis": sales_analysis}
+
+
+async def analyse_grouped_sales_history(request: SalesReportRequest) -> str:
+    """
+    Analyse the sales of a request covering several grouping values, map-reduce style.
+
+    The summary of every value was computed with the sales history; only the
+    values standing out in it, at most app_settings.grouped_report_max_sub_analyses,
+    get a sub-analysis of their own, with at most
+    app_settings.grouped_report_max_concurrency running at the same time. Each
+    sub-analysis runs in a REPL and a directory of its own, as the agents would
+    otherwise overwrite each other's variables and files; the files are then
+    moved next to the others, with the value as prefix of their names. The
+    sub-analyses are consolidated into the
+    analysis of the request; if the values can't be split, the history of all
+    of them is analysed at once instead.
+
+    See src/data_engine/grouped_sales.py.
+    """
+    input_location = get_sales_history_location(request)
+    try:
+        locations = await asyncio.to_thread(
+            store_sub_analysis_histories,
+            request,
+            input_location,
+            app_settings.grouped_report_max_sub_analyses,
+        )
+    except Exception as e:
+        default_logger.warning(
+            f"Could not split the sales history of {request.name} by "
+            f"{request.grouping.value}, analysing it at once: {e}"
+        )
+        return await analyse_sales_history(request, request.description, input_location)
+
+    semaphore = asyncio.Semaphore(app_settings.grouped_report_max_concurrency)
+
+    async def analyse_value(value: str, location: Path) -> str:
+        async with semaphore:
+            default_logger.info(f"Analysing the sales of {value} for {request.name}.")
+            value_request = request.model_copy(update={"grouping_value": value})
+            output_dir = get_sub_analysis_dir(value, input_location.parent)
+            analysis = await analyse_sales_history(
+                request, value_request.description, location, output_dir=output_dir
+            )
+            return await asyncio.to_thread(
+                collect_sub_analysis_files, value, analysis, output_dir
+            )
+
+    analyses = await asyncio.gather(
+        *(analyse_value(value, location) for value, location in locations.items()),
+        return_exceptions=True,
+    )
+
+    sections = [
+        f"The sales of every {request.grouping.value} of the request are summarized in "
+        f"{get_sales_summary_location(request, input_location.parent).name}. "
+        f"The {len(locations)} {request.grouping.value} "
+        "values standing out, by their sales or by their change from a year before, "
+        "were analysed in depth:"
+    ]
+    for (value, location), analysis in zip(locations.items(), analyses):
+        if isinstance(analysis, Exception):
+            default_logger.error(f"The analysis of {value} failed: {analysis}")
+            analysis = (
+                f"The in-depth analysis failed; its sales history is in {location.name}."
+            )
+        sections.append(f"## {value}\n\n{analysis}")
+    return "\n\n".join(sections)
 
 
 async def retrieve_operational_data(state: SalesReportGraphState):
@@ -116,8 +312,29 @@ async def retrieve_operational_data(state: SalesReportGraphState):
         },
         type=MessageTypes.HUMAN,
     )
+    text_parts = [
+        f"Output the operational data for the sales history of {state.request.grouping_value}.\n\n{task_message.content}"
+    ]
+    # The breakdowns are computed deterministically when possible, leaving the analysis to the agent
+    try:
+        output_dir = get_request_temp_dir(state.request)
+        breakdowns = await asyncio.to_thread(
+            store_operational_breakdowns,
+            state.request,
+            app_settings.analysis_date,
+            output_dir,
+        )
+        text_parts.append(
+            describe_operational_breakdowns(state.request, breakdowns, output_dir)
+        )
+    except Exception as e:
+        default_logger.warning(
+            f"Could not compute the operational breakdowns for {state.request.name} "
+            f"directly, the internal data agent will compute them: {e}"
+        )
+
     prompt = create_multimodal_prompt(
-        text_parts=f"Output the operational data for the sales history of {state.request.grouping_value}.\n\n{task_message.content}",
+        text_parts=text_parts,
         file_list=[get_sales_history_location(state.request)],
         human_message=task_message,
     )
@@ -128,8 +345,14 @@ async def retrieve_operational_data(state: SalesReportGraphState):
     # Increase max iterations to allow for more complex data retrieval
     internal_data_agent.update_max_iterations(50)
 
-    response = await internal_data_agent.ainvoke(messages=prompt.to_messages())
-    quant_agent_response = extract_graph_response_content(response)
+    # The code of the previous run is replayed first, the agent only runs if it fails
+    quant_agent_response = await ainvoke_with_replay(
+        internal_data_agent,
+        messages=prompt.to_messages(),
+        task_id=state.request.task_id,
+        node=GraphNodeNames.RETRIEVE_OPERATIONAL_DATA.value,
+        output_dir=get_request_temp_dir(state.request),
+    )
     return {
         "sales_operational_data": quant_agent_response,
     }
@@ -151,18 +374,7 @@ async def review_special_cases(
         type=MessageTypes.HUMAN,
     )
 
-    # Response format is a simple yes/no
-    class ReviewResponse(BaseModel):
-        is_special_case: bool = Field(
-            description="Whether there is a special case to review; answer with True or False."
-        )
-        special_case_reason: str = Field(
-            description="Reason for the special case, providing context or explanation."
-        )
-
-    structured_response_model = models_client.default_model.with_structured_output(
-        ReviewResponse
-    )
+    structured_response_model = get_review_response_model()
     response: ReviewResponse = await structured_response_model.ainvoke([task_prompt])
     return {
         "is_special_case": response.is_special_case,
@@ -276,17 +488,71 @@ async def generate_email_template(state: SalesReportGraphState):
     return {"email_template": response.content}
 
 
+async def store_report(state: SalesReportGraphState):
+    """
+    Store the report as a PDF in the storage directory.
+    """
+    default_logger.info(f"Storing the report for {state.request.name}.")
+    temp_dir = get_request_temp_dir(state.request)
+    md_file_path = store_response_with_timestamp(
+        response=state.report, folder=temp_dir, file_name=state.request.name
+    )
+
+    # PDF rendering is blocking, so run it in a thread to not stall other requests
+    pdf_path = await asyncio.to_thread(
+        convert_markdown_to_pdf, markdown_path=md_file_path, root_dir=temp_dir
+    )
+    pdf_path = move_file_to_storage(pdf_path)
+
+    return {"report_pdf_path": str(pdf_path)}
+
+
 async def create_report_graph(
     store_diagram: bool = False,
+    checkpointer: BaseCheckpointSaver | None = None,
 ) -> CompiledStateGraph[
     SalesReportGraphState, SalesReportGraphState, SalesReportGraphState
 ]:
     """
-    Create the state graph for the sales report generation.
+    Get the state graph for the sales report generation, compiling it only once per process.
 
     To be invokes with a request of type SalesReportRequest.
+
+    Args:
+        store_diagram (bool): Whether to store the graph diagram as a PNG file.
+        checkpointer (BaseCheckpointSaver | None): Optional checkpointer to persist
+            the state after each node (and in sub-graphs), so failed runs can be resumed.
+            If provided, a thread_id must be set in the config when invoking the graph.
+    """
+    chain: CompiledStateGraph = default_registry.get_or_create(
+        "report_graph", compile_report_graph
+    )
+
+    if checkpointer is not None:
+        # Copying the compiled graph is cheap, no need to recompile it
+        chain = chain.copy(update={"checkpointer": checkpointer})
+
+    if store_diagram:
+        # Store the graph diagram as a PNG file
+        default_logger.info("Storing the sales report graph diagram as a PNG file.")
+        chain.get_graph().draw_mermaid_png(
+            output_file_path=(BASE_DIR / "documentation" / "sales_report_graph.png")
+        )
+
+    return chain
+
+
+def compile_report_graph() -> CompiledStateGraph[
+    SalesReportGraphState, SalesReportGraphState, SalesReportGraphState
+]:
     """
+    Create the state graph for the sales report generation.
 
+    Steps that only depend on the same previous step run concurrently: the
+    analysis of the sales and the retrieval of the operational data both only
+    need the sales history, and are joined before the review of special cases;
+    the email template and the PDF of the report both only need the report.
+    """
     workflow = StateGraph(SalesReportGraphState)
 
     # Add all noted nodes to the graph
@@ -318,19 +584,27 @@ async def create_report_graph(
         GraphNodeNames.GENERATE_EMAIL_TEMPLATE.value,
         generate_email_template,
     )
+    workflow.add_node(
+        GraphNodeNames.STORE_REPORT.value,
+        store_report,
+    )
 
     # Add edges to connect the nodes
     workflow.add_edge(START, GraphNodeNames.RETRIEVE_SALES_HISTORY.value)
+    # Fan out after the sales history, and join before the review
     workflow.add_edge(
         GraphNodeNames.RETRIEVE_SALES_HISTORY.value,
         GraphNodeNames.PROCESS_SALES_DATA.value,
     )
     workflow.add_edge(
-        GraphNodeNames.PROCESS_SALES_DATA.value,
+        GraphNodeNames.RETRIEVE_SALES_HISTORY.value,
         GraphNodeNames.RETRIEVE_OPERATIONAL_DATA.value,
     )
     workflow.add_edge(
-        GraphNodeNames.RETRIEVE_OPERATIONAL_DATA.value,
+        [
+            GraphNodeNames.PROCESS_SALES_DATA.value,
+            GraphNodeNames.RETRIEVE_OPERATIONAL_DATA.value,
+        ],
         GraphNodeNames.REVIEW_SPECIAL_CASE.value,
     )
     workflow.add_conditional_edges(
@@ -340,19 +614,16 @@ async def create_report_graph(
         GraphNodeNames.PROCESS_SPECIAL_CASE.value,
         GraphNodeNames.GENERATE_REPORT.value,
     )
+    # Fan out after the report
     workflow.add_edge(
         GraphNodeNames.GENERATE_REPORT.value,
         GraphNodeNames.GENERATE_EMAIL_TEMPLATE.value,
     )
+    workflow.add_edge(
+        GraphNodeNames.GENERATE_REPORT.value,
+        GraphNodeNames.STORE_REPORT.value,
+    )
     workflow.add_edge(GraphNodeNames.GENERATE_EMAIL_TEMPLATE.value, END)
+    workflow.add_edge(GraphNodeNames.STORE_REPORT.value, END)
 
-    chain = workflow.compile()
-
-    if store_diagram:
-        # Store the graph diagram as a PNG file
-        default_logger.info("Storing the sales report graph diagram as a PNG file.")
-        chain.get_graph().draw_mermaid_png(
-            output_file_path=(BASE_DIR / "documentation" / "sales_report_graph.png")
-        )
-
-    return chain
+    return workflow.compile()
@@ -6,6 +6,7 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.graph.message import add_messages
 from langchain_core.messages import AnyMessage, HumanMessage
+from langchain_core.runnables import Runnable
 
 from src.agents.models import default_models as models_client
 from src.agents.internal_data_agent import get_internal_data_agent
@@ -14,6 +15,7 @@ from src.agents.utils.prompt_utils import (
     MessageTypes,
     render_prompt_template,
 )
+from src.agents.utils.runnable_registry import default_registry
 from src.configuration.db_models import SalesReportRequest
 from src.configuration.logger import default_logger
 
@@ -84,6 +86,15 @@ class ProgressLedger(BaseModel):
     )
 
 
+def get_progress_ledger_model() -> Runnable:
+    """Get the default model with the ProgressLedger structured output, bound once per model."""
+    model = models_client.default_model
+    return default_registry.get_or_create(
+        ("structured_output", id(model), ProgressLedger),
+        lambda: model.with_structured_output(ProgressLedger),
+    )
+
+
 class ResearchGraphState(BaseModel):
     """
     Internal state model for the research Agent's graph.
@@ -240,9 +251,7 @@ async def update_progress_ledger(state: ResearchGraphState):
     )
     progress_ledger_context = state.messages + [task_message]
 
-    structured_response_model = models_client.default_model.with_structured_output(
-        ProgressLedger
-    )
+    structured_response_model = get_progress_ledger_model()
     response: ProgressLedger = await structured_response_model.ainvoke(
         progress_ledger_context
     )
@@ -375,6 +384,16 @@ async def evaluate_progress_ledger(
 
 
 async def create_research_graph() -> CompiledStateGraph[ResearchGraphState]:
+    """
+    Get the research graph, compiling it only once per process.
+    """
+    return default_registry.get_or_create("research_graph", compile_research_graph)
+
+
+def compile_research_graph() -> CompiledStateGraph[ResearchGraphState]:
+    """
+    Create the research graph with the defined nodes and transitions.
+    """
     workflow = StateGraph(ResearchGraphState)
 
     workflow.add_node(
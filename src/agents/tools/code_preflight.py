@@ -0,0 +1,380 @@
+"""
+Static checks of the code of the python tool, before it is executed.
+
+Errors were only found after executing the code, and each one cost an
+execution, a code review by a model and another turn of the agent, even for
+mistakes like a typo in a column name. The most common of them are found
+from the syntax tree of the code instead, and returned at once with a precise
+message, without executing the code nor reviewing it:
+
+- syntax errors,
+- names that are not defined in the REPL, by the code or as builtins,
+- columns that are not in the dataframes of the REPL, e.g. the internal data,
+- files written at absolute paths outside the directory of the outputs of
+  the request.
+
+The checks are lenient: code they can't analyse, e.g. using exec or paths
+built at runtime, is executed as before.
+"""
+
+import ast
+import builtins
+import difflib
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+from src.agents.tools.execution_result import ExecutionResult
+
+# Start of the tool output for code that failed the checks, and was not executed
+PREFLIGHT_ERROR_PREFIX = "The code was not executed, a check before running it failed"
+# Functions making the names of the code impossible to know statically
+DYNAMIC_NAMESPACE_FUNCTIONS = {"exec", "eval", "globals", "locals", "vars", "__import__"}
+# Methods writing a file given as first argument, or as the object for Path methods
+WRITE_METHODS = {
+    "to_csv",
+    "to_parquet",
+    "to_excel",
+    "to_json",
+    "to_pickle",
+    "to_html",
+    "to_markdown",
+    "savefig",
+}
+PATH_WRITE_METHODS = {"write_text", "write_bytes", "touch", "mkdir"}
+# Methods taking column names as their first argument or by keyword
+COLUMN_METHODS = {"groupby": "by", "sort_values": "by", "pivot_table": "values"}
+# Methods changing the columns of a dataframe without inplace=True
+MUTATING_METHODS = {"insert", "pop", "assign", "update"}
+# Functions a dataframe can be given to without being changed
+READ_ONLY_FUNCTIONS = {"print", "len", "display", "repr", "str", "type", "isinstance"}
+
+
+@dataclass
+class PreflightContext:
+    """
+    What the code can use in its REPL.
+
+    Attributes:
+        defined_names: The names of the namespace of the REPL.
+        columns: The columns of each dataframe of the namespace.
+    """
+
+    defined_names: set[str] = field(default_factory=set)
+    columns: dict[str, set[str]] = field(default_factory=dict)
+
+
+def get_known_columns(dataframe: pd.DataFrame) -> set[str]:
+    """
+    Names the code can use as columns of a dataframe: its columns and the
+    levels of its index, as groupby and sort_values also accept those.
+    """
+    index_names = {name for name in dataframe.index.names if isinstance(name, str)}
+    return set(dataframe.columns) | index_names
+
+
+def get_preflight_context(*namespaces: dict) -> PreflightContext:
+    """Get the context of the checks from the namespaces of a REPL."""
+    context = PreflightContext()
+    for namespace in namespaces:
+        for name, value in namespace.items():
+            context.defined_names.add(name)
+            # Only simple columns, e.g. not the levels of pivoted dataframes
+            if isinstance(value, pd.DataFrame) and all(
+                isinstance(column, str) for column in value.columns
+            ):
+                context.columns[name] = get_known_columns(value)
+            else:
+                context.columns.pop(name, None)
+    return context
+
+
+def format_preflight_error(error_type: str, message: str) -> ExecutionResult:
+    """Result of code that failed a check, and was not executed."""
+    return ExecutionResult(
+        error_type=error_type,
+        error=f"{PREFLIGHT_ERROR_PREFIX}:\n{error_type}: {message}",
+        executed=False,
+    )
+
+
+def is_preflight_error(output: str) -> bool:
+    """Whether the output of the python tool comes from a failed check."""
+    return output.startswith(PREFLIGHT_ERROR_PREFIX)
+
+
+def _suggest(value: str, candidates: set[str]) -> str:
+    matches = difflib.get_close_matches(value, candidates, n=3, cutoff=0.6)
+    return f" Did you mean: {', '.join(matches)}?" if matches else ""
+
+
+def get_bound_names(tree: ast.AST) -> set[str]:
+    """Names the code binds anywhere: assignments, imports, definitions and arguments."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _is_dynamic(tree: ast.AST) -> bool:
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in DYNAMIC_NAMESPACE_FUNCTIONS:
+            return True
+        if isinstance(node, ast.ImportFrom) and any(
+            alias.name == "*" for alias in node.names
+        ):
+            return True
+    return False
+
+
+def check_undefined_names(
+    tree: ast.AST, context: PreflightContext, bound_names: set[str]
+) -> ExecutionResult | None:
+    """Find a name the code reads that is defined nowhere."""
+    defined_names = context.defined_names | bound_names | set(dir(builtins))
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Name)
+            and isinstance(node.ctx, ast.Load)
+            and node.id not in defined_names
+        ):
+            return format_preflight_error(
+                "NameError",
+                f"name '{node.id}' is not defined (line {node.lineno})."
+                + _suggest(node.id, context.defined_names | bound_names),
+            )
+    return None
+
+
+def _get_column_names(node: ast.AST) -> list[str]:
+    """Column names given as a literal string or list of strings."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, (ast.List, ast.Tuple)) and all(
+        isinstance(item, ast.Constant) and isinstance(item.value, str)
+        for item in node.elts
+    ):
+        return [item.value for item in node.elts]
+    return []
+
+
+def get_changed_dataframes(tree: ast.AST, names: set[str]) -> set[str]:
+    """
+    Names of the dataframes whose columns the code may change other than by
+    assigning a column given as a literal, e.g. df["NEW"] = ...
+
+    That is any other assignment to the dataframe or its attributes, e.g.
+    df.columns = [...] or df.loc[:, "NEW"] = ..., a method changing it, e.g.
+    df.insert(...) or df.rename(..., inplace=True), and any other use of the
+    dataframe than taking its items or attributes, e.g. alias = df or f(df),
+    as the code may change it through the alias or the function.
+    """
+    parents = {
+        child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)
+    }
+    changed = set()
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Name) and node.id in names):
+            continue
+        parent = parents.get(node)
+        if isinstance(parent, ast.Subscript) and parent.value is node:
+            if isinstance(parent.ctx, ast.Store) and not _get_column_names(
+                parent.slice
+            ):
+                changed.add(node.id)
+            continue
+        if isinstance(parent, ast.Attribute) and parent.value is node:
+            call = parents.get(parent)
+            if isinstance(parent.ctx, (ast.Store, ast.Del)):
+                changed.add(node.id)
+            elif isinstance(call, ast.Call) and call.func is parent:
+                # Any inplace value but a literal False, e.g. inplace=True
+                is_inplace = any(
+                    item.arg == "inplace"
+                    and getattr(item.value, "value", None) is not False
+                    for item in call.keywords
+                )
+                if is_inplace or parent.attr in MUTATING_METHODS:
+                    changed.add(node.id)
+            elif isinstance(call, ast.Subscript) and isinstance(
+                call.ctx, (ast.Store, ast.Del)
+            ):
+                # e.g. df.loc[:, "NEW"] = ...
+                changed.add(node.id)
+            continue
+        if (
+            isinstance(parent, ast.Call)
+            and getattr(parent.func, "id", None) in READ_ONLY_FUNCTIONS
+        ):
+            continue
+        changed.add(node.id)
+    return changed
+
+
+def check_missing_columns(
+    tree: ast.AST, context: PreflightContext, bound_names: set[str]
+) -> ExecutionResult | None:
+    """
+    Find a column the code reads from a dataframe of the REPL that the dataframe
+    doesn't have, e.g. internal_data_df["SALES"] or internal_data_df.groupby("CITY").
+
+    Columns the code assigns, e.g. df["NEW"] = ..., are added before checking.
+    Dataframes the code binds again or changes in any other way are not
+    checked, see get_changed_dataframes: the check must not reject valid code.
+    """
+    candidates = set(context.columns) - bound_names
+    changed = get_changed_dataframes(tree, candidates)
+    columns = {
+        name: set(context.columns[name]) for name in candidates - changed
+    }
+    if not columns:
+        return None
+
+    references: list[tuple[str, str, int]] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+            name = node.value.id
+            if name not in columns:
+                continue
+            if isinstance(node.ctx, ast.Store):
+                columns[name].update(_get_column_names(node.slice))
+            else:
+                references += [
+                    (name, column, node.lineno)
+                    for column in _get_column_names(node.slice)
+                ]
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and isinstance(node.func.value, ast.Name)
+            and node.func.value.id in columns
+            and node.func.attr in COLUMN_METHODS
+        ):
+            keyword = COLUMN_METHODS[node.func.attr]
+            arguments = node.args[:1] + [
+                item.value for item in node.keywords if item.arg == keyword
+            ]
+            references += [
+                (node.func.value.id, column, node.lineno)
+                for argument in arguments
+                for column in _get_column_names(argument)
+            ]
+
+    for name, column, lineno in references:
+        if column not in columns[name]:
+            return format_preflight_error(
+                "KeyError",
+                f"'{column}' is not a column of {name} (line {lineno})."
+                + _suggest(column, columns[name]),
+            )
+    return None
+
+
+def _get_literal_path(node: ast.AST | None) -> Path | None:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return Path(node.value)
+    if (
+        isinstance(node, ast.Call)
+        and getattr(node.func, "id", None) == "Path"
+        and len(node.args) == 1
+    ):
+        return _get_literal_path(node.args[0])
+    return None
+
+
+def _get_written_path(node: ast.Call) -> Path | None:
+    """Path of the file written by a call, if it writes one given as a literal."""
+    function = node.func
+    name = (
+        function.attr
+        if isinstance(function, ast.Attribute)
+        else getattr(function, "id", None)
+    )
+    if name in PATH_WRITE_METHODS and isinstance(function, ast.Attribute):
+        return _get_literal_path(function.value)
+    if name in WRITE_METHODS and node.args:
+        return _get_literal_path(node.args[0])
+    if name == "open" and node.args:
+        mode = node.args[1] if len(node.args) > 1 else None
+        mode = next((item.value for item in node.keywords if item.arg == "mode"), mode)
+        if (
+            isinstance(mode, ast.Constant)
+            and isinstance(mode.value, str)
+            and set(mode.value) & set("wax+")
+        ):
+            return _get_literal_path(node.args[0])
+    return None
+
+
+def check_writes(tree: ast.AST, output_dir: Path) -> ExecutionResult | None:
+    """Find an absolute path the code writes to outside the directory of the outputs."""
+    output_dir = output_dir.resolve()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        path = _get_written_path(node)
+        # Relative paths depend on the working directory of the REPL, so they pass
+        if (
+            path is not None
+            and path.is_absolute()
+            and not path.resolve().is_relative_to(output_dir)
+        ):
+            return format_preflight_error(
+                "PermissionError",
+                f"'{path}' is outside of the directory for the files of this "
+                f"request (line {node.lineno}); save files in {output_dir}.",
+            )
+    return None
+
+
+def check_code(
+    code: str,
+    context: PreflightContext | None = None,
+    output_dir: Path | None = None,
+) -> ExecutionResult | None:
+    """
+    Check code before executing it in a REPL.
+
+    Args:
+        code (str): The sanitized code.
+        context (PreflightContext | None): The names and dataframes of the REPL;
+            only the syntax and the writes are checked if None.
+        output_dir (Path | None): The only directory the code may write files in;
+            writes are not checked if None.
+
+    Returns:
+        ExecutionResult | None: The result to return instead of executing the
+            code, None if no check failed.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = f"\n{e.text.rstrip()}" if e.text else ""
+        return format_preflight_error("SyntaxError", f"{e.msg} (line {e.lineno}){line}")
+
+    if context is not None and not _is_dynamic(tree):
+        bound_names = get_bound_names(tree)
+        error = check_undefined_names(tree, context, bound_names)
+        error = error or check_missing_columns(tree, context, bound_names)
+        if error:
+            return error
+    if output_dir is not None:
+        return check_writes(tree, output_dir)
+    return None
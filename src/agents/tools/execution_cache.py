@@ -0,0 +1,558 @@
+"""
+Opt-in memoization of the executions of the python tool.
+
+After retries and resets, agents often run the same code again on the same
+data, e.g. loading a csv file or computing the same groupby. When
+app_settings.repl_memoize is enabled, each execution is keyed by:
+
+- the code, normalized so formatting and comments don't matter,
+- the hash of each file the code reads,
+- a fingerprint of each variable of the namespace the code uses,
+- the analysis date, as the code often filters the data relative to it.
+
+When the key was already executed, the stored output is returned, and the
+variables and files the execution produced are restored, instead of running
+the code again. Entries are stored on disk, so they are shared by the kernel
+processes and across runs.
+
+Only executions whose effects can be captured are memoized: executions that
+fail, read or write files through paths that are not literals, use variables
+that can't be fingerprinted (e.g. functions defined in the REPL), modify the
+variables they use in place, produce variables that can't be pickled, call
+functions whose result changes from one run to the next (e.g. datetime.now or
+random numbers), or change the state of modules, which is not restored (e.g.
+the current figure of matplotlib.pyplot, or pd.set_option) are always executed.
+
+The size of each entry and of the whole cache is limited, by
+app_settings.repl_memoize_max_entry_mb and repl_memoize_max_size_mb; the
+least recently used entries are removed when the cache is over its limit.
+"""
+
+import ast
+import builtins
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import pickle
+import shutil
+import uuid
+from pathlib import Path
+from threading import Lock
+from types import ModuleType
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from src.agents.tools.execution_result import ExecutionResult
+from src.agents.tools.namespace_memory import get_value_size
+from src.configuration.logger import default_logger
+from src.configuration.settings import CACHE_DIR, app_settings
+from src.data_engine.parquet_cache import get_file_hash
+from src.data_engine.shared_data import get_shared_data_fingerprint
+
+EXECUTION_CACHE_DIR = CACHE_DIR / "executions"
+OUTPUT_FILE_NAME = "output.txt"
+VARIABLES_FILE_NAME = "variables.pkl"
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Functions and methods reading or writing files, whose path must be a literal
+FILE_FUNCTIONS = {
+    "open",
+    "read_csv",
+    "read_parquet",
+    "read_excel",
+    "read_json",
+    "read_pickle",
+    "read_text",
+    "read_bytes",
+    "to_csv",
+    "to_parquet",
+    "to_excel",
+    "to_json",
+    "to_pickle",
+    "write_text",
+    "write_bytes",
+    "savefig",
+}
+# Methods of Path, which read or write the file of the object
+PATH_METHODS = {"read_text", "read_bytes", "write_text", "write_bytes"}
+# Functions returning a different result on each call, e.g. date.today()
+NONDETERMINISTIC_FUNCTIONS = {
+    "today",
+    "now",
+    "utcnow",
+    "time",
+    "time_ns",
+    "perf_counter",
+    "uuid1",
+    "uuid4",
+    "urandom",
+    "default_rng",
+    "sample",
+}
+# Modules whose functions all return random values, e.g. np.random.normal
+NONDETERMINISTIC_MODULES = {"random", "secrets"}
+# Libraries keeping state between calls, e.g. the current figure of pyplot
+STATEFUL_MODULES = {"matplotlib", "seaborn", "plotly", "random"}
+# Functions and methods changing the state of a library, e.g. DataFrame.plot
+# drawing on the current figure of pyplot
+STATEFUL_FUNCTIONS = {
+    "plot",
+    "hist",
+    "boxplot",
+    "set_option",
+    "reset_option",
+    "seed",
+    "seterr",
+}
+# Values of simple types are fingerprinted by their repr up to this length
+MAX_REPR_LENGTH = 10_000
+
+_file_hashes: dict[tuple[str, int, int], str] = {}
+_file_hashes_lock = Lock()
+
+
+class UncacheableError(Exception):
+    """The effects of an execution can't be captured, so it is not memoized."""
+
+
+def normalize_code(code: str) -> str:
+    """Normalize code, ignoring formatting and comments; stripped if it is not valid."""
+    try:
+        return ast.dump(ast.parse(code))
+    except SyntaxError:
+        return code.strip()
+
+
+def get_cached_file_hash(path: Path) -> str:
+    """Hash of a file, computed again only when its size or modification time changes."""
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if key not in _file_hashes:
+            _file_hashes[key] = get_file_hash(path)
+        return _file_hashes[key]
+
+
+def get_file_paths(tree: ast.AST) -> list[Path]:
+    """
+    Paths of the files the code may read or write, from its string literals.
+
+    Raises:
+        UncacheableError: If a file function gets a path that is not a literal.
+    """
+    paths = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            if 0 < len(node.value) < 4096 and "\n" not in node.value:
+                paths.add(Path(node.value))
+        elif isinstance(node, ast.Call):
+            function = node.func
+            name = (
+                function.attr
+                if isinstance(function, ast.Attribute)
+                else getattr(function, "id", None)
+            )
+            if name not in FILE_FUNCTIONS:
+                continue
+            if name in PATH_METHODS and isinstance(function, ast.Attribute):
+                # e.g. Path("data.csv").read_text(), the path is the object
+                path_argument = function.value
+            else:
+                arguments = [*node.args, *(keyword.value for keyword in node.keywords)]
+                path_argument = arguments[0] if arguments else None
+            if not _is_literal_path(path_argument):
+                raise UncacheableError(f"{name} gets a path that is not a literal.")
+    return sorted(paths)
+
+
+def _is_literal_path(node: ast.AST | None) -> bool:
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, str)
+    if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "Path":
+        return all(_is_literal_path(argument) for argument in node.args)
+    return False
+
+
+def check_deterministic(tree: ast.AST) -> None:
+    """
+    Check that the code only calls functions returning the same result on each run.
+
+    Raises:
+        UncacheableError: If the code calls a function like datetime.now, or
+            uses a module of random numbers.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in NONDETERMINISTIC_MODULES:
+            raise UncacheableError(f"The code uses {node.id}.")
+        if isinstance(node, ast.Attribute) and node.attr in NONDETERMINISTIC_MODULES:
+            raise UncacheableError(f"The code uses {node.attr}.")
+        if isinstance(node, ast.Call):
+            function = node.func
+            name = (
+                function.attr
+                if isinstance(function, ast.Attribute)
+                else getattr(function, "id", None)
+            )
+            if name in NONDETERMINISTIC_FUNCTIONS:
+                raise UncacheableError(f"The result of {name} changes on each run.")
+
+
+def _get_root_name(node: ast.AST) -> str | None:
+    """Name an attribute or subscript is taken from, e.g. plt for plt.gca().lines."""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def get_module_names(tree: ast.AST, namespaces: tuple[dict, dict]) -> dict[str, str]:
+    """Names bound to modules, in the namespaces or by the code, with their module."""
+    module_names = {
+        name: value.__name__
+        for namespace in namespaces
+        for name, value in namespace.items()
+        if isinstance(value, ModuleType)
+    }
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                module_names[alias.asname or alias.name.split(".")[0]] = (
+                    alias.name if alias.asname else alias.name.split(".")[0]
+                )
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            for alias in node.names:
+                module_names[alias.asname or alias.name] = (
+                    f"{node.module}.{alias.name}"
+                )
+    return module_names
+
+
+def check_module_state(tree: ast.AST, namespaces: tuple[dict, dict]) -> None:
+    """
+    Check that the code does not change the state of modules, as only the
+    variables and files an execution produces are restored.
+
+    Raises:
+        UncacheableError: If the code uses a library keeping state between
+            calls, calls a function changing the state of a library, or
+            assigns an attribute or item of a module.
+    """
+    module_names = get_module_names(tree, namespaces)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            function = node.func
+            name = (
+                function.attr
+                if isinstance(function, ast.Attribute)
+                else getattr(function, "id", None)
+            )
+            if name in STATEFUL_FUNCTIONS:
+                raise UncacheableError(f"{name} changes the state of a library.")
+            module = module_names.get(_get_root_name(function), "")
+            if module.split(".")[0] in STATEFUL_MODULES:
+                raise UncacheableError(f"{module} keeps state between executions.")
+        elif (
+            isinstance(node, (ast.Attribute, ast.Subscript))
+            and isinstance(node.ctx, (ast.Store, ast.Del))
+            and _get_root_name(node) in module_names
+        ):
+            raise UncacheableError("The code changes the state of a module.")
+
+
+def get_loaded_names(tree: ast.AST) -> set[str]:
+    """Names the code reads."""
+    return {
+        node.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+    }
+
+
+def fingerprint(value) -> str:
+    """
+    Fingerprint of a value, identical for equal values.
+
+    Raises:
+        UncacheableError: If the value can't be fingerprinted.
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        representation = repr(value)
+        if len(representation) > MAX_REPR_LENGTH:
+            return hashlib.sha256(representation.encode()).hexdigest()
+        return representation
+    if isinstance(value, ModuleType):
+        return f"module:{value.__name__}"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = list(map(fingerprint, value))
+        if isinstance(value, (set, frozenset)):
+            items.sort()
+        return f"{type(value).__name__}:[{','.join(items)}]"
+    if isinstance(value, dict):
+        return "dict:{" + ",".join(
+            f"{fingerprint(key)}={fingerprint(item)}" for key, item in value.items()
+        ) + "}"
+    if isinstance(value, pd.DataFrame):
+        # e.g. the preloaded internal data, too large to hash on each execution
+        shared_data_fingerprint = get_shared_data_fingerprint(value)
+        if shared_data_fingerprint is not None:
+            return shared_data_fingerprint
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        if len(value) > app_settings.repl_memoize_max_rows:
+            raise UncacheableError("The dataframe is too large to fingerprint.")
+        content_hash = hashlib.sha256(
+            pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes()
+        )
+        if isinstance(value, pd.DataFrame):
+            content_hash.update(repr(list(value.columns)).encode())
+            content_hash.update(repr(list(value.dtypes.astype(str))).encode())
+        else:
+            content_hash.update(repr((value.name, str(value.dtype))).encode())
+        return f"{type(value).__name__}:{content_hash.hexdigest()}"
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        content_hash = hashlib.sha256(np.ascontiguousarray(value).tobytes())
+        return f"ndarray:{value.dtype}:{value.shape}:{content_hash.hexdigest()}"
+    # Functions and classes of installed libraries, e.g. the print of the REPL
+    module = getattr(value, "__module__", None)
+    qualified_name = getattr(value, "__qualname__", None)
+    if callable(value) and module and qualified_name and module != "builtins":
+        if importlib.util.find_spec(module.split(".")[0]) is not None:
+            return f"callable:{module}.{qualified_name}"
+    if getattr(builtins, str(qualified_name), None) is value:
+        return f"builtin:{qualified_name}"
+    raise UncacheableError(f"A {type(value).__name__} can't be fingerprinted.")
+
+
+def _get_variable(namespaces: tuple[dict, dict], name: str):
+    globals_, locals_ = namespaces
+    if name in locals_:
+        return True, locals_[name]
+    if name in globals_:
+        return True, globals_[name]
+    return False, None
+
+
+def _serialize_variable(value):
+    """Modules are stored by name, as they can't be pickled."""
+    if isinstance(value, ModuleType):
+        return ("module", value.__name__)
+    return ("value", value)
+
+
+def _deserialize_variable(serialized):
+    kind, value = serialized
+    return importlib.import_module(value) if kind == "module" else value
+
+
+class ExecutionCache:
+    """Stored outputs and effects of executions, see the module docstring."""
+
+    def __init__(self, cache_dir: Path = EXECUTION_CACHE_DIR):
+        self._cache_dir = cache_dir
+
+    def _get_entry_path(self, key: str) -> Path:
+        return self._cache_dir / key[:2] / key
+
+    def get_key(
+        self, code: str, namespaces: tuple[dict, dict]
+    ) -> tuple[str, list[Path], dict[str, str]]:
+        """
+        Key of an execution, with the files it may use and the fingerprints of
+        the variables it reads.
+
+        Raises:
+            UncacheableError: If the execution can't be memoized.
+        """
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            raise UncacheableError("The code is not valid.") from e
+
+        check_deterministic(tree)
+        check_module_state(tree, namespaces)
+        key = hashlib.sha256(normalize_code(code).encode())
+        key.update(app_settings.analysis_date.isoformat().encode())
+        paths = get_file_paths(tree)
+        for path in paths:
+            if path.is_file():
+                key.update(f"{path.resolve()}:{get_cached_file_hash(path)}".encode())
+
+        fingerprints = {}
+        for name in sorted(get_loaded_names(tree)):
+            exists, value = _get_variable(namespaces, name)
+            if exists:
+                fingerprints[name] = fingerprint(value)
+                key.update(f"{name}={fingerprints[name]}".encode())
+        return key.hexdigest(), paths, fingerprints
+
+    def load(self, key: str, namespaces: tuple[dict, dict]) -> str | None:
+        """Restore the effects of a stored execution and return its output, if stored."""
+        entry_path = self._get_entry_path(key)
+        manifest_path = entry_path / MANIFEST_FILE_NAME
+        if not manifest_path.exists():
+            return None
+        try:
+            manifest = json.loads(manifest_path.read_text())
+            with open(entry_path / VARIABLES_FILE_NAME, "rb") as file:
+                variables = pickle.load(file)
+            for index, path in enumerate(manifest["files"]):
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(entry_path / f"file_{index}", path)
+            # The time of the last use, for the eviction of the least recently used
+            os.utime(manifest_path)
+        except Exception as e:
+            default_logger.warning(f"Could not restore a memoized execution: {str(e)}")
+            return None
+
+        globals_, locals_ = namespaces
+        for name, serialized in variables["locals"].items():
+            locals_[name] = _deserialize_variable(serialized)
+        for name, serialized in variables["globals"].items():
+            globals_[name] = _deserialize_variable(serialized)
+        return (entry_path / OUTPUT_FILE_NAME).read_text()
+
+    def store(
+        self,
+        key: str,
+        output: str,
+        variables: dict[str, dict],
+        written_files: list[Path],
+    ) -> None:
+        """Store the output and effects of an execution under its key."""
+        entry_path = self._get_entry_path(key)
+        build_path = entry_path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+        build_path.mkdir(parents=True)
+        try:
+            with open(build_path / VARIABLES_FILE_NAME, "wb") as file:
+                pickle.dump(
+                    {
+                        scope: {
+                            name: _serialize_variable(value)
+                            for name, value in scope_variables.items()
+                        }
+                        for scope, scope_variables in variables.items()
+                    },
+                    file,
+                )
+            for index, path in enumerate(written_files):
+                shutil.copy2(path, build_path / f"file_{index}")
+            (build_path / OUTPUT_FILE_NAME).write_text(output)
+            (build_path / MANIFEST_FILE_NAME).write_text(
+                json.dumps({"files": [str(path) for path in written_files]})
+            )
+            shutil.rmtree(entry_path, ignore_errors=True)
+            build_path.rename(entry_path)
+        except Exception as e:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise UncacheableError(f"The effects can't be stored: {str(e)}") from e
+
+    def evict(self, max_bytes: int) -> None:
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for entry_path in self._cache_dir.glob("*/*"):
+            manifest_path = entry_path / MANIFEST_FILE_NAME
+            # Entries being stored are in .tmp directories
+            if entry_path.suffix == ".tmp" or not manifest_path.exists():
+                continue
+            try:
+                size = sum(path.stat().st_size for path in entry_path.iterdir())
+                entries.append((manifest_path.stat().st_mtime_ns, size, entry_path))
+            except FileNotFoundError:
+                # Removed by another process in the meantime
+                continue
+
+        cache_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if cache_size <= max_bytes:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            cache_size -= size
+
+    def run(
+        self,
+        code: str,
+        namespaces: tuple[dict, dict],
+        execute: Callable[[str], ExecutionResult],
+    ) -> ExecutionResult:
+        """
+        Run code through the cache.
+
+        Args:
+            code (str): The code to run.
+            namespaces (tuple[dict, dict]): The globals and locals of the REPL.
+            execute (Callable[[str], ExecutionResult]): Executes the code in the
+                namespaces.
+
+        Returns:
+            ExecutionResult: The result of the execution, stored or new.
+        """
+        try:
+            key, paths, fingerprints = self.get_key(code, namespaces)
+        except UncacheableError as e:
+            default_logger.debug(f"Execution not memoized: {str(e)}")
+            return execute(code)
+
+        output = self.load(key, namespaces)
+        if output is not None:
+            default_logger.debug("Restored a memoized execution.")
+            return ExecutionResult(output=output)
+
+        globals_, locals_ = namespaces
+        identities = {
+            "globals": {name: id(value) for name, value in globals_.items()},
+            "locals": {name: id(value) for name, value in locals_.items()},
+        }
+        modification_times = {
+            path: path.stat().st_mtime_ns for path in paths if path.is_file()
+        }
+        result = execute(code)
+        if not result.succeeded:
+            return result
+
+        try:
+            for name, value_fingerprint in fingerprints.items():
+                value = _get_variable(namespaces, name)[1]
+                if fingerprint(value) != value_fingerprint:
+                    raise UncacheableError(f"{name} was modified in place.")
+            variables = {
+                scope: {
+                    name: value
+                    for name, value in namespace.items()
+                    if not name.startswith("__")
+                    and identities[scope].get(name) != id(value)
+                }
+                for scope, namespace in (("globals", globals_), ("locals", locals_))
+            }
+            written_files = [
+                path
+                for path in paths
+                if path.is_file()
+                and path.stat().st_mtime_ns != modification_times.get(path)
+            ]
+            entry_size = sum(
+                get_value_size(value)
+                for scope_variables in variables.values()
+                for value in scope_variables.values()
+            ) + sum(path.stat().st_size for path in written_files)
+            if entry_size > app_settings.repl_memoize_max_entry_mb * 2**20:
+                raise UncacheableError("The effects are too large to store.")
+            self.store(key, result.output, variables, written_files)
+            self.evict(app_settings.repl_memoize_max_size_mb * 2**20)
+        except UncacheableError as e:
+            default_logger.debug(f"Execution not memoized: {str(e)}")
+        return result
+
+
+_execution_cache: ExecutionCache | None = None
+_execution_cache_lock = Lock()
+
+
+def get_execution_cache() -> ExecutionCache:
+    """Execution cache shared by the REPLs of the process."""
+    global _execution_cache
+    with _execution_cache_lock:
+        if _execution_cache is None:
+            _execution_cache = ExecutionCache()
+        return _execution_cache
@@ -0,0 +1,85 @@
+"""
+Structured result of an execution of the python tool.
+
+The output sent to the model stays text, but the code agent used to find
+errors by searching it for "Error" or "Exception", so printing a column named
+Error_rate counted as a failure, and every failure went through a code review
+by a model. The result is returned as the artifact of the tool message
+instead, with the type of the exception and where it happened, so the agent
+can tell mechanical failures (e.g. a missing column) from ones worth a review.
+"""
+
+import traceback
+
+from pydantic import BaseModel, Field
+
+# File name given to the code in tracebacks, see CustomPythonREPL
+CODE_FILE_NAME = "<string>"
+
+
+class ExecutionResult(BaseModel):
+    """
+    Result of an execution.
+
+    Attributes:
+        output: The standard output of the execution.
+        error_type: Name of the exception raised, None if the execution succeeded.
+        error: Representation of the exception, as shown to the model.
+        error_line: Line of the code where the exception was raised.
+        error_code: Text of that line.
+        files: Files created or modified by the execution.
+        executed: False if the code was not run, e.g. it failed a check before.
+    """
+
+    output: str = ""
+    error_type: str | None = None
+    error: str | None = None
+    error_line: int | None = None
+    error_code: str | None = None
+    files: list[str] = Field(default_factory=list)
+    executed: bool = True
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error_type is None
+
+    @classmethod
+    def from_exception(
+        cls, output: str, exception: BaseException, code: str = "", error: str = ""
+    ) -> "ExecutionResult":
+        """
+        Result of an execution that raised an exception.
+
+        Args:
+            output (str): The output before the exception.
+            exception (BaseException): The exception raised.
+            code (str): The code executed, to get the line of the exception.
+            error (str): Text shown instead of the representation of the exception.
+        """
+        error_line = getattr(exception, "lineno", None) if isinstance(
+            exception, SyntaxError
+        ) else None
+        for frame in traceback.extract_tb(exception.__traceback__):
+            if frame.filename == CODE_FILE_NAME:
+                error_line = frame.lineno
+        lines = code.splitlines()
+        error_code = (
+            lines[error_line - 1].strip()
+            if error_line is not None and 0 < error_line <= len(lines)
+            else None
+        )
+        return cls(
+            output=output,
+            error_type=type(exception).__name__,
+            error=error or repr(exception),
+            error_line=error_line,
+            error_code=error_code,
+        )
+
+    def to_text(self) -> str:
+        """The output shown to the model: the standard output, then the error."""
+        if self.error is None:
+            return self.output
+        if not self.executed:
+            return self.error
+        return f"{self.output}\n{self.error}"
@@ -0,0 +1,276 @@
+"""
+Memory governance of the variables of a REPL namespace.
+
+The namespace of a REPL kept every dataframe the agent created for the life of
+the REPL, so a long run, e.g. 50 iterations of retrieve_operational_data, could
+hold gigabytes of intermediate results the agent would never use again. The
+locals of a REPL are a NamespaceLocals instead, which tracks the memory of each
+variable and when the code last used it. After an execution, if the variables
+use more than app_settings.repl_namespace_max_memory_mb, the least recently
+used dataframes, largest first, are spilled to Parquet files and removed from
+memory. A spilled variable is reloaded transparently when the code uses it
+again, and the agent is told what was spilled in the output of the execution.
+
+A value bound to several names, e.g. after b = a, is counted once and never
+spilled: spilling one of the names would not free its memory, and reloading it
+would give a copy, so changes made through the other name would be lost.
+
+Only the locals are governed: the preloaded data in the globals is shared and
+read-only, see src/data_engine/shared_data.py.
+"""
+
+import ast
+import shutil
+import sys
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Hashable
+
+import numpy as np
+import pandas as pd
+
+from src.agents.tools.code_preflight import get_known_columns
+from src.configuration.logger import default_logger
+from src.configuration.settings import TEMP_DIR
+
+# Spilled variables of each REPL are saved in a directory of their own in here
+SPILL_DIR = TEMP_DIR / ".namespaces"
+# Column of the dataframe a Series is saved as
+SERIES_COLUMN = "value"
+# Variables listed when reporting the memory of the namespace to the agent
+MEMORY_REPORT_MAX_VARIABLES = 5
+
+
+def get_value_size(value) -> int:
+    """Approximate memory used by a value, in bytes."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(value, pd.DataFrame) else int(usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+def format_size(size: int) -> str:
+    """Size in bytes as MB, e.g. 12.3 MB."""
+    return f"{size / 2**20:.1f} MB"
+
+
+def get_used_names(code: str) -> set[str]:
+    """Names the code reads, assigns or deletes; empty if it is not valid."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return set()
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+
+
+@dataclass
+class SpilledVariable:
+    """
+    A variable moved out of memory to a Parquet file.
+
+    Attributes:
+        path: The Parquet file holding the value.
+        size: Memory the value used, in bytes.
+        columns: The columns of the value, for the checks of code before it runs.
+        is_series: Whether the value is a Series, saved as a one column dataframe.
+        series_name: The name of the Series.
+    """
+
+    path: Path
+    size: int
+    columns: set[str] = field(default_factory=set)
+    is_series: bool = False
+    series_name: Hashable = None
+
+
+class NamespaceLocals(dict):
+    """
+    Locals of a REPL, tracking the memory of each variable and reloading the
+    variables spilled to disk when the code uses them, see the module docstring.
+
+    exec looks up names in a dict subclass through __getitem__, so a spilled
+    variable goes through __missing__ and is loaded back on first use.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spilled: dict[str, SpilledVariable] = {}
+        self._spill_dir: Path | None = None
+        self._executions = 0
+        self._last_used: dict[str, int] = {}
+        # Size of each variable, computed again only when it is used or replaced
+        self._sizes: dict[str, tuple[int, int]] = {}
+
+    def __missing__(self, name: str):
+        spilled = self.spilled.pop(name, None)
+        if spilled is None:
+            raise KeyError(name)
+        value = pd.read_parquet(spilled.path)
+        if spilled.is_series:
+            value = value.iloc[:, 0].rename(spilled.series_name)
+        spilled.path.unlink(missing_ok=True)
+        super().__setitem__(name, value)
+        self._last_used[name] = self._executions
+        default_logger.debug(f"Reloaded the spilled variable {name}.")
+        return value
+
+    def __contains__(self, name) -> bool:
+        return super().__contains__(name) or name in self.spilled
+
+    def __setitem__(self, name: str, value) -> None:
+        self._discard_spilled(name)
+        super().__setitem__(name, value)
+
+    def __delitem__(self, name: str) -> None:
+        if self._discard_spilled(name):
+            return
+        super().__delitem__(name)
+
+    def _discard_spilled(self, name: str) -> bool:
+        spilled = self.spilled.pop(name, None)
+        if spilled is not None:
+            spilled.path.unlink(missing_ok=True)
+        return spilled is not None
+
+    def clear(self) -> None:
+        super().clear()
+        self.spilled.clear()
+        self._last_used.clear()
+        self._sizes.clear()
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def get_sizes(self, used_names: set[str] = frozenset()) -> dict[str, int]:
+        """
+        Memory used by each variable in memory, in bytes.
+
+        Args:
+            used_names (set[str]): Names used by the last execution, whose size
+                may have changed even if the variable was not replaced.
+        """
+        sizes = {}
+        for name, value in dict.items(self):
+            if name.startswith("__"):
+                continue
+            size_id, size = self._sizes.get(name, (None, 0))
+            if size_id != id(value) or name in used_names:
+                size = get_value_size(value)
+                self._sizes[name] = (id(value), size)
+            sizes[name] = size
+        for name in set(self._sizes) - set(sizes):
+            del self._sizes[name]
+        return sizes
+
+    def _spill(self, name: str, size: int) -> bool:
+        """Move a dataframe or series to a Parquet file; False if it can't be saved."""
+        value = dict.__getitem__(self, name)
+        if not isinstance(value, (pd.DataFrame, pd.Series)):
+            return False
+        # Parquet turns other column names into strings, so they would not load back
+        if isinstance(value, pd.DataFrame) and not (
+            value.columns.is_unique
+            and all(isinstance(column, str) for column in value.columns)
+        ):
+            return False
+        if self._spill_dir is None:
+            self._spill_dir = SPILL_DIR / uuid.uuid4().hex
+        self._spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self._spill_dir / f"{uuid.uuid4().hex}.parquet"
+        is_series = isinstance(value, pd.Series)
+        try:
+            (value.to_frame(SERIES_COLUMN) if is_series else value).to_parquet(path)
+        except Exception as e:
+            # e.g. columns holding objects of mixed types
+            default_logger.debug(f"Could not spill the variable {name}: {str(e)}")
+            path.unlink(missing_ok=True)
+            return False
+
+        columns = set() if is_series else get_known_columns(value)
+        super().__delitem__(name)
+        self.spilled[name] = SpilledVariable(
+            path, size, columns, is_series, value.name if is_series else None
+        )
+        return True
+
+    def enforce_budget(self, used_names: set[str], max_bytes: int) -> str:
+        """
+        Record the names an execution used, and spill the least recently used
+        dataframes, largest first, while the variables use more than max_bytes.
+
+        Args:
+            used_names (set[str]): Names used by the execution.
+            max_bytes (int): Memory the variables may use.
+
+        Returns:
+            str: Report of the memory of the namespace for the agent, empty if
+                it is within the budget.
+        """
+        self._executions += 1
+        for name in used_names:
+            self._last_used[name] = self._executions
+        sizes = self.get_sizes(used_names)
+        total_size = self.get_total_size(sizes)
+        if total_size <= max_bytes:
+            return ""
+
+        names_per_value = Counter(id(dict.__getitem__(self, name)) for name in sizes)
+        spilled = []
+        candidates = sorted(
+            (
+                name
+                for name in sizes
+                if name not in used_names
+                and names_per_value[id(dict.__getitem__(self, name))] == 1
+            ),
+            key=lambda name: (self._last_used.get(name, 0), -sizes[name]),
+        )
+        for name in candidates:
+            if total_size <= max_bytes:
+                break
+            if self._spill(name, sizes[name]):
+                total_size -= sizes.pop(name)
+                spilled.append(name)
+        return self.describe_memory(sizes, spilled, max_bytes)
+
+    def get_total_size(self, sizes: dict[str, int]) -> int:
+        """Memory used by the variables, counting a value bound to several names once."""
+        sizes_per_value = {
+            id(dict.__getitem__(self, name)): size for name, size in sizes.items()
+        }
+        return sum(sizes_per_value.values())
+
+    def describe_memory(
+        self, sizes: dict[str, int], spilled: list[str], max_bytes: int
+    ) -> str:
+        """Report of the memory used by the variables, and of the ones spilled."""
+        largest = sorted(sizes.items(), key=lambda item: -item[1])
+        lines = [
+            f"Memory: the variables use {format_size(self.get_total_size(sizes))}, "
+            f"the budget is {format_size(max_bytes)}."
+        ]
+        if spilled:
+            lines.append(
+                "Spilled to disk, reloaded automatically when used: "
+                + ", ".join(
+                    f"{name} ({format_size(self.spilled[name].size)})"
+                    for name in spilled
+                )
+                + "."
+            )
+        else:
+            lines.append(
+                "Nothing could be spilled to disk; delete variables you no longer need."
+            )
+        lines.append(
+            "Largest variables in memory: "
+            + ", ".join(
+                f"{name} ({format_size(size)})"
+                for name, size in largest[:MEMORY_REPORT_MAX_VARIABLES]
+            )
+            + "."
+        )
+        return "\n".join(lines)
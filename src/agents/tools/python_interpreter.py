@@ -1,17 +1,115 @@
+import asyncio
 import re
 import sys
+from contextvars import ContextVar
 from io import StringIO
+from threading import Lock
+from pathlib import Path
 from typing import Dict, Optional
 
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 from pydantic import BaseModel, Field
+from langchain_core.runnables import RunnableConfig, ensure_config
 from langchain_core.tools import Tool
 
+from src.agents.tools.code_preflight import (
+    PreflightContext,
+    check_code,
+    get_preflight_context,
+)
+from src.agents.tools.execution_cache import get_execution_cache
+from src.agents.tools.execution_result import ExecutionResult
+from src.agents.tools.namespace_memory import NamespaceLocals, get_used_names
+from src.agents.tools.python_kernel import KernelPythonREPL
+from src.agents.tools.repl_output import limit_output, summarizing_print
+from src.configuration.settings import app_settings
+from src.data_engine.shared_data import get_repl_data, get_repl_sales_cube
+
+# Key under config["configurable"] holding the REPL to use for a given run
+PYTHON_REPL_CONFIG_KEY = "python_repl"
+# Key under config["configurable"] holding the directory for outputs too long to return
+PYTHON_REPL_OUTPUT_DIR_CONFIG_KEY = "python_repl_output_dir"
+# Name of the variable holding the internal data in the REPL namespace
+INTERNAL_DATA_VARIABLE = "internal_data_df"
+# Name of the variable holding the sales cube, see src/data_engine/sales_cube.py
+SALES_CUBE_VARIABLE = "sales_cube_df"
+
+
+# Buffer capturing the output of the execution running in the current thread or task
+_execution_output: ContextVar[StringIO | None] = ContextVar(
+    "execution_output", default=None
+)
+_stdout_lock = Lock()
+
+
+class ExecutionStdout:
+    """
+    Replacement of sys.stdout sending what is written during an execution to the
+    buffer of that execution, and everything else to the original stdout.
+
+    Swapping sys.stdout for each execution is not safe when agents run code
+    concurrently, in threads or asyncio tasks: their outputs would be mixed, and
+    output of unrelated code (e.g. console logs) captured. Instead, sys.stdout is
+    replaced once, and each write goes to the buffer of the current context.
+    """
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+
+    def _get_target(self):
+        output = _execution_output.get()
+        return self._stdout if output is None else output
+
+    def write(self, text: str) -> int:
+        return self._get_target().write(text)
+
+    def flush(self) -> None:
+        self._get_target().flush()
+
+    def __getattr__(self, name: str):
+        # Everything else, e.g. encoding or fileno, comes from the original stdout
+        return getattr(self._stdout, name)
+
+
+def install_execution_stdout() -> None:
+    """Replace sys.stdout by an ExecutionStdout, unless it already is one."""
+    with _stdout_lock:
+        if not isinstance(sys.stdout, ExecutionStdout):
+            sys.stdout = ExecutionStdout(sys.stdout)
+
+
+def create_repl_namespace() -> Dict:
+    """
+    Create the initial namespace of a REPL, with the standard imports, the
+    internal data and its sales cube already loaded, so agents don't spend a
+    tool call on them. print summarizes large dataframes (see
+    src/agents/tools/repl_output.py).
+
+    Returns:
+        Dict: The globals for a new REPL.
+    """
+    namespace = {"pd": pd, "np": np, "plt": plt, "print": summarizing_print}
+    internal_data = get_repl_data()
+    if internal_data is not None:
+        namespace[INTERNAL_DATA_VARIABLE] = internal_data
+    sales_cube = get_repl_sales_cube()
+    if sales_cube is not None:
+        namespace[SALES_CUBE_VARIABLE] = sales_cube
+    return namespace
+
 
 class CustomPythonREPL(BaseModel):
     """Simulates a standalone Python REPL."""
 
-    globals: Optional[Dict] = Field(default_factory=dict, alias="_globals")
-    locals: Optional[Dict] = Field(default_factory=dict, alias="_locals")
+    globals: Optional[Dict] = Field(
+        default_factory=create_repl_namespace, alias="_globals"
+    )
+    # Spills stale dataframes to disk over a memory budget, see src/agents/tools/namespace_memory.py
+    locals: Optional[Dict] = Field(default_factory=NamespaceLocals, alias="_locals")
+    # Reuse the output of code already executed, see src/agents/tools/execution_cache.py
+    memoize: bool = Field(default_factory=lambda: app_settings.repl_memoize)
 
     @staticmethod
     def sanitize_input(query: str) -> str:
@@ -32,34 +130,280 @@ class CustomPythonREPL(BaseModel):
         query = re.sub(r"(\s|`)*$", "", query)
         return query
 
-    def run(self, command: str) -> str:
-        """Run command and return output including errors, without multiprocessing."""
+    def execute(self, command: str) -> ExecutionResult:
+        """
+        Execute command and return its result, without multiprocessing.
 
-        old_stdout = sys.stdout
-        sys.stdout = mystdout = StringIO()
+        Only the output of this execution is captured, even if other code runs
+        at the same time in other threads or tasks (see ExecutionStdout). With
+        memoize, code already executed on the same data is not executed again.
+        """
+        cleaned_command = self.sanitize_input(command)
+        if self.memoize:
+            return get_execution_cache().run(
+                cleaned_command, (self.globals, self.locals), self._execute
+            )
+        return self._execute(cleaned_command)
 
+    def _execute(self, command: str) -> ExecutionResult:
+        install_execution_stdout()
+        output = StringIO()
+        token = _execution_output.set(output)
         try:
-            cleaned_command = self.sanitize_input(command)
-            exec(cleaned_command, self.globals, self.locals)
+            exec(command, self.globals, self.locals)
         except Exception as e:
-            output = mystdout.getvalue()
-            sys.stdout = old_stdout
-            return output + f"\n{repr(e)}"
+            result = ExecutionResult.from_exception(output.getvalue(), e, command)
         else:
-            output = mystdout.getvalue()
-            sys.stdout = old_stdout
-            return output
+            result = ExecutionResult(output=output.getvalue())
+        finally:
+            _execution_output.reset(token)
+        return self._enforce_memory_budget(command, result)
+
+    def _enforce_memory_budget(
+        self, command: str, result: ExecutionResult
+    ) -> ExecutionResult:
+        """Spill stale variables over the memory budget, reporting it in the output."""
+        max_memory_mb = app_settings.repl_namespace_max_memory_mb
+        if not max_memory_mb or not isinstance(self.locals, NamespaceLocals):
+            return result
+        report = self.locals.enforce_budget(
+            get_used_names(command), max_memory_mb * 2**20
+        )
+        if not report:
+            return result
+        return result.model_copy(update={"output": f"{result.output}{report}\n"})
+
+    async def aexecute(self, command: str) -> ExecutionResult:
+        """Execute command in a thread, so the event loop is not blocked while it runs."""
+        return await asyncio.to_thread(self.execute, command)
+
+    def run(self, command: str) -> str:
+        """Run command and return output including errors, without multiprocessing."""
+        return self.execute(command).to_text()
+
+    async def arun(self, command: str) -> str:
+        """Run command in a thread, so the event loop is not blocked while it runs."""
+        return await asyncio.to_thread(self.run, command)
+
+    def get_preflight_context(self) -> PreflightContext:
+        """Names and dataframes of the namespace, see src/agents/tools/code_preflight.py."""
+        context = get_preflight_context(self.globals, self.locals)
+        # Spilled variables are still defined, they are reloaded when used
+        for name, spilled in getattr(self.locals, "spilled", {}).items():
+            context.defined_names.add(name)
+            if spilled.columns:
+                context.columns[name] = spilled.columns
+        return context
+
+    def close(self) -> None:
+        """Free the variables defined in the REPL."""
+        self.locals.clear()
+
+
+PythonREPL = CustomPythonREPL | KernelPythonREPL
+
+
+def create_python_repl() -> PythonREPL:
+    """
+    Create a REPL for an agent.
+
+    The code runs in a kernel process of its own (see src/agents/tools/python_kernel.py),
+    with a timeout and a memory cap, unless app_settings.repl_isolated_kernels is False.
+    """
+    if app_settings.repl_isolated_kernels:
+        return KernelPythonREPL()
+    return CustomPythonREPL()
+
+
+# REPL of each request in progress, by task_id, see get_request_python_repl
+_request_python_repls: dict[str, PythonREPL] = {}
+_request_python_repls_lock = Lock()
+
+
+def get_request_python_repl(task_id: str) -> PythonREPL:
+    """
+    Get the REPL of a request, creating it on first use.
+
+    Every agent working on the request executes code in the same REPL, so the
+    dataframes an agent computes stay in memory for the next one instead of
+    being written to a file and parsed again; files are only kept as outputs.
+    The REPL is not meant for agents running at the same time, e.g. in
+    concurrent steps of the report graph: their variables would overwrite each
+    other's, and a CustomPythonREPL would even execute their code in the same
+    namespace from several threads. Such agents get a REPL of their own from
+    create_python_repl.
+
+    Args:
+        task_id (str): The task_id of the request.
+
+    Returns:
+        PythonREPL: The REPL of the request, until close_request_python_repl is called.
+    """
+    with _request_python_repls_lock:
+        python_repl = _request_python_repls.get(task_id)
+        if python_repl is None:
+            python_repl = _request_python_repls[task_id] = create_python_repl()
+        return python_repl
+
+
+def close_request_python_repl(task_id: str) -> None:
+    """Stop the REPL of a request once it is done, freeing its kernel and variables."""
+    with _request_python_repls_lock:
+        python_repl = _request_python_repls.pop(task_id, None)
+    if python_repl is not None:
+        python_repl.close()
+
+
+def describe_repl_dataframes(python_repl: PythonREPL) -> str:
+    """
+    Describe the dataframes defined in a REPL besides the preloaded data, e.g.
+    by the previous agents of a request.
+
+    Returns:
+        str: One line per dataframe with its columns, empty if there are none
+            or the REPL can't provide them.
+    """
+    context = python_repl.get_preflight_context()
+    if context is None:
+        return ""
+    return "\n".join(
+        f"- `{name}`: {', '.join(sorted(columns))}"
+        for name, columns in sorted(context.columns.items())
+        if name not in (INTERNAL_DATA_VARIABLE, SALES_CUBE_VARIABLE)
+    )
+
+
+def get_python_repl_config(
+    python_repl: PythonREPL, output_dir: Path | None = None
+) -> RunnableConfig:
+    """
+    Create the config that routes the python tool calls of a run to a given REPL.
+
+    Args:
+        python_repl (PythonREPL): The REPL the run should execute code in.
+        output_dir (Path | None): Directory where outputs too long to return are
+            saved, e.g. the temp dir of the request; TEMP_DIR if None.
+
+    Returns:
+        RunnableConfig: Config to merge into the graph invocation config.
+    """
+    # A "configurable" key replaces the one of the calling graph instead of merging,
+    # so keep its values (e.g. the checkpointer) to still run as its sub-graph
+    configurable = ensure_config().get("configurable", {})
+    return {
+        "configurable": {
+            **configurable,
+            PYTHON_REPL_CONFIG_KEY: python_repl,
+            PYTHON_REPL_OUTPUT_DIR_CONFIG_KEY: output_dir,
+        }
+    }
+
+
+def check_command(
+    python_repl: PythonREPL, command: str, output_dir: Path | None
+) -> ExecutionResult | None:
+    """
+    Check a command before running it in a REPL, see src/agents/tools/code_preflight.py.
+
+    Args:
+        python_repl (PythonREPL): The REPL the command would run in.
+        command (str): The command, as written by the agent.
+        output_dir (Path | None): The directory for the files of the request,
+            the only one the command may write in; writes are not checked if None.
+
+    Returns:
+        ExecutionResult | None: The result to return instead of running the
+            command, None if the checks passed or are disabled.
+    """
+    if not app_settings.repl_preflight_checks:
+        return None
+    return check_code(
+        CustomPythonREPL.sanitize_input(command),
+        python_repl.get_preflight_context(),
+        output_dir,
+    )
+
+
+def get_file_versions(directory: Path | None) -> dict[str, int]:
+    """Modification time of each file of a directory, to find the files an execution produced."""
+    if directory is None or not directory.is_dir():
+        return {}
+    return {
+        str(path): path.stat().st_mtime_ns
+        for path in directory.rglob("*")
+        if path.is_file()
+    }
+
+
+def complete_result(
+    result: ExecutionResult, output_dir: Path | None, file_versions: dict[str, int]
+) -> tuple[str, ExecutionResult]:
+    """
+    Add the files produced to the result of an execution, and cut its output.
+
+    Returns:
+        tuple[str, ExecutionResult]: The content of the tool message, and the
+            result as its artifact.
+    """
+    files = [
+        path
+        for path, version in get_file_versions(output_dir).items()
+        if file_versions.get(path) != version
+    ]
+    result = result.model_copy(
+        update={"output": limit_output(result.output, output_dir), "files": files}
+    )
+    return result.to_text(), result
 
 
 def create_python_repl_tool() -> Tool:
     """
     Create a tool for executing Python code in a REPL environment.
 
+    The tool can be shared by compiled graphs: it executes code in the REPL
+    provided in the run config (see get_python_repl_config), and only falls back
+    to its own REPL when none is provided. When invoked asynchronously, the code
+    runs without blocking the event loop, in a kernel process by default (see
+    create_python_repl). Code failing the checks of check_command is not run,
+    and long outputs are cut, see limit_output.
+
+    The tool message holds the output as text, and its artifact the
+    ExecutionResult, see src/agents/tools/execution_result.py.
+
     Returns:
         Tool: A tool that can execute Python commands.
     """
 
-    python_repl = CustomPythonREPL()
+    default_python_repl = create_python_repl()
+
+    def get_python_repl(config: RunnableConfig | None) -> tuple[PythonREPL, Path | None]:
+        configurable = (config or {}).get("configurable", {})
+        return (
+            configurable.get(PYTHON_REPL_CONFIG_KEY, default_python_repl),
+            configurable.get(PYTHON_REPL_OUTPUT_DIR_CONFIG_KEY),
+        )
+
+    def run(command: str, config: RunnableConfig) -> tuple[str, ExecutionResult]:
+        python_repl, output_dir = get_python_repl(config)
+        file_versions = get_file_versions(output_dir)
+        result = check_command(python_repl, command, output_dir)
+        if result is None:
+            result = python_repl.execute(command)
+        return complete_result(result, output_dir, file_versions)
+
+    async def arun(command: str, config: RunnableConfig) -> tuple[str, ExecutionResult]:
+        python_repl, output_dir = get_python_repl(config)
+        file_versions = await asyncio.to_thread(get_file_versions, output_dir)
+        # Getting the names of a kernel waits for its previous execution
+        result = await asyncio.to_thread(
+            check_command, python_repl, command, output_dir
+        )
+        if result is None:
+            result = await python_repl.aexecute(command)
+        return await asyncio.to_thread(
+            complete_result, result, output_dir, file_versions
+        )
+
     return Tool(
         name="python_repl",
         description=(
@@ -67,5 +411,7 @@ def create_python_repl_tool() -> Tool:
             "Input should be a valid python command. If you want to see the output of a value, "
             "you should print it out with `print(...)`."
         ),
-        func=python_repl.run,
+        func=run,
+        coroutine=arun,
+        response_format="content_and_artifact",
     )
@@ -0,0 +1,353 @@
+"""
+Python kernels running in their own processes, for the code tool.
+
+Code written by the LLM used to run with exec in the agent process, so an
+infinite loop or a runaway cross join blocked the event loop, and with it
+every report running concurrently. Each kernel is instead a separate process
+running a CustomPythonREPL, with pandas, numpy, matplotlib and the internal
+data already loaded. Executions have a timeout and a memory cap: a kernel
+going over either is killed, and the REPL that used it continues in a fresh
+kernel, so only the agent that wrote the code is affected.
+
+Kernels are started ahead of time by a pool, so a new REPL doesn't wait for
+the imports and the data to load. Before starting them, the pool prepares the
+data in the agent process: the kernels memory-map a single copy of it, and find
+the sales cube already built, see src/data_engine/shared_data.py.
+"""
+
+import asyncio
+import atexit
+import multiprocessing
+import time
+import weakref
+from collections import deque
+from multiprocessing.connection import Connection
+from threading import Lock
+from typing import Any
+
+import psutil
+
+from src.agents.tools.code_preflight import PreflightContext
+from src.agents.tools.execution_result import ExecutionResult
+from src.configuration.logger import default_logger
+from src.configuration.settings import app_settings
+from src.data_engine.shared_data import prepare_shared_data
+
+# Interval between checks of the time and memory used by an execution
+POLL_INTERVAL_SECONDS = 0.05
+# Message sent by a kernel once its namespace is ready
+KERNEL_READY = "__kernel_ready__"
+# Message asking a kernel for the context of the checks of code before it runs
+KERNEL_PREFLIGHT_CONTEXT = "__kernel_preflight_context__"
+PREFLIGHT_CONTEXT_TIMEOUT_SECONDS = 10
+
+# Spawned rather than forked, as the agents run in a multi-threaded process
+_kernel_context = multiprocessing.get_context("spawn")
+
+
+def _kernel_main(connection: Connection) -> None:
+    """
+    Loop of a kernel process: execute each command received and send back its
+    result, or the context of the checks of code before it runs.
+    """
+    # Imported here, so the REPL namespace (and the data) is only loaded in the kernel
+    from src.agents.tools.python_interpreter import CustomPythonREPL
+
+    python_repl = CustomPythonREPL()
+    connection.send(KERNEL_READY)
+    while True:
+        try:
+            command = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if command == KERNEL_PREFLIGHT_CONTEXT:
+            connection.send(python_repl.get_preflight_context())
+        else:
+            connection.send(python_repl.execute(command))
+
+
+class KernelError(RuntimeError):
+    """The kernel stopped during an execution: it was killed or it crashed."""
+
+
+class PythonKernel:
+    """A Python process executing commands one at a time, with limits on each execution."""
+
+    def __init__(self):
+        self._connection, kernel_connection = _kernel_context.Pipe()
+        self._process = _kernel_context.Process(
+            target=_kernel_main, args=(kernel_connection,), daemon=True
+        )
+        self._process.start()
+        kernel_connection.close()
+        self._ready = False
+        # Executions are serialized, e.g. for parallel tool calls of the same agent
+        self._lock = Lock()
+
+    @property
+    def pid(self) -> int | None:
+        return self._process.pid
+
+    def is_alive(self) -> bool:
+        return self._process.is_alive()
+
+    def kill(self) -> None:
+        """Stop the kernel, e.g. to interrupt a running execution."""
+        if self._process.is_alive():
+            self._process.kill()
+        self._process.join(timeout=5)
+        self._connection.close()
+
+    def _get_memory_usage(self) -> int:
+        """
+        Resident memory of the kernel, in bytes, without the pages of mapped files.
+
+        The pages of the memory-mapped internal data are in the OS cache, shared
+        by the kernels and reclaimable, so they don't count towards the limit.
+        """
+        try:
+            memory = psutil.Process(self._process.pid).memory_info()
+        except psutil.Error:
+            return 0
+        # shared, the file-backed and shared memory pages, is only known on Linux
+        return memory.rss - getattr(memory, "shared", 0)
+
+    def _receive(self, timeout: float, max_memory_bytes: int | None) -> Any:
+        """
+        Wait for the next message of the kernel, killing it if it goes over the limits.
+
+        Raises:
+            TimeoutError: If no message arrives before the timeout.
+            MemoryError: If the kernel uses more than max_memory_bytes.
+            KernelError: If the kernel stops before sending a message.
+        """
+        deadline = time.monotonic() + timeout
+        while not self._poll():
+            if time.monotonic() > deadline:
+                self.kill()
+                raise TimeoutError(
+                    f"The execution did not finish within {timeout:g} seconds."
+                )
+            if (
+                max_memory_bytes is not None
+                and self._get_memory_usage() > max_memory_bytes
+            ):
+                self.kill()
+                raise MemoryError(
+                    f"The execution used more than {max_memory_bytes // 2**20} MB of memory."
+                )
+        try:
+            return self._connection.recv()
+        except (EOFError, OSError) as e:
+            raise KernelError("The kernel stopped during the execution.") from e
+
+    def _poll(self) -> bool:
+        """Wait briefly for a message of the kernel; True if there is one or it stopped."""
+        try:
+            return self._connection.poll(POLL_INTERVAL_SECONDS)
+        except (EOFError, OSError):
+            # Reading will raise the KernelError
+            return True
+
+    def execute(
+        self,
+        command: str,
+        timeout: float | None = None,
+        max_memory_bytes: int | None = None,
+    ) -> ExecutionResult:
+        """
+        Execute a command in the kernel and return its result, including errors.
+
+        Args:
+            command (str): The Python code to execute.
+            timeout (float | None): Seconds the execution may take, defaults to
+                app_settings.repl_timeout_seconds.
+            max_memory_bytes (int | None): Memory the kernel may use, defaults to
+                app_settings.repl_max_memory_mb.
+
+        Raises:
+            TimeoutError: If the execution takes longer than the timeout.
+            MemoryError: If the kernel uses more memory than allowed.
+            KernelError: If the kernel stops during the execution.
+        """
+        timeout = timeout or app_settings.repl_timeout_seconds
+        if max_memory_bytes is None and app_settings.repl_max_memory_mb:
+            max_memory_bytes = app_settings.repl_max_memory_mb * 2**20
+
+        return self._request(command, timeout, max_memory_bytes)
+
+    def _request(
+        self, message: str, timeout: float, max_memory_bytes: int | None
+    ) -> Any:
+        """Send a message to the kernel and wait for its response."""
+        with self._lock:
+            if not self._ready:
+                # Loading the namespace doesn't count towards the execution time
+                self._receive(app_settings.repl_startup_timeout_seconds, None)
+                self._ready = True
+            try:
+                self._connection.send(message)
+            except (BrokenPipeError, OSError) as e:
+                raise KernelError("The kernel is not running.") from e
+            return self._receive(timeout, max_memory_bytes)
+
+    def get_preflight_context(self) -> PreflightContext:
+        """
+        Get the names and dataframes of the namespace of the kernel, see
+        src/agents/tools/code_preflight.py.
+
+        Raises:
+            TimeoutError: If the kernel doesn't respond in time.
+            KernelError: If the kernel stops.
+        """
+        return self._request(
+            KERNEL_PREFLIGHT_CONTEXT, PREFLIGHT_CONTEXT_TIMEOUT_SECONDS, None
+        )
+
+    async def aexecute(
+        self,
+        command: str,
+        timeout: float | None = None,
+        max_memory_bytes: int | None = None,
+    ) -> ExecutionResult:
+        """
+        Execute a command without blocking the event loop; see execute.
+
+        Cancelling the call kills the kernel, stopping the execution.
+        """
+        try:
+            return await asyncio.to_thread(
+                self.execute, command, timeout, max_memory_bytes
+            )
+        except asyncio.CancelledError:
+            self.kill()
+            raise
+
+
+class KernelPool:
+    """
+    Kernels started ahead of time, so they are ready when a REPL needs one.
+
+    Kernels are never shared: each REPL takes one for itself, and a new one is
+    started to replace it in the pool.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._idle: deque[PythonKernel] = deque()
+        self._lock = Lock()
+        self.fill()
+
+    def fill(self) -> None:
+        """Start kernels until the pool has its size."""
+        with self._lock:
+            while len(self._idle) < self._size:
+                self._idle.append(PythonKernel())
+
+    def acquire(self) -> PythonKernel:
+        """Take a kernel out of the pool, starting a new one if none is idle."""
+        with self._lock:
+            kernel = None
+            while self._idle and kernel is None:
+                candidate = self._idle.popleft()
+                if candidate.is_alive():
+                    kernel = candidate
+        self.fill()
+        return kernel or PythonKernel()
+
+    def shutdown(self) -> None:
+        """Stop the idle kernels."""
+        with self._lock:
+            while self._idle:
+                self._idle.popleft().kill()
+
+
+_kernel_pool: KernelPool | None = None
+_kernel_pool_lock = Lock()
+
+
+def get_kernel_pool() -> KernelPool:
+    """Kernel pool shared by all the REPLs, started on first use."""
+    global _kernel_pool
+    with _kernel_pool_lock:
+        if _kernel_pool is None:
+            # Kernels are daemon processes, so they can't build the cube in parallel
+            prepare_shared_data()
+            default_logger.info(
+                f"Starting {app_settings.repl_kernel_pool_size} Python kernels."
+            )
+            _kernel_pool = KernelPool(app_settings.repl_kernel_pool_size)
+            atexit.register(_kernel_pool.shutdown)
+        return _kernel_pool
+
+
+class KernelPythonREPL:
+    """
+    REPL executing code in its own kernel process, with the interface of CustomPythonREPL.
+
+    The kernel is taken from the pool on the first execution. If it is killed
+    for going over the limits, the next execution starts in a fresh kernel.
+    """
+
+    def __init__(self, kernel_pool: KernelPool | None = None):
+        self._kernel_pool = kernel_pool
+        self._kernel: PythonKernel | None = None
+        self._lock = Lock()
+
+    def _get_kernel(self) -> PythonKernel:
+        with self._lock:
+            if self._kernel is None or not self._kernel.is_alive():
+                kernel_pool = self._kernel_pool or get_kernel_pool()
+                self._kernel = kernel_pool.acquire()
+                # Stop the kernel with the REPL that owns it
+                weakref.finalize(self, self._kernel.kill)
+            return self._kernel
+
+    @staticmethod
+    def _get_error_result(error: Exception) -> ExecutionResult:
+        return ExecutionResult.from_exception(
+            "",
+            error,
+            error=(
+                f"{repr(error)}\nThe Python kernel was restarted: variables and "
+                "imports defined before are lost, only the preloaded data is available."
+            ),
+        )
+
+    def execute(self, command: str) -> ExecutionResult:
+        """Execute a command in the kernel and return its result, including errors."""
+        try:
+            return self._get_kernel().execute(command)
+        except (TimeoutError, MemoryError, KernelError) as e:
+            return self._get_error_result(e)
+
+    async def aexecute(self, command: str) -> ExecutionResult:
+        """Execute a command without blocking the event loop; cancelling it stops it."""
+        try:
+            # Starting the pool on first use prepares the data, which takes a while
+            kernel = await asyncio.to_thread(self._get_kernel)
+            return await kernel.aexecute(command)
+        except (TimeoutError, MemoryError, KernelError) as e:
+            return self._get_error_result(e)
+
+    def run(self, command: str) -> str:
+        """Run a command in the kernel and return its output, including errors."""
+        return self.execute(command).to_text()
+
+    async def arun(self, command: str) -> str:
+        """Run a command without blocking the event loop; cancelling it stops the execution."""
+        return (await self.aexecute(command)).to_text()
+
+    def get_preflight_context(self) -> PreflightContext | None:
+        """Names and dataframes of the namespace, None if the kernel can't provide them."""
+        try:
+            return self._get_kernel().get_preflight_context()
+        except (TimeoutError, MemoryError, KernelError):
+            return None
+
+    def close(self) -> None:
+        """Stop the kernel of the REPL."""
+        with self._lock:
+            if self._kernel is not None:
+                self._kernel.kill()
+                self._kernel = None
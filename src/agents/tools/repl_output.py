@@ -0,0 +1,89 @@
+"""
+Compact rendering of the output of the python tool.
+
+The output of each execution becomes a ToolMessage that is sent back to the
+model on every later turn, so printing a dataframe of thousands of rows costs
+tokens for the rest of the run, and can go over the context length. Large
+dataframes printed in the REPL are summarized instead (first and last rows,
+shape, column types and summary statistics), and outputs over
+app_settings.repl_output_max_bytes are saved to a file, keeping only their
+beginning and end in the message.
+"""
+
+import builtins
+import sys
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from src.configuration.settings import TEMP_DIR, app_settings
+
+
+def summarize_dataframe(data: pd.DataFrame | pd.Series, max_rows: int) -> str:
+    """
+    Summarize a dataframe or series with its first and last rows, shape, types
+    and summary statistics.
+    """
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+    parts = [
+        f"DataFrame with {data.shape[0]} rows and {data.shape[1]} columns, "
+        f"showing the first and last {max_rows // 2} rows:",
+        data.to_string(max_rows=max_rows, max_cols=20),
+        "Column types: "
+        + ", ".join(f"{column} ({dtype})" for column, dtype in data.dtypes.items()),
+    ]
+    numeric_data = data.select_dtypes("number")
+    if not numeric_data.empty:
+        parts += ["Summary statistics:", numeric_data.describe().T.to_string()]
+    return "\n".join(parts)
+
+
+def summarizing_print(*values, sep=" ", end="\n", file=None, flush=False) -> None:
+    """
+    print, summarizing the dataframes and series with more than
+    app_settings.repl_dataframe_max_rows rows; output to files is not changed.
+    """
+    if file is None or file is sys.stdout:
+        max_rows = app_settings.repl_dataframe_max_rows
+        values = [
+            summarize_dataframe(value, max_rows)
+            if isinstance(value, (pd.DataFrame, pd.Series)) and len(value) > max_rows
+            else value
+            for value in values
+        ]
+    builtins.print(*values, sep=sep, end=end, file=file, flush=flush)
+
+
+def limit_output(output: str, output_dir: Path | None = None) -> str:
+    """
+    Keep an output within app_settings.repl_output_max_bytes.
+
+    Longer outputs are saved to a file, and only their beginning and end, where
+    errors are reported, are kept, with the path of the file.
+
+    Args:
+        output (str): The output of an execution.
+        output_dir (Path | None): Directory for the file, e.g. the temp dir of the request.
+
+    Returns:
+        str: The output, or its beginning and end with the path of the full output.
+    """
+    max_bytes = app_settings.repl_output_max_bytes
+    encoded_output = output.encode()
+    if len(encoded_output) <= max_bytes:
+        return output
+
+    output_dir = output_dir or TEMP_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"python_output_{uuid.uuid4().hex[:8]}.txt"
+    output_path.write_text(output)
+
+    kept_bytes = max_bytes // 2
+    return (
+        f"{encoded_output[:kept_bytes].decode(errors='ignore')}\n"
+        f"... [{len(encoded_output) - 2 * kept_bytes} bytes omitted, the full output "
+        f"was saved to {output_path}; print less or read that file in parts] ...\n"
+        f"{encoded_output[-kept_bytes:].decode(errors='ignore')}"
+    )
@@ -0,0 +1,92 @@
+"""
+Rolling compaction of the messages of the code agent.
+
+Each call of the agent sends the whole history: the code, the outputs of the
+tool and the reviews. Over long runs (e.g. 50 iterations to retrieve the
+operational data) the tokens sent grow with the square of the turns. Once the
+history is over a budget, the oldest tool outputs are replaced by a summary:
+their first and last lines and the files they mention, which are the artifacts
+later steps rely on. The most recent messages are never compacted, and the
+summary is deterministic, so compacting doesn't call a model.
+"""
+
+import re
+
+from langchain_core.messages import AIMessage, AnyMessage, ToolMessage
+
+# Rough number of characters per token, enough to compare with a budget
+CHARS_PER_TOKEN = 4
+# Marker of the outputs already compacted
+COMPACTED_MARKER = "[Output compacted to save context"
+# Lines of an output kept in its summary
+SUMMARY_HEAD_LINES = 5
+SUMMARY_TAIL_LINES = 3
+SUMMARY_LINE_MAX_CHARS = 200
+# Outputs shorter than this are not worth compacting
+MIN_COMPACTED_CHARS = 600
+
+_file_path_pattern = re.compile(
+    r"[\w./\\:-]+\.(?:csv|png|jpg|parquet|xlsx|json|txt|md|pdf)\b", re.IGNORECASE
+)
+
+
+def estimate_tokens(message: AnyMessage) -> int:
+    """Rough number of tokens of a message, including the code of its tool calls."""
+    characters = len(str(message.content))
+    if isinstance(message, AIMessage):
+        characters += sum(len(str(call.get("args", ""))) for call in message.tool_calls)
+    return characters // CHARS_PER_TOKEN + 1
+
+
+def summarize_tool_output(content: str) -> str:
+    """Summarize a tool output with its first and last lines and the files it mentions."""
+    lines = content.splitlines()
+    kept_lines = lines[:SUMMARY_HEAD_LINES]
+    omitted_lines = len(lines) - SUMMARY_HEAD_LINES - SUMMARY_TAIL_LINES
+    if omitted_lines > 0:
+        kept_lines += [f"... {omitted_lines} lines ..."]
+        kept_lines += lines[-SUMMARY_TAIL_LINES:]
+    else:
+        kept_lines = lines
+    kept_lines = [line[:SUMMARY_LINE_MAX_CHARS] for line in kept_lines]
+
+    files = list(dict.fromkeys(_file_path_pattern.findall(content)))
+    files_line = f" Files mentioned: {', '.join(files)}." if files else ""
+    return "\n".join(
+        [f"{COMPACTED_MARKER}, {len(content)} characters.{files_line}]", *kept_lines]
+    )
+
+
+def compact_messages(
+    messages: list[AnyMessage], max_tokens: int, keep_recent: int
+) -> list[ToolMessage]:
+    """
+    Compact the oldest tool outputs until the history is within a token budget.
+
+    Args:
+        messages (list[AnyMessage]): The history of the agent.
+        max_tokens (int): The token budget of the history.
+        keep_recent (int): Number of most recent messages never compacted.
+
+    Returns:
+        list[ToolMessage]: The compacted messages, with the ids of the messages
+            they replace; empty if the history is within the budget.
+    """
+    total_tokens = sum(estimate_tokens(message) for message in messages)
+    compacted = []
+    for message in messages[: max(len(messages) - keep_recent, 0)]:
+        if total_tokens <= max_tokens:
+            break
+        content = str(message.content)
+        if (
+            not isinstance(message, ToolMessage)
+            or len(content) < MIN_COMPACTED_CHARS
+            or content.startswith(COMPACTED_MARKER)
+        ):
+            continue
+        compacted_message = message.model_copy(
+            update={"content": summarize_tool_output(content)}
+        )
+        total_tokens += estimate_tokens(compacted_message) - estimate_tokens(message)
+        compacted.append(compacted_message)
+    return compacted
@@ -0,0 +1,177 @@
+"""
+Local classifier deciding if the code agent continues working or responds.
+
+When the agent writes a message without tool calls, the code agent has to
+decide whether it is mid-task (CONTINUE) or done, waiting for input (RESPOND).
+A model used to be asked after every such message. Most messages carry clear
+cues instead: "Next, I will..." at the end, "Let me know if...", a summary with
+key insights, a self-evaluation... so the decision is first taken from them,
+and the model is only asked when the cues are not conclusive.
+
+Each cue adds its weight to the log-odds of continuing, starting from a bias
+towards responding, as messages without tool calls usually end the turn. The
+confidence is the resulting probability of the decision, except when opposing
+cues are both found, e.g. a question to the user and a commitment to a next
+step ("Should I proceed? If you confirm, I will generate the plots."): the
+decision is then inconclusive, with a confidence of 0.5, so the model decides.
+Offers of extra work ("Let me know if you'd like any additional charts.") are
+left out, as they don't hold the task for an answer.
+"""
+
+import math
+import re
+from dataclasses import dataclass
+from enum import Enum
+
+# Log-odds of continuing for a message without any cue
+BIAS = -1.0
+# Characters at the end of a message where a commitment to a next step counts most
+TAIL_LENGTH = 500
+# Offers of extra work, which don't wait for the user to go on with the task
+OFFER_PATTERN = re.compile(
+    r"(?:let me know )?\b(?:if|should) you(?: would|'d)? (?:like|want|need) "
+    r"(?:any |some )?(?:additional|further|more|other)\b[^.?!\n]*[.?!]?"
+)
+
+
+class ContinueDecision(Enum):
+    CONTINUE = "CONTINUE"
+    RESPOND = "RESPOND"
+
+
+@dataclass(frozen=True)
+class Cue:
+    """
+    A cue of the decision.
+
+    Attributes:
+        name: Name of the cue, for logging.
+        weight: Log-odds of continuing added when any pattern matches.
+        patterns: Patterns of the cue, matched on the lowercase message.
+        tail_only: Only match the end of the message.
+        conflicts_with: Name of a cue that makes the decision inconclusive when
+            both are found.
+    """
+
+    name: str
+    weight: float
+    patterns: tuple[str, ...]
+    tail_only: bool = False
+    conflicts_with: str | None = None
+
+
+_COMMITMENT_PATTERNS = (
+    r"\b(?:next|now|then),? i(?: will|'ll)\b",
+    r"\bi(?: will|'ll) (?:now|proceed|continue|perform|analy[sz]e|compute|calculate"
+    r"|create|generate|build|load|run|start|fix|retry|save|check)\b",
+    r"\bi(?: am|'m) (?:now )?(?:going to|proceeding|continuing|moving on)\b",
+    r"\bproceeding (?:with|to)\b",
+    r"\blet me (?:now )?(?:proceed|continue|start|compute|calculate|analy[sz]e|load"
+    r"|check|run|create|generate|build|fix|try)\b",
+    r"\bmoving on to\b",
+)
+
+CUES = (
+    # Explicitly committing to a next step, above all at the end of the message
+    Cue("commitment", 2.0, _COMMITMENT_PATTERNS),
+    Cue("final commitment", 3.0, _COMMITMENT_PATTERNS, tail_only=True),
+    # Asking the user, or waiting for them, which a commitment to a next step contradicts
+    Cue(
+        "question",
+        -1.5,
+        (
+            r"\blet me know\b",
+            r"\bwould you like\b",
+            r"\bdo you want\b",
+            r"\bshall i\b",
+            r"\bshould i\b",
+            r"\?\s*$",
+        ),
+        conflicts_with="commitment",
+    ),
+    Cue(
+        "waiting for user",
+        -2.0,
+        (r"\b(?:once|if|when) you(?:'d| would)? (?:like|confirm|prefer|want)\b",),
+        conflicts_with="commitment",
+    ),
+    # A final answer
+    Cue(
+        "final answer",
+        -1.5,
+        (
+            r"\bin summary\b",
+            r"\bin conclusion\b",
+            r"\bto summari[sz]e\b",
+            r"\bkey (?:insights|findings|takeaways)\b",
+            r"\brecommendations?\b",
+            r"\bfinal (?:answer|report|summary|results?)\b",
+        ),
+    ),
+    # Self-evaluations, e.g. after too many errors
+    Cue(
+        "self-evaluation",
+        -3.0,
+        (r"\bwhat i tried\b", r"\bwhat i know\b", r"\bwhat's missing\b"),
+    ),
+    # Results ready for a next step, without committing to it
+    Cue("ready", -1.5, (r"\b(?:are|is|'re|'s) (?:now )?ready (?:for|to)\b",)),
+    # Files of results, usually listed once a step is done
+    Cue("output files", -0.5, (r"\.(?:csv|png|parquet|xlsx|json)\b",)),
+)
+
+_compiled_cues = [
+    (cue, [re.compile(pattern, re.MULTILINE) for pattern in cue.patterns])
+    for cue in CUES
+]
+
+
+@dataclass(frozen=True)
+class ContinueClassification:
+    """
+    Decision of the classifier.
+
+    Attributes:
+        decision: Whether the agent should continue or respond.
+        confidence: Probability of the decision, between 0.5 and 1.
+        cues: Names of the cues found in the message.
+    """
+
+    decision: ContinueDecision
+    confidence: float
+    cues: tuple[str, ...]
+
+
+def classify_continue(message: str) -> ContinueClassification:
+    """
+    Decide if the code agent should continue after a message without tool calls.
+
+    Args:
+        message (str): The content of the last message of the agent.
+
+    Returns:
+        ContinueClassification: The decision, its confidence and the cues found.
+    """
+    text = OFFER_PATTERN.sub("", message.lower().replace("’", "'")).strip()
+    if not text:
+        return ContinueClassification(ContinueDecision.RESPOND, 1.0, ("empty",))
+
+    tail = text[-TAIL_LENGTH:]
+    found_cues = [
+        cue
+        for cue, patterns in _compiled_cues
+        if any(
+            pattern.search(tail if cue.tail_only else text) for pattern in patterns
+        )
+    ]
+    found_names = {cue.name for cue in found_cues}
+    log_odds = BIAS + sum(cue.weight for cue in found_cues)
+    cues = tuple(cue.name for cue in found_cues)
+
+    probability = 1 / (1 + math.exp(-log_odds))
+    decision = (
+        ContinueDecision.CONTINUE if probability >= 0.5 else ContinueDecision.RESPOND
+    )
+    if any(cue.conflicts_with in found_names for cue in found_cues):
+        return ContinueClassification(decision, 0.5, cues)
+    return ContinueClassification(decision, max(probability, 1 - probability), cues)
@@ -0,0 +1,47 @@
+from threading import Lock
+from typing import Any, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class RunnableRegistry:
+    """
+    Process-wide registry of compiled graphs and runnables.
+
+    Compiling a graph or binding a structured output to a model is relatively
+    expensive, and the result does not depend on the request being processed,
+    so each runnable is created once and then reused. Per-request values
+    (e.g. the system prompt or the temp path) must be passed through the state
+    or the config, never captured when the runnable is created.
+    """
+
+    def __init__(self):
+        self._runnables: dict[Hashable, Any] = {}
+        self._lock = Lock()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], T]) -> T:
+        """
+        Return the runnable stored under key, creating it with factory if needed.
+
+        Args:
+            key (Hashable): Unique key for the runnable; include id(model) if the
+                runnable depends on a model, so replacing the model creates a new
+                one. Models are not hashable, and the stored runnable keeps its
+                model alive, so its id can't be reused by another model.
+            factory (Callable[[], T]): Function that creates the runnable.
+
+        Returns:
+            T: The cached runnable.
+        """
+        with self._lock:
+            if key not in self._runnables:
+                self._runnables[key] = factory()
+            return self._runnables[key]
+
+    def clear(self) -> None:
+        """Remove all the cached runnables, e.g. after patching nodes in tests."""
+        with self._lock:
+            self._runnables.clear()
+
+
+default_registry = RunnableRegistry()
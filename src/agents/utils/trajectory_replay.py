@@ -0,0 +1,387 @@
+"""
+Replay of the code written by the code agents for recurring report steps.
+
+The same requests run every month, and the code the internal data agent writes
+for a data step, e.g. retrieve_operational_data, is essentially the same each
+time. The code of the successful executions of a step is stored per task_id
+and node, with the analysis date and the paths of the run replaced by
+placeholders. On the next run, the stored code is executed again with the
+values of the new run, in the REPL of the request, and the agent is only
+invoked if the replay fails validation:
+
+- the code must not have date literals left, e.g. INVOICE_MONTH == 9 or
+  '2023-11', as it would compute the window of the previous run again,
+- every step must execute without errors,
+- every file the original run produced must be written again by the replay,
+  not empty, and the csv files with a period column must end with the last
+  complete period before the analysis date.
+
+The code of a run with date literals left is not stored at all.
+
+The response of a replayed step is built from the outputs of its code, as the
+data steps print what they retrieved.
+"""
+
+import ast
+import json
+import re
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from langchain_core.messages import AIMessage, AnyMessage, ToolMessage
+from pydantic import BaseModel, Field
+
+from src.agents.code_agent_with_review import PreConfiguredCodeAgent
+from src.agents.tools.execution_result import ExecutionResult
+from src.agents.tools.python_interpreter import PythonREPL
+from src.agents.tools.repl_output import limit_output
+from src.agents.utils.prompt_utils import extract_graph_response_content
+from src.configuration.constants import INTERNAL_DATA
+from src.configuration.db_models import KpiPeriodsEnum
+from src.configuration.logger import default_logger
+from src.configuration.settings import CACHE_DIR, app_settings
+from src.data_engine.sales_cube import PERIOD_COLUMNS
+
+TRAJECTORY_DIR = CACHE_DIR / "trajectories"
+# Years written in the code, e.g. INVOICE_YEAR >= 2021 or '2023-11'
+YEAR_PATTERN = re.compile(r"(?<!\d)(19|20)\d{2}(?!\d)")
+# Columns and variables holding months or quarters, compared to numbers in the code
+MONTH_NAME_PATTERN = re.compile(r"MONTH|QUARTER", re.IGNORECASE)
+# Margin for the modification time of the files, as file systems round it
+FILE_TIME_MARGIN_SECONDS = 1.0
+
+
+class Trajectory(BaseModel):
+    """
+    Code of the successful executions of a step, as templates.
+
+    Attributes:
+        steps: The code of each execution, in order.
+        files: The files the executions produced.
+    """
+
+    steps: list[str] = Field(default_factory=list)
+    files: list[str] = Field(default_factory=list)
+
+
+def get_last_month(analysis_date: date) -> date:
+    """First day of the last complete month before the analysis date."""
+    return (analysis_date.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def get_template_values(output_dir: Path) -> dict[str, str]:
+    """Values of a run that change from one run to the next, by placeholder."""
+    analysis_date = app_settings.analysis_date
+    return {
+        "<<output_dir>>": str(output_dir),
+        "<<internal_data_path>>": str(INTERNAL_DATA.path),
+        "<<analysis_date>>": analysis_date.isoformat(),
+        "<<analysis_month>>": analysis_date.strftime("%Y-%m"),
+        "<<last_month>>": get_last_month(analysis_date).strftime("%Y-%m"),
+    }
+
+
+def to_template(text: str, values: dict[str, str]) -> str:
+    """Replace the values of a run by their placeholders, longest values first."""
+    for placeholder, value in sorted(values.items(), key=lambda item: -len(item[1])):
+        text = text.replace(value, placeholder)
+    return text
+
+
+def from_template(text: str, values: dict[str, str]) -> str:
+    """Replace the placeholders by the values of a run."""
+    for placeholder, value in values.items():
+        text = text.replace(placeholder, value)
+    return text
+
+
+def _mentions_months(node: ast.AST) -> bool:
+    """Whether an expression uses a month or quarter, e.g. df["INVOICE_MONTH"]."""
+    return any(
+        MONTH_NAME_PATTERN.search(
+            getattr(child, "id", None) or getattr(child, "attr", None) or ""
+        )
+        or (
+            isinstance(child, ast.Constant)
+            and isinstance(child.value, str)
+            and MONTH_NAME_PATTERN.search(child.value)
+        )
+        for child in ast.walk(node)
+    )
+
+
+def _is_number(node: ast.AST) -> bool:
+    return (
+        isinstance(node, ast.Constant)
+        and isinstance(node.value, int)
+        and not isinstance(node.value, bool)
+    )
+
+
+def find_date_literals(code: str) -> list[str]:
+    """
+    Dates written in code as literals rather than placeholders: years, e.g.
+    INVOICE_YEAR >= 2021 or '2023-11', and months or quarters compared to a
+    number, e.g. INVOICE_MONTH == 9 or df["INVOICE_MONTH"].isin([7, 8, 9]).
+
+    Returns:
+        list[str]: The source of each literal, empty for code that can't be parsed.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+
+    literals = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and (
+            (_is_number(node) and 1900 <= node.value <= 2100)
+            or (isinstance(node.value, str) and YEAR_PATTERN.search(node.value))
+        ):
+            literals.append(repr(node.value))
+        elif isinstance(node, ast.Compare):
+            operands = [node.left, *node.comparators]
+            if any(map(_mentions_months, operands)):
+                literals += [ast.unparse(item) for item in operands if _is_number(item)]
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr in ("isin", "between")
+            and _mentions_months(node.func.value)
+        ):
+            literals += [
+                ast.unparse(item)
+                for argument in node.args
+                for item in ast.walk(argument)
+                if _is_number(item)
+            ]
+    return literals
+
+
+def _get_tool_call_code(tool_call: dict) -> str | None:
+    """Code of a call of the python tool, whatever the name of its argument."""
+    return next(
+        (value for value in tool_call["args"].values() if isinstance(value, str)),
+        None,
+    )
+
+
+def extract_trajectory(messages: list[AnyMessage], output_dir: Path) -> Trajectory:
+    """
+    Get the code of the successful executions of a run of a code agent.
+
+    Args:
+        messages (list[AnyMessage]): The messages of the run.
+        output_dir (Path): The directory of the files of the request.
+
+    Returns:
+        Trajectory: The executions, as templates.
+    """
+    values = get_template_values(output_dir)
+    codes = {
+        tool_call["id"]: _get_tool_call_code(tool_call)
+        for message in messages
+        if isinstance(message, AIMessage)
+        for tool_call in message.tool_calls
+    }
+    trajectory = Trajectory()
+    for message in messages:
+        if not (
+            isinstance(message, ToolMessage)
+            and isinstance(message.artifact, ExecutionResult)
+            and message.artifact.succeeded
+            and codes.get(message.tool_call_id)
+        ):
+            continue
+        trajectory.steps.append(to_template(codes[message.tool_call_id], values))
+        for path in message.artifact.files:
+            template = to_template(path, values)
+            if template not in trajectory.files:
+                trajectory.files.append(template)
+    return trajectory
+
+
+class TrajectoryStore:
+    """Trajectories of the steps of the requests, stored on disk by task_id and node."""
+
+    def __init__(self, directory: Path = TRAJECTORY_DIR):
+        self._directory = directory
+
+    def _get_path(self, task_id: str, node: str) -> Path:
+        return self._directory / task_id / f"{node}.json"
+
+    def load(self, task_id: str, node: str) -> Trajectory | None:
+        """The stored trajectory of a step, None if there is none or it can't be read."""
+        path = self._get_path(task_id, node)
+        if not path.is_file():
+            return None
+        try:
+            return Trajectory.model_validate_json(path.read_text())
+        except ValueError as e:
+            default_logger.warning(f"Could not read the trajectory {path}: {str(e)}")
+            return None
+
+    def save(self, task_id: str, node: str, trajectory: Trajectory) -> None:
+        """Store the trajectory of a step, replacing the previous one."""
+        path = self._get_path(task_id, node)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(trajectory.model_dump(), indent=2))
+        temp_path.replace(path)
+
+    def delete(self, task_id: str, node: str) -> None:
+        """Forget the trajectory of a step, e.g. once it fails to replay."""
+        self._get_path(task_id, node).unlink(missing_ok=True)
+
+
+default_trajectory_store = TrajectoryStore()
+
+
+def get_last_period_labels(analysis_date: date) -> dict[str, str]:
+    """
+    Label of the last complete period before the analysis date, by period
+    column, e.g. {"MONTH_YEAR": "2023-11", "QUARTER_YEAR": "2023-Q4", "YEAR": "2023"}.
+    """
+    last_month = get_last_month(analysis_date)
+    return {
+        PERIOD_COLUMNS[KpiPeriodsEnum.MONTHLY]: last_month.strftime("%Y-%m"),
+        PERIOD_COLUMNS[KpiPeriodsEnum.QUARTERLY]: (
+            f"{last_month.year}-Q{(last_month.month - 1) // 3 + 1}"
+        ),
+        PERIOD_COLUMNS[KpiPeriodsEnum.YEARLY]: str(last_month.year),
+    }
+
+
+def covers_last_period(path: Path) -> bool:
+    """
+    Whether the periods of a csv file end with the last complete period before
+    the analysis date; True for other files, and csv files without a period column.
+    """
+    if path.suffix != ".csv":
+        return True
+    labels = get_last_period_labels(app_settings.analysis_date)
+    try:
+        periods = pd.read_csv(path, usecols=lambda column: column in labels, dtype=str)
+    except Exception as e:
+        default_logger.info(f"Could not read the periods of {path}: {str(e)}")
+        return False
+    return all(
+        periods[column].dropna().max() == labels[column] for column in periods.columns
+    )
+
+
+async def replay_trajectory(
+    trajectory: Trajectory, python_repl: PythonREPL, output_dir: Path
+) -> str | None:
+    """
+    Execute the code of a trajectory again, with the values of this run.
+
+    Args:
+        trajectory (Trajectory): The trajectory to replay.
+        python_repl (PythonREPL): The REPL of the request.
+        output_dir (Path): The directory of the files of the request.
+
+    Returns:
+        str | None: The response of the step, built from the outputs of the
+            code; None if the replay failed validation.
+    """
+    literals = [
+        literal for step in trajectory.steps for literal in find_date_literals(step)
+    ]
+    if literals:
+        default_logger.info(f"Not replayed, the code has dates: {', '.join(literals)}.")
+        return None
+
+    values = get_template_values(output_dir)
+    outputs = []
+    started = time.time() - FILE_TIME_MARGIN_SECONDS
+    for index, step in enumerate(trajectory.steps):
+        result = await python_repl.aexecute(from_template(step, values))
+        if not result.succeeded:
+            default_logger.info(
+                f"Replay failed at step {index + 1}: {result.error_type}, {result.error}"
+            )
+            return None
+        if result.output.strip():
+            outputs.append(result.output.strip())
+
+    files = [Path(from_template(file, values)) for file in trajectory.files]
+    # Files of the previous run are still there, so they must have been written again
+    missing_files = [
+        file
+        for file in files
+        if not file.is_file()
+        or file.stat().st_size == 0
+        or file.stat().st_mtime < started
+    ]
+    if missing_files:
+        default_logger.info(
+            f"Replay did not produce {', '.join(map(str, missing_files))}."
+        )
+        return None
+    stale_files = [file for file in files if not covers_last_period(file)]
+    if stale_files:
+        default_logger.info(
+            f"Replay did not cover the last period in {', '.join(map(str, stale_files))}."
+        )
+        return None
+
+    output = limit_output("\n\n".join(outputs), output_dir)
+    file_names = "\n".join(f"- {file.name}" for file in files)
+    return (
+        "The data of this step was computed by the same code as in the previous "
+        f"run, on the current data.\n\nOutputs of the code:\n{output}\n\n"
+        f"Files saved:\n{file_names}"
+    )
+
+
+async def ainvoke_with_replay(
+    agent: PreConfiguredCodeAgent,
+    messages: list[AnyMessage],
+    task_id: str,
+    node: str,
+    output_dir: Path,
+    trajectory_store: TrajectoryStore = default_trajectory_store,
+) -> str:
+    """
+    Run a step of a recurring report, replaying its stored code before invoking the agent.
+
+    Args:
+        agent (PreConfiguredCodeAgent): The agent of the step, used if there is
+            no trajectory or the replay fails.
+        messages (list[AnyMessage]): The task of the step for the agent.
+        task_id (str): The task_id of the request.
+        node (str): The node of the step in the report graph.
+        output_dir (Path): The directory of the files of the request.
+        trajectory_store (TrajectoryStore): Where trajectories are stored.
+
+    Returns:
+        str: The response of the step.
+    """
+    if app_settings.trajectory_replay:
+        trajectory = trajectory_store.load(task_id, node)
+        if trajectory is not None:
+            response = await replay_trajectory(trajectory, agent.python_repl, output_dir)
+            if response is not None:
+                default_logger.info(f"Replayed the code of {node} for {task_id}.")
+                return response
+            trajectory_store.delete(task_id, node)
+
+    result = await agent.ainvoke(messages)
+    if app_settings.trajectory_replay and agent.succeeded(result):
+        trajectory = extract_trajectory(result["messages"], output_dir)
+        literals = [
+            literal for step in trajectory.steps for literal in find_date_literals(step)
+        ]
+        if literals:
+            default_logger.info(
+                f"The code of {node} is not stored for replay, it has dates: "
+                f"{', '.join(literals)}."
+            )
+            trajectory_store.delete(task_id, node)
+        elif trajectory.steps:
+            trajectory_store.save(task_id, node, trajectory)
+    return extract_graph_response_content(result)
@@ -0,0 +1,39 @@
+from contextlib import AbstractAsyncContextManager
+from pathlib import Path
+
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from src.configuration.db_models import SalesReportRequest
+from src.configuration.settings import app_settings
+
+# Stored next to configuration.db, so it persists between cron runs
+CHECKPOINTS_DB_PATH = Path(__file__).parent / "checkpoints.db"
+
+
+def get_checkpointer(
+    db_path: Path = CHECKPOINTS_DB_PATH,
+) -> AbstractAsyncContextManager[AsyncSqliteSaver]:
+    """
+    Get a durable checkpointer for the report graph and its sub-graphs.
+
+    Sub-graphs invoked inside a node inherit the checkpointer of the parent graph,
+    so a failed run can be resumed from the last completed node, at any level.
+
+    Args:
+        db_path (Path): Path to the SQLite file storing the checkpoints.
+
+    Returns:
+        AbstractAsyncContextManager[AsyncSqliteSaver]: Context manager that opens
+            and closes the connection to the checkpoints database.
+    """
+    return AsyncSqliteSaver.from_conn_string(str(db_path))
+
+
+def get_report_thread_id(request: SalesReportRequest) -> str:
+    """
+    Get the checkpoint thread id for a request.
+
+    Includes the analysis date, so a run is only resumed within the same
+    analysis period and never reused for the next scheduled run.
+    """
+    return f"{request.task_id}_{app_settings.analysis_date.isoformat()}"
@@ -5,9 +5,12 @@ This file is mean to be modified by the user to reflect their own company and da
 """
 
 from pathlib import Path
+import pandas as pd
 from pydantic import BaseModel
 
-from src.configuration.settings import DATA_DIR
+from src.configuration.db_models import SalesGroupingsEnum
+from src.configuration.settings import CACHE_DIR, DATA_DIR
+from src.data_engine.parquet_cache import ensure_parquet_cache, read_parquet_cache
 
 financials_description = """Detailed per-invoice data of the company.
 
@@ -29,18 +32,83 @@ To load to dataframe, use encoding="ISO-8859-1"
 """
 
 
+# Columns of the internal data used to compute sales without an LLM
+INVOICE_YEAR_COLUMN = "INVOICE_YEAR"
+INVOICE_MONTH_COLUMN = "INVOICE_MONTH"
+ENTITY_CURRENCY_COLUMN = "ENTITY_CURRENCY"
+FUNCTIONAL_SALES_COLUMN = "SALES_FUNCTIONAL_CURRENCY"
+GROSS_AMOUNT_COLUMN = "GROSS_AMOUNT"
+DISCOUNT_AMOUNT_COLUMN = "DISCOUNT_AMOUNT"
+REPORTING_SALES_COLUMN = "SALES_REPORTING_CURRENCY"  # Computed as gross amount net of discounts
+ITEM_CODE_COLUMN = "ITEM_CODE"
+CUSTOMER_ID_COLUMN = "SoldToID"
+
+# Column of the internal data holding the value of each grouping
+SALES_GROUPING_COLUMNS: dict[SalesGroupingsEnum, str] = {
+    SalesGroupingsEnum.COUNTRY: "SOLD_TO_COUNTRY",
+    SalesGroupingsEnum.CITY: "SOLD_TO_CITY",
+    SalesGroupingsEnum.PRODUCT_FAMILY: "ITEM_EU_FAMILY",
+}
+
+
 class LocalDataSource(BaseModel):
     name: str  # Include the extension in the name, e.g. "financials.csv"
     description: str
     location: Path = DATA_DIR
+    # Columnar cache settings, see src/data_engine/parquet_cache.py
+    categorical_columns: list[str] = []
+    partition_columns: list[str] = []
+    cache_location: Path = CACHE_DIR
 
     @property
     def path(self) -> Path:
         """Returns the path to the data source."""
         return self.location / self.name
 
+    @property
+    def cache_path(self) -> Path:
+        """Returns the path to the Parquet cache of the data source."""
+        return self.cache_location / f"{Path(self.name).stem}.parquet"
+
+    def ensure_cache(self) -> Path:
+        """Builds the Parquet cache if it is missing or the source changed, and returns its path."""
+        return ensure_parquet_cache(self.path, self.cache_path, self.partition_columns)
+
+    def load(
+        self,
+        columns: list[str] | None = None,
+        filters: list[tuple] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Loads the data source from its Parquet cache, building it if needed.
+
+        Args:
+            columns (list[str] | None): Columns to load, all of them if None.
+            filters (list[tuple] | None): Row filters in pyarrow format,
+                e.g. [("INVOICE_YEAR", ">=", 2021)].
+
+        Returns:
+            pd.DataFrame: The loaded data.
+        """
+        return read_parquet_cache(
+            self.ensure_cache(),
+            columns,
+            filters,
+            self.partition_columns,
+            self.categorical_columns,
+        )
+
 
 INTERNAL_DATA = LocalDataSource(
     name="financials_final.csv",
     description=financials_description,
+    categorical_columns=[
+        ENTITY_CURRENCY_COLUMN,
+        "CURRENCY",
+        "SOLD_TO_CITY",
+        "SOLD_TO_COUNTRY",
+        ITEM_CODE_COLUMN,
+        "ITEM_EU_FAMILY",
+    ],
+    partition_columns=[INVOICE_YEAR_COLUMN, INVOICE_MONTH_COLUMN],
 )
@@ -1,7 +1,8 @@
+import hashlib
 from enum import Enum
 from typing import Optional, List
 
-from pydantic import BaseModel, EmailStr, model_validator, ConfigDict
+from pydantic import BaseModel, EmailStr, field_validator, model_validator, ConfigDict
 from sqlalchemy import String, ForeignKey, Enum as SQLEnum
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -28,6 +29,14 @@ class SalesCurrencyEnum(Enum):
     REPORTING = "Reporting currency"
 
 
+# grouping_value of a request covering every value of its grouping
+ALL_GROUPING_VALUES = "all"
+# Separator of the values of a request covering several values of its grouping
+GROUPING_VALUES_SEPARATOR = ";"
+# Values listed in the name of a request before only counting them
+NAME_MAX_GROUPING_VALUES = 3
+
+
 # Pydantic Models for API/validation
 class RecipientEmail(BaseModel):
     """Base model for recipient emails with validation."""
@@ -47,19 +56,80 @@ class SalesReportRequestBase(BaseModel):
     currency: SalesCurrencyEnum = SalesCurrencyEnum.FUNCTIONAL
     recipients: list[RecipientEmail]
 
+    @field_validator("grouping_value", mode="before")
+    @classmethod
+    def join_grouping_values(cls, value):
+        """A list of grouping values is stored as a single string, see grouping_values."""
+        if isinstance(value, (list, tuple)):
+            values = [str(item).strip() for item in value if str(item).strip()]
+            return f"{GROUPING_VALUES_SEPARATOR} ".join(values) or None
+        return value
+
+    @property
+    def is_multi_value(self) -> bool:
+        """
+        Whether the request covers several values of its grouping in one report,
+        either "all" of them or a list separated by GROUPING_VALUES_SEPARATOR.
+        """
+        if self.grouping is None or self.grouping_value is None:
+            return False
+        return (
+            self.grouping_value.strip().lower() == ALL_GROUPING_VALUES
+            or GROUPING_VALUES_SEPARATOR in self.grouping_value
+        )
+
+    @property
+    def grouping_values(self) -> list[str]:
+        """Values of the grouping the request covers; empty for all of them or no grouping."""
+        if self.grouping is None or self.grouping_value is None:
+            return []
+        if self.grouping_value.strip().lower() == ALL_GROUPING_VALUES:
+            return []
+        return [
+            value.strip()
+            for value in self.grouping_value.split(GROUPING_VALUES_SEPARATOR)
+            if value.strip()
+        ]
+
+    @property
+    def _grouping_value_id(self) -> str:
+        """The grouping value of the request, suitable for identifiers and filenames."""
+        if not self.is_multi_value:
+            return self.grouping_value.lower().replace(" ", "_")
+        values = self.grouping_values
+        if not values:
+            return ALL_GROUPING_VALUES
+        # Lists can be long, so they are identified by a hash of their values
+        digest = hashlib.sha1(
+            GROUPING_VALUES_SEPARATOR.join(sorted(v.upper() for v in values)).encode()
+        ).hexdigest()[:8]
+        return f"{len(values)}_values_{digest}"
+
     @property
     def name(self) -> str:
         if self.grouping is None:
             return "Sales Report - Total Sales"
-        else:
+        elif not self.is_multi_value:
             return f"Sales Report - {self.grouping.value} - {self.grouping_value}"
 
+        values = self.grouping_values
+        if not values:
+            return f"Sales Report - {self.grouping.value} - All"
+        if len(values) > NAME_MAX_GROUPING_VALUES:
+            return f"Sales Report - {self.grouping.value} - {len(values)} values"
+        return f"Sales Report - {self.grouping.value} - {', '.join(values)}"
+
     @property
     def task_id(self) -> str:
+        """
+        Identifier of the work needed for the report; requests that only differ
+        in their recipients share the same task_id (and the same temp dir).
+        """
+        work_id = f"{self.period.name.lower()}_{self.currency.name.lower()}"
         if self.grouping is None or self.grouping_value is None:
-            return "sales_report_total_sales"
+            return f"sales_report_total_sales_{work_id}"
         else:
-            return f"sales_report_{self.grouping.value.lower().replace(' ', '_')}_{self.grouping_value.lower().replace(' ', '_')}"
+            return f"sales_report_{self.grouping.value.lower().replace(' ', '_')}_{self._grouping_value_id}_{work_id}"
 
     @property
     def short_name(self) -> str:
@@ -67,13 +137,16 @@ class SalesReportRequestBase(BaseModel):
         if self.grouping is None:
             return "total"
         else:
-            return self.grouping_value.lower().replace(" ", "_")
+            return self._grouping_value_id
 
     @property
     def description(self) -> str:
         """Description of the task for the report."""
         if self.grouping is None or self.grouping_value is None:
             return f"{self.period.value} total sales history data, net of discounts, in its {self.currency.value}"
+        elif self.is_multi_value:
+            values = ", ".join(self.grouping_values) or "all of them"
+            return f"{self.period.value} sales history data, net of discounts, for each {self.grouping.value} ({values}), in its {self.currency.value}"
         else:
             return f"{self.period.value} sales history data, net of discounts, for the following {self.grouping}: {self.grouping_value}, in its {self.currency.value}"
 
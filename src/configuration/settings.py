@@ -50,6 +50,47 @@ class Settings(BaseSettings):
     # Run configuration
     is_data_current: bool = True
     retry_limit: int = 3
+    max_concurrent_requests: int = 4  # Sales report requests processed at the same time
+    azure_requests_per_second: float = 10  # Under max RPM (1K/min = ~16.6/sec)
+
+    # Code agent configuration, see src/agents/code_agent_with_review.py
+    # Below this confidence, a model decides if the agent continues working
+    continue_min_confidence: float = 0.85
+    # Older tool outputs are summarized once the history is over this budget
+    code_agent_context_max_tokens: int = 24_000
+    code_agent_keep_recent_messages: int = 8  # Never summarized
+    # Replay the code of the data steps of the previous run before invoking
+    # the agent, see src/agents/utils/trajectory_replay.py
+    trajectory_replay: bool = True
+    # Requests covering several grouping values, see src/data_engine/grouped_sales.py
+    grouped_report_max_sub_analyses: int = 6  # Values analysed in depth in a report
+    grouped_report_max_concurrency: int = 3  # Sub-analyses running at the same time
+
+    # Data engine configuration
+    # Peak memory when processing the internal data is about
+    # data_max_workers * data_chunk_rows rows of the source file
+    data_chunk_rows: int = 500_000
+    data_max_workers: int | None = None  # None uses all the cores
+
+    # Code execution configuration, see src/agents/tools/python_kernel.py
+    # Kernels memory-map one copy of the internal data (src/data_engine/shared_data.py)
+    repl_isolated_kernels: bool = True  # False runs the code in the agent process
+    repl_kernel_pool_size: int = 2  # Kernels started ahead of time
+    repl_timeout_seconds: float = 300
+    repl_startup_timeout_seconds: float = 300  # Loading the imports and data
+    repl_max_memory_mb: int | None = 4096
+    # Stale dataframes of a REPL are spilled to disk over this budget,
+    # see src/agents/tools/namespace_memory.py
+    repl_namespace_max_memory_mb: int | None = 1024
+    # Outputs sent back to the models, see src/agents/tools/repl_output.py
+    repl_output_max_bytes: int = 8_000  # Longer outputs are saved to a file
+    repl_dataframe_max_rows: int = 20  # Larger printed dataframes are summarized
+    repl_preflight_checks: bool = True  # See src/agents/tools/code_preflight.py
+    # Memoization of executions, see src/agents/tools/execution_cache.py
+    repl_memoize: bool = False
+    repl_memoize_max_rows: int = 1_000_000  # Larger dataframes are not hashed
+    repl_memoize_max_entry_mb: int = 64  # Larger effects are not stored
+    repl_memoize_max_size_mb: int = 1024  # Least recently used entries are removed
 
     model_config = ConfigDict(extra="ignore")
 
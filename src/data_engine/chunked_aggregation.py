@@ -0,0 +1,168 @@
+"""
+Aggregation of the internal data file by file, across processes.
+
+The Parquet cache of a data source is made of files of at most
+app_settings.data_chunk_rows rows. Instead of loading the whole data, each
+file is aggregated on its own in a process pool, and the partial results,
+which are much smaller, are combined as they arrive. Peak memory is then
+bounded by the number of workers times the size of a chunk, whatever the
+size of the data.
+"""
+
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Callable
+
+import pandas as pd
+
+from src.configuration.constants import LocalDataSource
+from src.configuration.settings import app_settings
+from src.data_engine.parquet_cache import downcast_integers
+
+# Number of partial results combined at once while aggregating
+COMBINE_BATCH_SIZE = 8
+
+_executor: Executor | None = None
+_executor_lock = Lock()
+
+
+def get_executor() -> Executor:
+    """
+    Process pool shared by all aggregations, created on first use.
+
+    Workers are spawned rather than forked, as the app runs several threads
+    and forking a multi-threaded process can deadlock.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=app_settings.data_max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def get_partition_values(file_path: Path, dataset_path: Path) -> dict[str, int | str]:
+    """
+    Partition values of a file of a hive partitioned dataset, e.g.
+    {"INVOICE_YEAR": 2023, "INVOICE_MONTH": 11}; numeric values are parsed as integers.
+    """
+    partition_values = {}
+    for part in file_path.relative_to(dataset_path).parent.parts:
+        if "=" in part:
+            column, value = part.split("=", 1)
+            partition_values[column] = (
+                int(value) if value.lstrip("-").isdigit() else value
+            )
+    return partition_values
+
+
+def get_dataset_files(
+    data_source: LocalDataSource,
+    partition_filter: Callable[[dict[str, int | str]], bool] | None = None,
+) -> list[Path]:
+    """
+    List the files of the Parquet cache of a data source, building it if needed.
+
+    Args:
+        data_source (LocalDataSource): The data source.
+        partition_filter (Callable[[dict[str, int | str]], bool] | None): Function
+            receiving the partition values of each file (e.g. its INVOICE_YEAR and
+            INVOICE_MONTH), returning whether to include it.
+
+    Returns:
+        list[Path]: The files of the dataset.
+    """
+    dataset_path = data_source.ensure_cache()
+    files = sorted(dataset_path.rglob("*.parquet"))
+    if partition_filter is None or not data_source.partition_columns:
+        return files
+    return [
+        file
+        for file in files
+        if partition_filter(get_partition_values(file, dataset_path))
+    ]
+
+
+def read_dataset_file(
+    file_path: Path,
+    dataset_path: Path,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """Read a single file of a Parquet dataset, adding its partition columns."""
+    partition_values = get_partition_values(file_path, dataset_path)
+    file_columns = (
+        None
+        if columns is None
+        else [column for column in columns if column not in partition_values]
+    )
+    data = pd.read_parquet(file_path, engine="pyarrow", columns=file_columns)
+    for column, value in partition_values.items():
+        if columns is None or column in columns:
+            data[column] = value
+    return downcast_integers(data[columns] if columns is not None else data)
+
+
+def _aggregate_file(
+    file_path: Path,
+    dataset_path: Path,
+    columns: list[str] | None,
+    aggregate: Callable[[pd.DataFrame], pd.DataFrame],
+) -> pd.DataFrame:
+    """Read and aggregate a single file; runs in the worker processes."""
+    return aggregate(read_dataset_file(file_path, dataset_path, columns))
+
+
+def aggregate_in_chunks(
+    data_source: LocalDataSource,
+    aggregate: Callable[[pd.DataFrame], pd.DataFrame],
+    combine: Callable[[list[pd.DataFrame]], pd.DataFrame],
+    columns: list[str] | None = None,
+    partition_filter: Callable[[dict[str, int | str]], bool] | None = None,
+) -> pd.DataFrame:
+    """
+    Aggregate a data source file by file in the process pool, and combine the results.
+
+    Files are aggregated one after the other in daemon processes, which can't
+    start the workers of the pool.
+
+    Args:
+        data_source (LocalDataSource): The data source to aggregate.
+        aggregate (Callable[[pd.DataFrame], pd.DataFrame]): Aggregates the rows of
+            one file; must be a module level function (or a functools.partial of
+            one) so it can be sent to the worker processes.
+        combine (Callable[[list[pd.DataFrame]], pd.DataFrame]): Combines several
+            aggregates into one, e.g. by summing them again.
+        columns (list[str] | None): Columns to read, all of them if None.
+        partition_filter (Callable[[dict[str, int | str]], bool] | None): Filter of
+            the files by their partition values, see get_dataset_files.
+
+    Returns:
+        pd.DataFrame: The combined aggregate.
+    """
+    dataset_path = data_source.ensure_cache()
+    files = get_dataset_files(data_source, partition_filter)
+    # Daemon processes, e.g. the kernels of the code tool, can't start workers
+    if len(files) <= 1 or multiprocessing.current_process().daemon:
+        results = (
+            _aggregate_file(file, dataset_path, columns, aggregate) for file in files
+        )
+    else:
+        results = get_executor().map(
+            _aggregate_file,
+            files,
+            [dataset_path] * len(files),
+            [columns] * len(files),
+            [aggregate] * len(files),
+        )
+
+    partial_results: list[pd.DataFrame] = []
+    for partial_result in results:
+        partial_results.append(partial_result)
+        # Combine as results arrive, so they never accumulate in memory
+        if len(partial_results) >= COMBINE_BATCH_SIZE:
+            partial_results = [combine(partial_results)]
+    return combine(partial_results) if partial_results else pd.DataFrame()
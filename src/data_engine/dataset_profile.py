@@ -0,0 +1,235 @@
+"""
+Profile of the internal data, built once per version of the data.
+
+The profile holds the distinct values of each grouping column, the number of
+rows, the months covered and the total sales. It is used to validate the
+grouping value of a request before any LLM call (see agent_main.py), and is
+included in the prompts of the agents, so they don't need to explore the data
+to know what it contains.
+"""
+
+import difflib
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from src.configuration.constants import (
+    ENTITY_CURRENCY_COLUMN,
+    FUNCTIONAL_SALES_COLUMN,
+    INTERNAL_DATA,
+    INVOICE_MONTH_COLUMN,
+    INVOICE_YEAR_COLUMN,
+    REPORTING_SALES_COLUMN,
+    SALES_GROUPING_COLUMNS,
+    LocalDataSource,
+)
+from src.configuration.db_models import (
+    GROUPING_VALUES_SEPARATOR,
+    SalesGroupingsEnum,
+    SalesReportRequest,
+)
+from src.configuration.logger import default_logger
+from src.data_engine.parquet_cache import get_cache_hash
+from src.data_engine.sales_cube import (
+    get_month_index,
+    get_sales_cube,
+    normalize_grouping_value,
+)
+
+# Close matches suggested when a grouping value is not found
+SUGGESTED_MATCHES = 3
+# Distinct values of a grouping listed in the description for the agents
+DESCRIPTION_MAX_VALUES = 30
+
+_profiles: dict[Path, tuple[str, "DatasetProfile"]] = {}
+_profiles_lock = Lock()
+
+
+class InvalidRequestError(ValueError):
+    """The grouping value of a request is not in the data."""
+
+
+@dataclass
+class DatasetProfile:
+    """Summary of a version of a data source."""
+
+    data_source_name: str
+    row_count: int
+    columns: dict[str, str]
+    first_month: int | None
+    last_month: int | None
+    # Functional currency sales by entity currency
+    functional_sales: dict[str, float]
+    reporting_sales: float
+    # Distinct values of each grouping, from their normalized to their original form
+    grouping_values: dict[SalesGroupingsEnum, dict[str, str]] = field(
+        default_factory=dict
+    )
+
+    def get_close_matches(self, grouping: SalesGroupingsEnum, value: str) -> list[str]:
+        """Values of a grouping similar to the given one, e.g. "CALIFORNIA" for "Califonia"."""
+        values = self.grouping_values[grouping]
+        return [
+            values[match]
+            for match in difflib.get_close_matches(
+                normalize_grouping_value(value), values, n=SUGGESTED_MATCHES
+            )
+        ]
+
+    def resolve_grouping_value(self, grouping: SalesGroupingsEnum, value: str) -> str:
+        """
+        Get the value of a grouping as it is written in the data.
+
+        Values are matched ignoring case and surrounding spaces, so e.g.
+        " madrid" resolves to "MADRID".
+
+        Raises:
+            InvalidRequestError: If the value is not in the data, suggesting close
+                matches.
+        """
+        resolved = self.grouping_values[grouping].get(normalize_grouping_value(value))
+        if resolved is not None:
+            return resolved
+
+        message = f"There is no {grouping.value} '{value}' in {self.data_source_name}."
+        close_matches = self.get_close_matches(grouping, value)
+        if close_matches:
+            message += f" Did you mean: {', '.join(close_matches)}?"
+        raise InvalidRequestError(message)
+
+    def describe(self) -> str:
+        """Describe the profile for the agents, in markdown."""
+        lines = [f"- Rows: {self.row_count:,}"]
+        if self.first_month is not None and self.last_month is not None:
+            lines.append(
+                f"- Invoices from {format_month(self.first_month)} "
+                f"to {format_month(self.last_month)} (inclusive)"
+            )
+        for currency, sales in self.functional_sales.items():
+            lines.append(f"- Total sales in {currency} (functional currency): {sales:,.2f}")
+        lines.append(f"- Total sales in reporting currency: {self.reporting_sales:,.2f}")
+        lines.append(
+            "- Columns: "
+            + ", ".join(f"{column} ({dtype})" for column, dtype in self.columns.items())
+        )
+        for grouping, column in SALES_GROUPING_COLUMNS.items():
+            values = sorted(self.grouping_values[grouping].values())
+            listed = ", ".join(values[:DESCRIPTION_MAX_VALUES])
+            if len(values) > DESCRIPTION_MAX_VALUES:
+                listed += f", ... ({len(values) - DESCRIPTION_MAX_VALUES} more)"
+            lines.append(f"- {column}: {len(values)} distinct values: {listed}")
+        return "\n".join(lines)
+
+
+def format_month(month_index: int) -> str:
+    """Format a month index as "YYYY-MM"."""
+    return f"{month_index // 12}-{month_index % 12 + 1:02d}"
+
+
+def build_dataset_profile(data_source: LocalDataSource) -> DatasetProfile:
+    """
+    Profile a data source from its Parquet cache and sales cube.
+
+    The row count and column types are read from the metadata of the cache,
+    and everything else from the sales cube, so no invoice level data is read.
+    """
+    dataset = ds.dataset(
+        data_source.ensure_cache(), format="parquet", partitioning="hive"
+    )
+    columns = {column.name: str(column.type) for column in dataset.schema}
+
+    cube_data = get_sales_cube(data_source).data
+    month_index = get_month_index(
+        cube_data[INVOICE_YEAR_COLUMN].astype(int),
+        cube_data[INVOICE_MONTH_COLUMN].astype(int),
+    )
+    functional_sales = cube_data.groupby(ENTITY_CURRENCY_COLUMN, observed=True)[
+        FUNCTIONAL_SALES_COLUMN
+    ].sum()
+
+    grouping_values = {}
+    for grouping, column in SALES_GROUPING_COLUMNS.items():
+        values = pd.Series(cube_data[column].dropna().astype(str).unique())
+        grouping_values[grouping] = dict(
+            zip(values.str.strip().str.upper(), values.str.strip())
+        )
+
+    return DatasetProfile(
+        data_source_name=data_source.name,
+        row_count=dataset.count_rows(),
+        columns=columns,
+        first_month=int(month_index.min()) if not cube_data.empty else None,
+        last_month=int(month_index.max()) if not cube_data.empty else None,
+        functional_sales={
+            str(currency): float(sales) for currency, sales in functional_sales.items()
+        },
+        reporting_sales=float(cube_data[REPORTING_SALES_COLUMN].sum()),
+        grouping_values=grouping_values,
+    )
+
+
+def get_dataset_profile(data_source: LocalDataSource = INTERNAL_DATA) -> DatasetProfile:
+    """
+    Get the profile of a data source, building it once per version of the data.
+
+    Raises:
+        FileNotFoundError: If the data source file does not exist.
+    """
+    with _profiles_lock:
+        cache_hash = get_cache_hash(data_source.ensure_cache())
+        cached = _profiles.get(data_source.cache_path)
+        if cached is not None and cached[0] == cache_hash:
+            return cached[1]
+
+        profile = build_dataset_profile(data_source)
+        _profiles[data_source.cache_path] = (cache_hash, profile)
+        return profile
+
+
+def describe_dataset_profile(data_source: LocalDataSource = INTERNAL_DATA) -> str:
+    """Describe the profile of a data source for the prompts of the agents."""
+    try:
+        return get_dataset_profile(data_source).describe()
+    except Exception as e:
+        default_logger.warning(
+            f"Could not profile {data_source.name}, prompts won't include it: {str(e)}"
+        )
+        return "The profile of the data is not available."
+
+
+def validate_sales_report_request(
+    request: SalesReportRequest, data_source: LocalDataSource = INTERNAL_DATA
+) -> SalesReportRequest:
+    """
+    Check the grouping value of a request against the data, before running the report.
+
+    Each value of a request covering several values is checked.
+
+    Returns:
+        SalesReportRequest: The request, with the grouping value written as in the
+            data (e.g. "MADRID" instead of "Madrid").
+
+    Raises:
+        InvalidRequestError: If a grouping value is not in the data.
+        FileNotFoundError: If the data source file does not exist.
+    """
+    if request.grouping is None or request.grouping_value is None:
+        return request
+    if request.is_multi_value and not request.grouping_values:
+        # Covers all the values of the grouping, whatever they are
+        return request
+
+    profile = get_dataset_profile(data_source)
+    resolved = f"{GROUPING_VALUES_SEPARATOR} ".join(
+        profile.resolve_grouping_value(request.grouping, value)
+        for value in request.grouping_values
+    )
+    if resolved == request.grouping_value:
+        return request
+    default_logger.info(
+        f"Using the {request.grouping.value} '{resolved}' of the data for '{request.grouping_value}'."
+    )
+    return request.model_copy(update={"grouping_value": resolved})
@@ -0,0 +1,314 @@
+"""
+Sales history of a request covering several values of its grouping, e.g. every country.
+
+Such a request produces a single report, map-reduce style, instead of running
+the whole report once per value:
+
+- the history of all its values is extracted once, in a single groupby over
+  the sales cube, and summarized per value (sales of the last period, change
+  from the previous period and from a year before, share of the total),
+- only the values that stand out in the summary, the largest and the ones that
+  changed the most, get an in-depth sub-analysis by the quantitative agent, on
+  a history file of their own,
+- the summary and the sub-analyses are consolidated into one report.
+
+The number of sub-analyses is capped by app_settings.grouped_report_max_sub_analyses,
+so the cost of a report does not grow with the number of values it covers; see
+process_sales_data in src/agents/report_graph.py.
+"""
+
+import re
+import shutil
+from datetime import date
+from itertools import chain, zip_longest
+from pathlib import Path
+
+import pandas as pd
+
+from src.configuration.constants import (
+    ENTITY_CURRENCY_COLUMN,
+    INTERNAL_DATA,
+    SALES_GROUPING_COLUMNS,
+    LocalDataSource,
+)
+from src.configuration.db_models import SalesReportRequest
+from src.data_engine.sales_cube import PERIOD_COLUMNS, PERIOD_MONTHS, get_sales_cube
+from src.data_engine.sales_history import (
+    format_sales_history,
+    get_history_window,
+    get_sales_column,
+)
+
+LAST_PERIOD_SALES_COLUMN = "LAST_PERIOD_SALES"
+PREVIOUS_PERIOD_CHANGE_COLUMN = "PREVIOUS_PERIOD_CHANGE_PCT"
+YEAR_OVER_YEAR_CHANGE_COLUMN = "YEAR_OVER_YEAR_CHANGE_PCT"
+SHARE_COLUMN = "SHARE_OF_TOTAL_PCT"
+HISTORY_SALES_COLUMN = "HISTORY_SALES"
+# Rows of the summary included in the description for the agents
+DESCRIPTION_MAX_ROWS = 30
+
+
+def get_sales_summary_location(request: SalesReportRequest, output_dir: Path) -> Path:
+    """Path of the csv file with the summary of the sales of each value of a request."""
+    return output_dir / f"{request.short_name}_sales_summary.csv"
+
+
+def get_value_name(value: str) -> str:
+    """Name of a grouping value usable in file names, e.g. united_kingdom."""
+    return re.sub(r"\W+", "_", value.lower()).strip("_")
+
+
+def get_value_sales_history_location(
+    request: SalesReportRequest, value: str, output_dir: Path
+) -> Path:
+    """Path of the csv file with the sales history of one value of a request."""
+    return output_dir / f"{request.short_name}_{get_value_name(value)}_sales_history.csv"
+
+
+def get_sub_analysis_dir(value: str, output_dir: Path) -> Path:
+    """
+    Directory of the files of the sub-analysis of one value, created if needed.
+
+    The sub-analyses run at the same time and their agents tend to use the
+    same file names, e.g. sales_trend.png, so each one saves its files apart.
+    """
+    path = output_dir / f"{get_value_name(value)}_analysis"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def collect_sub_analysis_files(
+    value: str, analysis: str, sub_analysis_dir: Path
+) -> str:
+    """
+    Move the files of the sub-analysis of one value next to the other files of
+    the request, with the name of the value as prefix, so the report can refer
+    to them by name.
+
+    Args:
+        value (str): The grouping value of the sub-analysis.
+        analysis (str): The analysis, mentioning its files by name.
+        sub_analysis_dir (Path): The directory of the files of the sub-analysis,
+            see get_sub_analysis_dir.
+
+    Returns:
+        str: The analysis, mentioning the files by their new names.
+    """
+    prefix = f"{get_value_name(value)}_"
+    for path in sorted(sub_analysis_dir.iterdir()):
+        if not path.is_file():
+            continue
+        name = path.name if path.name.startswith(prefix) else prefix + path.name
+        path.replace(sub_analysis_dir.parent / name)
+        analysis = re.sub(
+            rf"(?<![\w\-]){re.escape(path.name)}\b",
+            lambda _: name,
+            analysis,
+        )
+    shutil.rmtree(sub_analysis_dir, ignore_errors=True)
+    return analysis
+
+
+def extract_grouped_sales_history(
+    request: SalesReportRequest,
+    analysis_date: date,
+    data_source: LocalDataSource = INTERNAL_DATA,
+) -> pd.DataFrame:
+    """
+    Extract the last three years of sales of every value of a request, in one groupby.
+
+    Args:
+        request (SalesReportRequest): The request, covering several values of its grouping.
+        analysis_date (date): The date of the analysis; its month is not included.
+        data_source (LocalDataSource): The internal data source.
+
+    Returns:
+        pd.DataFrame: The sales per grouping value (in the column of the grouping)
+            and period, sorted by value and period.
+
+    Raises:
+        FileNotFoundError: If the internal data file does not exist.
+        ValueError: If there is no data for the request in the history window.
+    """
+    start, end = get_history_window(request.period, analysis_date)
+    sales = get_sales_cube(data_source).get_grouped_sales(
+        request.grouping, request.grouping_values, request.period, start, end
+    )
+    if sales.empty:
+        raise ValueError(f"No sales data found for {request.name}.")
+
+    return format_sales_history(
+        sales, request, by=[SALES_GROUPING_COLUMNS[request.grouping]]
+    )
+
+
+def get_change(current: pd.Series, previous: pd.Series) -> pd.Series:
+    """Change from previous to current in percent, NaN when there were no previous sales."""
+    return ((current - previous) / previous.abs() * 100).where(previous != 0).round(2)
+
+
+def summarize_grouped_sales_history(
+    sales_history: pd.DataFrame, request: SalesReportRequest
+) -> pd.DataFrame:
+    """
+    Summarize the sales history of each value of a request, in vectorized form.
+
+    Returns:
+        pd.DataFrame: One row per grouping value (and entity currency, when the
+            history is split by it) with the sales of the last period, its
+            change from the previous period and from the same period a year
+            before, its share of the total and the sales of the whole history;
+            sorted by the sales of the last period, highest first.
+    """
+    column = SALES_GROUPING_COLUMNS[request.grouping]
+    keys = [key for key in (ENTITY_CURRENCY_COLUMN, column) if key in sales_history]
+    sales = sales_history.pivot_table(
+        index=keys,
+        columns=PERIOD_COLUMNS[request.period],
+        values=get_sales_column(request.currency),
+        aggfunc="sum",
+        fill_value=0.0,
+    )
+    periods = list(sales.columns)
+    periods_per_year = 12 // PERIOD_MONTHS[request.period]
+    last_sales = sales[periods[-1]]
+
+    summary = pd.DataFrame({LAST_PERIOD_SALES_COLUMN: last_sales})
+    summary[PREVIOUS_PERIOD_CHANGE_COLUMN] = (
+        get_change(last_sales, sales[periods[-2]]) if len(periods) > 1 else float("nan")
+    )
+    summary[YEAR_OVER_YEAR_CHANGE_COLUMN] = (
+        get_change(last_sales, sales[periods[-1 - periods_per_year]])
+        if len(periods) > periods_per_year
+        else float("nan")
+    )
+    if ENTITY_CURRENCY_COLUMN in keys:
+        totals = last_sales.groupby(level=ENTITY_CURRENCY_COLUMN).transform("sum")
+    else:
+        totals = last_sales.sum()
+    summary[SHARE_COLUMN] = (last_sales / totals * 100).round(2)
+    summary[HISTORY_SALES_COLUMN] = sales.sum(axis=1)
+    return summary.reset_index().sort_values(
+        [*keys[:-1], LAST_PERIOD_SALES_COLUMN], ascending=False
+    ).reset_index(drop=True)
+
+
+def store_grouped_sales_history(
+    request: SalesReportRequest,
+    analysis_date: date,
+    output_location: Path,
+    data_source: LocalDataSource = INTERNAL_DATA,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Extract and summarize the sales history of every value of a request, and
+    store both as csv files; the summary next to the history.
+
+    Args:
+        request (SalesReportRequest): The request, covering several values of its grouping.
+        analysis_date (date): The date of the analysis; its month is not included.
+        output_location (Path): Path of the csv file of the history to create.
+        data_source (LocalDataSource): The internal data source.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: The stored sales history and summary.
+    """
+    sales_history = extract_grouped_sales_history(request, analysis_date, data_source)
+    summary = summarize_grouped_sales_history(sales_history, request)
+    sales_history.to_csv(output_location, index=False)
+    summary.to_csv(
+        get_sales_summary_location(request, output_location.parent), index=False
+    )
+    return sales_history, summary
+
+
+def describe_grouped_sales_history(
+    request: SalesReportRequest,
+    sales_history: pd.DataFrame,
+    summary: pd.DataFrame,
+    output_location: Path,
+) -> str:
+    """Describe the stored sales history and summary of every value of a request."""
+    column = SALES_GROUPING_COLUMNS[request.grouping]
+    period_column = PERIOD_COLUMNS[request.period]
+    periods = sales_history[period_column].sort_values()
+    summary_location = get_sales_summary_location(request, output_location.parent)
+
+    description = (
+        f"The {request.description} was retrieved and saved to {output_location.name}.\n\n"
+        f"It contains one row per {column} and period, for {summary[column].nunique()} "
+        f"values of {column} from {periods.iloc[0]} to {periods.iloc[-1]}, "
+        f"with columns: {', '.join(sales_history.columns)}.\n\n"
+        f"The sales of each {column} were summarized and saved to {summary_location.name}, "
+        f"sorted by the sales of the last period ({periods.iloc[-1]}), highest first, "
+        "with their change from the previous period and from the same period of the "
+        f"previous year, and their share of the total sales:\n\n"
+        f"{summary.head(DESCRIPTION_MAX_ROWS).to_string(index=False)}"
+    )
+    if len(summary) > DESCRIPTION_MAX_ROWS:
+        description += f"\n\n... ({len(summary) - DESCRIPTION_MAX_ROWS} more rows)"
+    return description
+
+
+def select_sub_analysis_values(
+    summary: pd.DataFrame, request: SalesReportRequest, max_values: int
+) -> list[str]:
+    """
+    Pick the values of a request that get an in-depth sub-analysis.
+
+    The largest values, by share of the sales of the last period, alternate
+    with the ones that changed the most from a year before.
+
+    Returns:
+        list[str]: At most max_values grouping values, in order of selection.
+    """
+    column = SALES_GROUPING_COLUMNS[request.grouping]
+    largest = summary.sort_values(SHARE_COLUMN, ascending=False)[column]
+    movers = summary.loc[
+        summary[YEAR_OVER_YEAR_CHANGE_COLUMN]
+        .abs()
+        .sort_values(ascending=False, na_position="last")
+        .index,
+        column,
+    ]
+    selected = []
+    for value in chain.from_iterable(zip_longest(largest, movers)):
+        if value is not None and value not in selected:
+            selected.append(value)
+    return selected[:max_values]
+
+
+def store_sub_analysis_histories(
+    request: SalesReportRequest, output_location: Path, max_values: int
+) -> dict[str, Path]:
+    """
+    Store the sales history of each value of a request selected for a sub-analysis.
+
+    Args:
+        request (SalesReportRequest): The request, covering several values of its grouping.
+        output_location (Path): The csv file of the history of all the values,
+            with the summary next to it, see store_grouped_sales_history.
+        max_values (int): The maximum number of values to select.
+
+    Returns:
+        dict[str, Path]: The csv file of the history of each selected value, in
+            order of selection.
+
+    Raises:
+        FileNotFoundError: If the history or the summary was not stored.
+        KeyError: If they don't have the expected columns.
+    """
+    column = SALES_GROUPING_COLUMNS[request.grouping]
+    period_column = PERIOD_COLUMNS[request.period]
+    sales_history = pd.read_csv(output_location, dtype={period_column: str})
+    summary = pd.read_csv(get_sales_summary_location(request, output_location.parent))
+    values = select_sub_analysis_values(summary, request, max_values)
+
+    locations = {}
+    selected_history = sales_history.loc[sales_history[column].isin(values)]
+    for value, sales in selected_history.groupby(column, sort=False):
+        location = get_value_sales_history_location(
+            request, value, output_location.parent
+        )
+        sales.drop(columns=column).to_csv(location, index=False)
+        locations[value] = location
+    return {value: locations[value] for value in values if value in locations}
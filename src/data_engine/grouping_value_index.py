@@ -0,0 +1,176 @@
+"""
+In-memory index of the grouping values of the internal data, for autocompletion.
+
+Values are matched by prefix first, with a binary search over the sorted values,
+and then by similarity, with an inverted index of their trigrams, so a search
+among tens of thousands of values takes a few milliseconds. The index is built
+from the dataset profile (see src/data_engine/dataset_profile.py) and is only
+rebuilt when the data file changes. Profiling a new version of the data can take
+a while, so the index is then rebuilt in a background thread, and searches use
+the previous index until the new one is ready.
+"""
+
+import bisect
+from collections import Counter
+from pathlib import Path
+from threading import Lock, Thread
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.db_models import SalesGroupingsEnum
+from src.configuration.logger import default_logger
+from src.data_engine.dataset_profile import get_dataset_profile
+from src.data_engine.sales_cube import normalize_grouping_value
+
+# Share of the trigrams of the query a value must have to be a fuzzy match
+MIN_TRIGRAM_SIMILARITY = 0.3
+
+_indexes: dict[Path, tuple[tuple[int, int], "GroupingValueIndex"]] = {}
+_indexes_lock = Lock()
+# Data files whose index is being rebuilt in the background
+_rebuilding: set[Path] = set()
+# Held while building an index, so it is only built once at a time
+_build_lock = Lock()
+
+
+def get_trigrams(value: str) -> set[str]:
+    """Trigrams of a normalized value, padded so the start of the value weighs more."""
+    padded = f"  {value} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class _GroupingIndex:
+    """Index of the values of a single grouping."""
+
+    def __init__(self, values: dict[str, str]):
+        # Normalized values, sorted for the prefix search, and their original form
+        self.normalized = sorted(values)
+        self.original = [values[value] for value in self.normalized]
+        self.trigrams: dict[str, list[int]] = {}
+        for position, value in enumerate(self.normalized):
+            for trigram in get_trigrams(value):
+                self.trigrams.setdefault(trigram, []).append(position)
+
+    def search_prefix(self, query: str, limit: int) -> list[int]:
+        start = bisect.bisect_left(self.normalized, query)
+        end = bisect.bisect_right(self.normalized, query + "\uffff", lo=start)
+        return list(range(start, min(end, start + limit)))
+
+    def search_similar(self, query: str, limit: int) -> list[int]:
+        query_trigrams = get_trigrams(query)
+        counts = Counter()
+        for trigram in query_trigrams:
+            counts.update(self.trigrams.get(trigram, ()))
+        min_count = MIN_TRIGRAM_SIMILARITY * len(query_trigrams)
+        return [
+            position
+            for position, count in counts.most_common(limit)
+            if count >= min_count
+        ]
+
+
+class GroupingValueIndex:
+    """Prefix and fuzzy search over the values of each grouping."""
+
+    def __init__(self, grouping_values: dict[SalesGroupingsEnum, dict[str, str]]):
+        self._indexes = {
+            grouping: _GroupingIndex(values)
+            for grouping, values in grouping_values.items()
+        }
+
+    def search(
+        self, grouping: SalesGroupingsEnum, query: str, limit: int = 10
+    ) -> list[str]:
+        """
+        Find the values of a grouping matching a query, ignoring case.
+
+        Values starting with the query come first, in alphabetical order,
+        followed by the most similar values, e.g. "CALIFORNIA" for "Califonia".
+
+        Args:
+            grouping (SalesGroupingsEnum): The grouping to search the values of.
+            query (str): The text typed so far.
+            limit (int): Maximum number of values returned.
+
+        Returns:
+            list[str]: The matching values, as written in the data.
+        """
+        index = self._indexes[grouping]
+        query = normalize_grouping_value(query)
+        if not query:
+            return index.original[:limit]
+
+        positions = index.search_prefix(query, limit)
+        if len(positions) < limit:
+            for position in index.search_similar(query, limit):
+                if position not in positions:
+                    positions.append(position)
+        return [index.original[position] for position in positions[:limit]]
+
+
+def _get_source_version(data_source: LocalDataSource) -> tuple[int, int]:
+    source_stat = data_source.path.stat()
+    return source_stat.st_size, source_stat.st_mtime_ns
+
+
+def build_grouping_value_index(data_source: LocalDataSource) -> GroupingValueIndex:
+    """
+    Build the grouping value index of a data source and make it the current one.
+
+    Raises:
+        FileNotFoundError: If the data source file does not exist.
+    """
+    with _build_lock:
+        # Read before profiling, so a change made meanwhile triggers another rebuild
+        source_version = _get_source_version(data_source)
+        with _indexes_lock:
+            cached = _indexes.get(data_source.path)
+        if cached is not None and cached[0] == source_version:
+            return cached[1]
+
+        index = GroupingValueIndex(get_dataset_profile(data_source).grouping_values)
+        with _indexes_lock:
+            _indexes[data_source.path] = (source_version, index)
+        return index
+
+
+def _rebuild_grouping_value_index(data_source: LocalDataSource) -> None:
+    try:
+        build_grouping_value_index(data_source)
+    except Exception as e:
+        default_logger.warning(
+            f"Could not rebuild the grouping value index of {data_source.name}, "
+            f"the previous one is still used: {str(e)}"
+        )
+    finally:
+        with _indexes_lock:
+            _rebuilding.discard(data_source.path)
+
+
+def get_grouping_value_index(
+    data_source: LocalDataSource = INTERNAL_DATA,
+) -> GroupingValueIndex:
+    """
+    Get the grouping value index of a data source, rebuilding it when the file changes.
+
+    Only the size and modification time of the file are checked on each call,
+    so searches never read the data itself. When the file changed, the index is
+    rebuilt in a background thread and the previous one is returned meanwhile;
+    it is only built in the calling thread if there is no previous index.
+
+    Raises:
+        FileNotFoundError: If the data source file does not exist.
+    """
+    source_version = _get_source_version(data_source)
+    with _indexes_lock:
+        cached = _indexes.get(data_source.path)
+        if cached is not None:
+            if cached[0] != source_version and data_source.path not in _rebuilding:
+                _rebuilding.add(data_source.path)
+                Thread(
+                    target=_rebuild_grouping_value_index,
+                    args=(data_source,),
+                    daemon=True,
+                ).start()
+            return cached[1]
+
+    return build_grouping_value_index(data_source)
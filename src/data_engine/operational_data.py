@@ -0,0 +1,263 @@
+"""
+Deterministic breakdowns of the sales of the last period of a request.
+
+The retrieve_operational_data step breaks the sales of the last period down by
+geography, product and customer. The breakdowns are computed here with the
+chunked aggregation engine, so the internal data agent can focus on analysing
+them instead of filtering the invoice level data itself.
+"""
+
+from datetime import date
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+
+from src.configuration.constants import (
+    CUSTOMER_ID_COLUMN,
+    DISCOUNT_AMOUNT_COLUMN,
+    ENTITY_CURRENCY_COLUMN,
+    FUNCTIONAL_SALES_COLUMN,
+    GROSS_AMOUNT_COLUMN,
+    INTERNAL_DATA,
+    INVOICE_MONTH_COLUMN,
+    INVOICE_YEAR_COLUMN,
+    ITEM_CODE_COLUMN,
+    REPORTING_SALES_COLUMN,
+    SALES_GROUPING_COLUMNS,
+    LocalDataSource,
+)
+from src.configuration.db_models import (
+    KpiPeriodsEnum,
+    SalesCurrencyEnum,
+    SalesReportRequest,
+)
+from src.data_engine.chunked_aggregation import aggregate_in_chunks
+from src.data_engine.sales_cube import PERIOD_MONTHS, get_month_index
+from src.data_engine.sales_history import get_sales_column
+
+# Columns the sales of the last period are broken down by
+BREAKDOWN_COLUMNS = [
+    *SALES_GROUPING_COLUMNS.values(),
+    ITEM_CODE_COLUMN,
+    CUSTOMER_ID_COLUMN,
+]
+BREAKDOWN_COLUMN = "BREAKDOWN"
+VALUE_COLUMN = "VALUE"
+SHARE_COLUMN = "SHARE_OF_TOTAL_PCT"
+# Rows of each breakdown included in the description for the agent
+DESCRIPTION_TOP_ROWS = 10
+
+
+def get_last_period_window(
+    period: KpiPeriodsEnum, analysis_date: date
+) -> tuple[int, int]:
+    """
+    Get the months of the last period before the analysis date, as month indexes.
+
+    The month of the analysis date is not complete, so the last period ends
+    before it; e.g. for quarterly requests on 2023-12-01, October and November.
+
+    Returns:
+        tuple[int, int]: The first month included and the first month excluded.
+    """
+    end = get_month_index(analysis_date.year, analysis_date.month)
+    last_month = end - 1
+    return last_month - last_month % PERIOD_MONTHS[period], end
+
+
+def is_partition_in_window(
+    partition_values: dict[str, int | str], start_month: int, end_month: int
+) -> bool:
+    """
+    Whether a partition of the internal data can hold invoices of a window of months.
+
+    The cache is partitioned by year and month, so usually only the files of
+    the months of the window are read; a partition without a month holds
+    invoices of any month of its year.
+    """
+    year = partition_values[INVOICE_YEAR_COLUMN]
+    month = partition_values.get(INVOICE_MONTH_COLUMN)
+    if month is None:
+        return start_month // 12 <= year <= (end_month - 1) // 12
+    return start_month <= get_month_index(year, month) < end_month
+
+
+def aggregate_breakdowns(
+    data: pd.DataFrame,
+    grouping_column: str | None,
+    grouping_values: list[str] | None,
+    start_month: int,
+    end_month: int,
+) -> pd.DataFrame:
+    """
+    Sum the sales of a chunk of invoices by each breakdown column.
+
+    Args:
+        data (pd.DataFrame): Invoice level data.
+        grouping_column (str | None): Column to filter by, None for total sales.
+        grouping_values (list[str] | None): Values of the grouping column to keep,
+            all of them if None or empty. The sales are also broken down by the
+            grouping column, unless a single value is kept.
+        start_month (int): First month included, as a month index.
+        end_month (int): First month excluded, as a month index.
+
+    Returns:
+        pd.DataFrame: Sales by breakdown, value and entity currency, in long format.
+    """
+    month_index = get_month_index(
+        data[INVOICE_YEAR_COLUMN], data[INVOICE_MONTH_COLUMN]
+    )
+    mask = (month_index >= start_month) & (month_index < end_month)
+    if grouping_column is not None and grouping_values:
+        mask &= (
+            data[grouping_column]
+            .astype(str)
+            .str.strip()
+            .str.upper()
+            .isin([value.strip().upper() for value in grouping_values])
+        )
+    data = data.loc[mask]
+
+    sales = pd.DataFrame(
+        {
+            ENTITY_CURRENCY_COLUMN: data[ENTITY_CURRENCY_COLUMN],
+            FUNCTIONAL_SALES_COLUMN: data[FUNCTIONAL_SALES_COLUMN],
+            REPORTING_SALES_COLUMN: data[GROSS_AMOUNT_COLUMN]
+            - data[DISCOUNT_AMOUNT_COLUMN],
+        }
+    )
+    breakdowns = [
+        sales.assign(
+            **{BREAKDOWN_COLUMN: column, VALUE_COLUMN: data[column].astype(str)}
+        )
+        for column in BREAKDOWN_COLUMNS
+        if column != grouping_column or len(grouping_values or []) != 1
+    ]
+    return combine_breakdowns(breakdowns)
+
+
+def combine_breakdowns(breakdowns: list[pd.DataFrame]) -> pd.DataFrame:
+    """Sum several breakdowns in long format into a single one."""
+    return pd.concat(breakdowns, ignore_index=True).groupby(
+        [BREAKDOWN_COLUMN, VALUE_COLUMN, ENTITY_CURRENCY_COLUMN],
+        as_index=False,
+        dropna=False,
+    )[[FUNCTIONAL_SALES_COLUMN, REPORTING_SALES_COLUMN]].sum()
+
+
+def format_breakdown(
+    breakdowns: pd.DataFrame, column: str, currency: SalesCurrencyEnum
+) -> pd.DataFrame:
+    """
+    Get the breakdown by one column, in the currency of the request.
+
+    Sales are sorted from highest to lowest, with their share of the total;
+    functional currency sales are split by entity currency if there are several.
+    """
+    sales_column = get_sales_column(currency)
+    breakdown = breakdowns.loc[breakdowns[BREAKDOWN_COLUMN] == column].rename(
+        columns={VALUE_COLUMN: column}
+    )
+    group_columns = [column]
+    if (
+        currency == SalesCurrencyEnum.FUNCTIONAL
+        and breakdown[ENTITY_CURRENCY_COLUMN].nunique() > 1
+    ):
+        group_columns.insert(0, ENTITY_CURRENCY_COLUMN)
+
+    breakdown = breakdown.groupby(group_columns, as_index=False)[sales_column].sum()
+    if ENTITY_CURRENCY_COLUMN in group_columns:
+        totals = breakdown.groupby(ENTITY_CURRENCY_COLUMN)[sales_column].transform("sum")
+    else:
+        totals = breakdown[sales_column].sum()
+    breakdown[SHARE_COLUMN] = (breakdown[sales_column] / totals * 100).round(2)
+    return breakdown.sort_values(
+        [*group_columns[:-1], sales_column], ascending=False
+    ).reset_index(drop=True)
+
+
+def get_breakdown_location(
+    request: SalesReportRequest, column: str, output_dir: Path
+) -> Path:
+    """Path of the csv file with a breakdown of the sales of a request."""
+    return output_dir / f"{request.short_name}_last_period_sales_by_{column.lower()}.csv"
+
+
+def store_operational_breakdowns(
+    request: SalesReportRequest,
+    analysis_date: date,
+    output_dir: Path,
+    data_source: LocalDataSource = INTERNAL_DATA,
+) -> dict[str, pd.DataFrame]:
+    """
+    Break down the sales of the last period of a request and store each breakdown as csv.
+
+    Only the partitions of the months of the last period are read, chunk by chunk.
+
+    Args:
+        request (SalesReportRequest): The request defining grouping, period and currency.
+        analysis_date (date): The date of the analysis; its month is not included.
+        output_dir (Path): Directory where the csv files are stored.
+        data_source (LocalDataSource): The internal data source.
+
+    Returns:
+        dict[str, pd.DataFrame]: The breakdowns, by the column they break the sales down by.
+
+    Raises:
+        FileNotFoundError: If the internal data file does not exist.
+        ValueError: If there are no sales for the request in the last period.
+    """
+    start, end = get_last_period_window(request.period, analysis_date)
+    grouping_column = (
+        SALES_GROUPING_COLUMNS[request.grouping] if request.grouping else None
+    )
+    breakdowns = aggregate_in_chunks(
+        data_source,
+        aggregate=partial(
+            aggregate_breakdowns,
+            grouping_column=grouping_column,
+            grouping_values=request.grouping_values,
+            start_month=start,
+            end_month=end,
+        ),
+        combine=combine_breakdowns,
+        columns=[
+            INVOICE_YEAR_COLUMN,
+            INVOICE_MONTH_COLUMN,
+            ENTITY_CURRENCY_COLUMN,
+            FUNCTIONAL_SALES_COLUMN,
+            GROSS_AMOUNT_COLUMN,
+            DISCOUNT_AMOUNT_COLUMN,
+            *BREAKDOWN_COLUMNS,
+        ],
+        partition_filter=partial(is_partition_in_window, start_month=start, end_month=end),
+    )
+    if breakdowns.empty:
+        raise ValueError(f"No sales data found for {request.name} in the last period.")
+
+    stored_breakdowns = {}
+    for column in breakdowns[BREAKDOWN_COLUMN].unique():
+        breakdown = format_breakdown(breakdowns, column, request.currency)
+        breakdown.to_csv(get_breakdown_location(request, column, output_dir), index=False)
+        stored_breakdowns[column] = breakdown
+    return stored_breakdowns
+
+
+def describe_operational_breakdowns(
+    request: SalesReportRequest,
+    breakdowns: dict[str, pd.DataFrame],
+    output_dir: Path,
+) -> str:
+    """Describe the stored breakdowns, with their top rows, for the internal data agent."""
+    descriptions = [
+        "The sales of the last period have already been broken down and saved to csv files, "
+        "sorted from highest to lowest sales, with their share of the total sales:"
+    ]
+    for column, breakdown in breakdowns.items():
+        file_name = get_breakdown_location(request, column, output_dir).name
+        descriptions.append(
+            f"- By {column}, saved to {file_name} ({len(breakdown)} rows); top rows:\n\n"
+            f"{breakdown.head(DESCRIPTION_TOP_ROWS).to_string(index=False)}"
+        )
+    return "\n\n".join(descriptions)
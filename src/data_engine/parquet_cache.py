@@ -0,0 +1,543 @@
+"""
+Columnar cache of local csv data sources.
+
+Parsing a large csv file means re-detecting dtypes and keeping every string
+column as python objects. The first time a data source is used, it is
+converted to a compressed Parquet dataset, optionally partitioned by columns
+such as INVOICE_YEAR and INVOICE_MONTH; when loaded, low cardinality string
+columns are read as categoricals and integers are downcast.
+
+The source is read in chunks of app_settings.data_chunk_rows rows, so files
+larger than the available memory can be converted. Each chunk is written to
+its own file, which also lets the data be processed file by file (see
+src/data_engine/chunked_aggregation.py).
+
+The cache is refreshed when the hash of the source file changes. The content
+of each partition is hashed as well, and only the partitions that are new or
+changed are written again; e.g. when a month of invoices is appended, only
+that month is rewritten, and the aggregates built from the cache can also be
+refreshed for that month only (see src/data_engine/sales_cube.py). The csv is
+only parsed once per refresh: the chunks parsed while hashing the partitions
+are spooled to Arrow files, and those holding rows of the changed partitions
+are read back from there.
+
+The agent process, the kernels of the code tool and the workers of the
+aggregations can all find the cache outdated at the same time, so it is built
+holding a lock file shared by the processes, see lock_cache.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from threading import RLock
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from src.configuration.logger import default_logger
+from src.configuration.settings import app_settings
+
+# File in the cache directory describing the source it was built from;
+# pyarrow ignores files starting with an underscore when reading the dataset
+MANIFEST_FILE_NAME = "_source.json"
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+CSV_ENCODING = "ISO-8859-1"
+# Directory of the build where the parsed chunks are spooled, ignored by pyarrow
+SPOOL_DIR_NAME = "_spool"
+# Arrow type of each dtype inferred by scan_csv
+ARROW_TYPES = {
+    "int64": pa.int64(),
+    "float64": pa.float64(),
+    "bool": pa.bool_(),
+    "str": pa.string(),
+}
+
+# Held with the lock file, as flock doesn't exclude the threads of a process
+# using the same file; reentrant, as a cache can be built while holding the
+# lock of a cache built from it, e.g. the sales cube
+_cache_lock = RLock()
+
+
+@contextmanager
+def lock_cache(cache_path: Path):
+    """
+    Hold the lock of a cache, shared by the threads and processes building it.
+
+    The lock is a file next to the cache; a process waiting for it must check
+    again whether the cache is up to date once it has it, as the process that
+    held it may just have built it.
+    """
+    lock_path = cache_path.with_name(f"{cache_path.name}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with _cache_lock, open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_file_hash(path: Path) -> str:
+    """Compute the sha256 hash of a file, reading it in chunks."""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_partition_key(partition_values: dict) -> str:
+    """
+    Key of a partition, which is also its directory in the dataset,
+    e.g. "INVOICE_YEAR=2023/INVOICE_MONTH=11".
+    """
+    return "/".join(f"{column}={value}" for column, value in partition_values.items())
+
+
+def read_csv_chunks(
+    source_path: Path,
+    chunk_rows: int,
+    dtypes: dict[str, str] | None = None,
+):
+    """Iterate over a csv file in dataframes of at most chunk_rows rows."""
+    return pd.read_csv(
+        source_path,
+        encoding=CSV_ENCODING,
+        dtype=dtypes,
+        chunksize=chunk_rows,
+        low_memory=False,
+    )
+
+
+def iterate_partitions(chunk: pd.DataFrame, partition_columns: list[str]):
+    """Iterate over the rows of a chunk of each partition, as (key, rows) tuples."""
+    if not partition_columns:
+        yield "", chunk
+        return
+    for values, rows in chunk.groupby(partition_columns, sort=False):
+        yield get_partition_key(dict(zip(partition_columns, values))), rows
+
+
+@dataclass
+class CsvScan:
+    """Content of a csv file, as found by scan_csv."""
+
+    # Dtype of each column
+    dtypes: dict[str, str]
+    # Hash of the rows of each partition, by partition key
+    partition_hashes: dict[str, str]
+    # Keys of the partitions with rows in each chunk
+    chunk_partitions: list[set[str]]
+    # Columns with values parsed as numbers or booleans in each chunk
+    chunk_typed_columns: list[set[str]]
+
+
+def _get_spooled_chunk_path(spool_path: Path, index: int) -> Path:
+    return spool_path / f"chunk-{index:05d}.arrow"
+
+
+def scan_csv(
+    source_path: Path,
+    chunk_rows: int,
+    partition_columns: list[str],
+    spool_path: Path | None = None,
+) -> CsvScan:
+    """
+    Infer the dtype of each column of a csv file and hash the content of each partition.
+
+    Each chunk is parsed independently, so a column can be read as integers in
+    one chunk and floats (e.g. because of missing values) in another; the widest
+    type is used for all of them, so every file of the cache has the same schema.
+
+    Args:
+        source_path (Path): Path to the csv file.
+        chunk_rows (int): Rows read at once.
+        partition_columns (list[str]): Columns the dataset is partitioned by.
+        spool_path (Path | None): Directory where each parsed chunk is written
+            as an Arrow file, to be read back by read_changed_chunks instead of
+            parsing the csv again.
+
+    Returns:
+        CsvScan: The dtypes, the hash of each partition and the content of each chunk.
+    """
+    kinds: dict[str, set[str]] = {}
+    partition_hashes: dict[str, "hashlib._Hash"] = {}
+    chunk_partitions = []
+    chunk_typed_columns = []
+    if spool_path is not None:
+        spool_path.mkdir(parents=True)
+    for index, chunk in enumerate(read_csv_chunks(source_path, chunk_rows)):
+        for column, dtype in chunk.dtypes.items():
+            kinds.setdefault(column, set()).add(dtype.kind)
+        row_hashes = pd.util.hash_pandas_object(chunk, index=False)
+        partitions = set()
+        for key, rows in iterate_partitions(chunk, partition_columns):
+            partition_hash = partition_hashes.setdefault(key, hashlib.sha256())
+            partition_hash.update(row_hashes.loc[rows.index].to_numpy().tobytes())
+            partitions.add(key)
+        chunk_partitions.append(partitions)
+        chunk_typed_columns.append(
+            {
+                column
+                for column, dtype in chunk.dtypes.items()
+                if dtype.kind != "O" and chunk[column].notna().any()
+            }
+        )
+        if spool_path is not None:
+            feather.write_feather(
+                pa.Table.from_pandas(chunk, preserve_index=False),
+                _get_spooled_chunk_path(spool_path, index),
+            )
+
+    dtypes = {}
+    for column, column_kinds in kinds.items():
+        if column_kinds == {"i"}:
+            dtypes[column] = "int64"
+        elif column_kinds <= {"i", "f"}:
+            dtypes[column] = "float64"
+        elif column_kinds == {"b"}:
+            dtypes[column] = "bool"
+        else:
+            dtypes[column] = "str"
+    return CsvScan(
+        dtypes=dtypes,
+        partition_hashes={
+            key: partition_hash.hexdigest()
+            for key, partition_hash in partition_hashes.items()
+        },
+        chunk_partitions=chunk_partitions,
+        chunk_typed_columns=chunk_typed_columns,
+    )
+
+
+def read_changed_chunks(
+    source_path: Path,
+    spool_path: Path,
+    scan: CsvScan,
+    chunk_rows: int,
+    changed_partitions: set[str],
+):
+    """
+    Iterate over the chunks of a csv file with rows of the changed partitions,
+    as (index, chunk) tuples, with the dtypes of the whole file.
+
+    The chunks are read back from the spool of scan_csv, unless a column of
+    strings was parsed as numbers in one of them, e.g. "007" as 7: the csv is
+    then parsed again, as the original values can't be recovered.
+    """
+    changed_chunks = [
+        index
+        for index, partitions in enumerate(scan.chunk_partitions)
+        if partitions & changed_partitions
+    ]
+    str_columns = {column for column, dtype in scan.dtypes.items() if dtype == "str"}
+    if any(scan.chunk_typed_columns[index] & str_columns for index in changed_chunks):
+        default_logger.info(
+            f"Parsing {source_path.name} again, as its columns have mixed types."
+        )
+        for index, chunk in enumerate(
+            read_csv_chunks(source_path, chunk_rows, scan.dtypes)
+        ):
+            if index in changed_chunks:
+                yield index, chunk
+        return
+
+    for index in changed_chunks:
+        chunk = feather.read_table(_get_spooled_chunk_path(spool_path, index)).to_pandas()
+        for column, dtype in scan.dtypes.items():
+            if dtype != "str":
+                chunk[column] = chunk[column].astype(dtype)
+            elif chunk[column].dtype.kind != "O":
+                # Empty in this chunk, so parsed as floats
+                chunk[column] = chunk[column].astype(object)
+        yield index, chunk
+
+
+def downcast_integers(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcast integer columns to the smallest type that holds their values.
+
+    Float columns are kept as float64, as they hold amounts that would lose
+    precision when aggregated as float32.
+    """
+    for column in data.columns:
+        if pd.api.types.is_integer_dtype(data[column]):
+            data[column] = pd.to_numeric(data[column], downcast="integer")
+    return data
+
+
+def _read_manifest(cache_path: Path) -> dict | None:
+    manifest_path = cache_path / MANIFEST_FILE_NAME
+    if not manifest_path.exists():
+        return None
+    return json.loads(manifest_path.read_text())
+
+
+def _write_manifest(cache_path: Path, manifest: dict) -> None:
+    # Replaced at once, as other processes read it without holding the lock
+    temp_path = cache_path / f"{MANIFEST_FILE_NAME}.{uuid.uuid4().hex}.tmp"
+    temp_path.write_text(json.dumps(manifest))
+    temp_path.replace(cache_path / MANIFEST_FILE_NAME)
+
+
+def get_cache_hash(cache_path: Path) -> str | None:
+    """Hash of the source file the cache was built from, or None if there is no cache."""
+    manifest = _read_manifest(cache_path)
+    return manifest["sha256"] if manifest else None
+
+
+def get_cache_partitions(cache_path: Path) -> dict[str, str]:
+    """Hash of the content of each partition of the cache, by partition key."""
+    manifest = _read_manifest(cache_path)
+    return manifest.get("partitions", {}) if manifest else {}
+
+
+def _link_partition(source_path: Path, target_path: Path) -> None:
+    """Reuse the files of an unchanged partition, without copying them if possible."""
+    try:
+        shutil.copytree(source_path, target_path, copy_function=os.link)
+    except OSError:
+        # Hard links are not supported by every file system
+        shutil.rmtree(target_path, ignore_errors=True)
+        shutil.copytree(source_path, target_path)
+
+
+def build_parquet_cache(
+    source_path: Path,
+    cache_path: Path,
+    partition_columns: list[str] | None = None,
+    source_hash: str | None = None,
+    chunk_rows: int | None = None,
+) -> None:
+    """
+    Convert a csv file to a Parquet dataset, reusing the unchanged partitions of
+    the existing cache, if any.
+
+    The dataset is written to a temporary directory first, so readers never
+    see a partially written cache; the directory is removed if the build fails.
+    It also holds the spool of the parsed chunks until the changed partitions
+    are written, so the build needs up to the size of the csv of free space.
+    Must be called holding lock_cache, as it reads the partitions to reuse from
+    the existing cache and replaces it.
+
+    Args:
+        source_path (Path): Path to the csv file.
+        cache_path (Path): Directory of the Parquet dataset.
+        partition_columns (list[str] | None): Columns to partition the dataset by.
+        source_hash (str | None): Hash of the source file, computed if not provided.
+        chunk_rows (int | None): Rows read at once, app_settings.data_chunk_rows if None.
+    """
+    partition_columns = partition_columns or []
+    chunk_rows = chunk_rows or app_settings.data_chunk_rows
+    source_hash = source_hash or get_file_hash(source_path)
+
+    # Left by builds that were killed, as only one build runs at a time
+    for stale_path in cache_path.parent.glob(f"{cache_path.name}.*.tmp"):
+        shutil.rmtree(stale_path, ignore_errors=True)
+
+    build_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+    build_path.mkdir(parents=True)
+    try:
+        spool_path = build_path / SPOOL_DIR_NAME
+        scan = scan_csv(source_path, chunk_rows, partition_columns, spool_path)
+        dtypes, partition_hashes = scan.dtypes, scan.partition_hashes
+
+        # Partitions can only be reused if they have the same schema and layout
+        manifest = _read_manifest(cache_path)
+        reusable_partitions = (
+            manifest["partitions"]
+            if manifest is not None
+            and partition_columns
+            and manifest.get("dtypes") == dtypes
+            and manifest.get("partition_columns") == partition_columns
+            else {}
+        )
+        changed_partitions = {
+            key
+            for key, partition_hash in partition_hashes.items()
+            if reusable_partitions.get(key) != partition_hash
+        }
+        default_logger.info(
+            f"Building the Parquet cache of {source_path.name}: writing "
+            f"{len(changed_partitions)} of {len(partition_hashes)} partitions."
+        )
+
+        # Set explicitly, as a column of strings that is empty in a chunk would
+        # otherwise be written with a null type the other files can't be read with
+        schema = pa.schema(
+            [(column, ARROW_TYPES[dtype]) for column, dtype in dtypes.items()]
+        )
+        for key in partition_hashes.keys() - changed_partitions:
+            _link_partition(cache_path / key, build_path / key)
+
+        for index, chunk in read_changed_chunks(
+            source_path, spool_path, scan, chunk_rows, changed_partitions
+        ):
+            changed_rows = [
+                rows
+                for key, rows in iterate_partitions(chunk, partition_columns)
+                if key in changed_partitions
+            ]
+            if partition_columns:
+                pd.concat(changed_rows).to_parquet(
+                    build_path,
+                    engine="pyarrow",
+                    compression="zstd",
+                    index=False,
+                    schema=schema,
+                    partition_cols=partition_columns,
+                    basename_template=f"chunk-{uuid.uuid4().hex[:8]}-{index:05d}-{{i}}.parquet",
+                )
+            else:
+                chunk.to_parquet(
+                    build_path / f"chunk-{index:05d}.parquet",
+                    engine="pyarrow",
+                    compression="zstd",
+                    index=False,
+                    schema=schema,
+                )
+        shutil.rmtree(spool_path)
+
+        source_stat = source_path.stat()
+        _write_manifest(
+            build_path,
+            {
+                "sha256": source_hash,
+                "size": source_stat.st_size,
+                "mtime_ns": source_stat.st_mtime_ns,
+                "dtypes": dtypes,
+                "partition_columns": partition_columns,
+                "partitions": partition_hashes,
+            },
+        )
+    except BaseException:
+        shutil.rmtree(build_path, ignore_errors=True)
+        raise
+
+    if cache_path.exists():
+        # Swapped by renames, so the cache is only missing for an instant
+        previous_path = cache_path.with_name(
+            f"{cache_path.name}.{uuid.uuid4().hex}.tmp"
+        )
+        cache_path.rename(previous_path)
+        build_path.rename(cache_path)
+        shutil.rmtree(previous_path, ignore_errors=True)
+    else:
+        build_path.rename(cache_path)
+
+
+def ensure_parquet_cache(
+    source_path: Path,
+    cache_path: Path,
+    partition_columns: list[str] | None = None,
+) -> Path:
+    """
+    Make sure the Parquet cache of a csv file exists and is up to date.
+
+    The source is only hashed if its size or modification time changed since
+    the cache was built, and the cache is only refreshed if the hash changed.
+
+    Args:
+        source_path (Path): Path to the csv file.
+        cache_path (Path): Directory of the Parquet dataset.
+        partition_columns (list[str] | None): Columns to partition the dataset by.
+
+    Returns:
+        Path: The directory of the Parquet dataset.
+
+    Raises:
+        FileNotFoundError: If the source file does not exist.
+    """
+    if not source_path.exists():
+        raise FileNotFoundError(f"The file {source_path} does not exist.")
+    if _is_cache_current(cache_path, source_path):
+        return cache_path
+
+    with lock_cache(cache_path):
+        # Another process may have built the cache while this one waited for the lock
+        if _is_cache_current(cache_path, source_path):
+            return cache_path
+
+        manifest = _read_manifest(cache_path)
+        source_stat = source_path.stat()
+        source_hash = get_file_hash(source_path)
+        if manifest is not None and manifest["sha256"] == source_hash:
+            # Only the modification time changed, e.g. the file was copied again
+            manifest.update(size=source_stat.st_size, mtime_ns=source_stat.st_mtime_ns)
+            _write_manifest(cache_path, manifest)
+            return cache_path
+
+        build_parquet_cache(
+            source_path,
+            cache_path,
+            partition_columns,
+            source_hash=source_hash,
+        )
+        return cache_path
+
+
+def _is_cache_current(cache_path: Path, source_path: Path) -> bool:
+    """Whether the size and modification time of the source match the cache."""
+    manifest = _read_manifest(cache_path)
+    source_stat = source_path.stat()
+    return (
+        manifest is not None
+        and manifest["size"] == source_stat.st_size
+        and manifest["mtime_ns"] == source_stat.st_mtime_ns
+    )
+
+
+def restore_partition_columns(
+    data: pd.DataFrame, partition_columns: list[str] | None
+) -> pd.DataFrame:
+    """Partition values are read back as categoricals, restore their original type."""
+    for column in partition_columns or []:
+        if column in data.columns:
+            partition_values = data[column]
+            data[column] = partition_values.astype(
+                partition_values.cat.categories.dtype
+            )
+    return data
+
+
+def read_parquet_cache(
+    cache_path: Path,
+    columns: list[str] | None = None,
+    filters: list[tuple] | None = None,
+    partition_columns: list[str] | None = None,
+    categorical_columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Read a Parquet dataset, loading only the requested columns and rows.
+
+    Args:
+        cache_path (Path): Directory of the Parquet dataset.
+        columns (list[str] | None): Columns to load, all of them if None.
+        filters (list[tuple] | None): Row filters in pyarrow format, e.g.
+            [("INVOICE_YEAR", ">=", 2021)]; filters on the partition columns
+            skip whole files.
+        partition_columns (list[str] | None): Columns the dataset is partitioned by.
+        categorical_columns (list[str] | None): Columns to load as categoricals.
+
+    Returns:
+        pd.DataFrame: The loaded data.
+    """
+    data = pd.read_parquet(
+        cache_path,
+        engine="pyarrow",
+        columns=columns,
+        filters=filters,
+        read_dictionary=[
+            column
+            for column in categorical_columns or []
+            if columns is None or column in columns
+        ],
+    )
+    return downcast_integers(restore_partition_columns(data, partition_columns))
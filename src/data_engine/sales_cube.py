@@ -0,0 +1,457 @@
+"""
+Precomputed aggregate of the internal sales data.
+
+Sales are summed by year, month, country, city, product family and entity
+currency, in both functional and reporting currency, once per version of the
+internal data. The cube is stored next to the Parquet cache of the data and
+indexed in memory by grouping value, so the sales of any grouping value and
+period are obtained without scanning the invoice level rows.
+
+When the data changes, only the partitions of the Parquet cache whose content
+changed are aggregated again and merged into the stored cube, as long as the
+cache is partitioned by dimensions of the cube (e.g. INVOICE_YEAR and
+INVOICE_MONTH).
+"""
+
+import json
+from pathlib import Path
+from threading import Lock
+
+import pandas as pd
+
+from src.configuration.constants import (
+    DISCOUNT_AMOUNT_COLUMN,
+    ENTITY_CURRENCY_COLUMN,
+    FUNCTIONAL_SALES_COLUMN,
+    GROSS_AMOUNT_COLUMN,
+    INTERNAL_DATA,
+    INVOICE_MONTH_COLUMN,
+    INVOICE_YEAR_COLUMN,
+    REPORTING_SALES_COLUMN,
+    SALES_GROUPING_COLUMNS,
+    LocalDataSource,
+)
+from src.configuration.db_models import KpiPeriodsEnum, SalesGroupingsEnum
+from src.configuration.logger import default_logger
+from src.data_engine.chunked_aggregation import aggregate_in_chunks
+from src.data_engine.parquet_cache import (
+    get_cache_hash,
+    get_cache_partitions,
+    get_partition_key,
+    lock_cache,
+)
+
+CUBE_DIMENSIONS = [
+    INVOICE_YEAR_COLUMN,
+    INVOICE_MONTH_COLUMN,
+    *SALES_GROUPING_COLUMNS.values(),
+    ENTITY_CURRENCY_COLUMN,
+]
+CUBE_MEASURES = [FUNCTIONAL_SALES_COLUMN, REPORTING_SALES_COLUMN]
+# Columns of the internal data needed to build the cube
+CUBE_SOURCE_COLUMNS = [
+    INVOICE_YEAR_COLUMN,
+    INVOICE_MONTH_COLUMN,
+    *SALES_GROUPING_COLUMNS.values(),
+    ENTITY_CURRENCY_COLUMN,
+    FUNCTIONAL_SALES_COLUMN,
+    GROSS_AMOUNT_COLUMN,
+    DISCOUNT_AMOUNT_COLUMN,
+]
+
+# Name of the period column of the rolled up sales, per periodicity
+PERIOD_COLUMNS: dict[KpiPeriodsEnum, str] = {
+    KpiPeriodsEnum.MONTHLY: "MONTH_YEAR",
+    KpiPeriodsEnum.QUARTERLY: "QUARTER_YEAR",
+    KpiPeriodsEnum.YEARLY: "YEAR",
+}
+
+# Number of months in each period
+PERIOD_MONTHS: dict[KpiPeriodsEnum, int] = {
+    KpiPeriodsEnum.MONTHLY: 1,
+    KpiPeriodsEnum.QUARTERLY: 3,
+    KpiPeriodsEnum.YEARLY: 12,
+}
+
+_cubes: dict[Path, tuple[str, "SalesCube"]] = {}
+_cubes_lock = Lock()
+
+
+def get_month_index(year: int | pd.Series, month: int | pd.Series) -> int | pd.Series:
+    """Number of months since year 0, used to compare and align months."""
+    return year * 12 + month - 1
+
+
+def normalize_grouping_value(value: str) -> str:
+    """Grouping values are matched ignoring case and surrounding spaces."""
+    return value.strip().upper()
+
+
+def aggregate_sales(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sum invoice level sales by the dimensions of the cube.
+
+    The result of aggregating parts of the data can be combined by aggregating
+    again with combine_sales_aggregates.
+
+    Args:
+        data (pd.DataFrame): Invoice level data, with the CUBE_SOURCE_COLUMNS.
+
+    Returns:
+        pd.DataFrame: The sales by CUBE_DIMENSIONS, with the CUBE_MEASURES.
+    """
+    sales = data[CUBE_DIMENSIONS].copy()
+    sales[FUNCTIONAL_SALES_COLUMN] = data[FUNCTIONAL_SALES_COLUMN]
+    sales[REPORTING_SALES_COLUMN] = (
+        data[GROSS_AMOUNT_COLUMN] - data[DISCOUNT_AMOUNT_COLUMN]
+    )
+    return combine_sales_aggregates([sales])
+
+
+def combine_sales_aggregates(aggregates: list[pd.DataFrame]) -> pd.DataFrame:
+    """Sum several sales aggregates with the cube's columns into a single one."""
+    combined = pd.concat(aggregates, ignore_index=True)
+    # Categoricals of different parts may have different categories
+    for column in CUBE_DIMENSIONS:
+        if isinstance(combined[column].dtype, pd.CategoricalDtype):
+            combined[column] = combined[column].astype(object)
+    return combined.groupby(
+        CUBE_DIMENSIONS, as_index=False, observed=True, dropna=False, sort=True
+    )[CUBE_MEASURES].sum()
+
+
+def rollup_sales(
+    monthly_sales: pd.DataFrame,
+    period: KpiPeriodsEnum,
+    by: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Roll up monthly sales to the given period.
+
+    Args:
+        monthly_sales (pd.DataFrame): Sales by year, month and entity currency.
+        period (KpiPeriodsEnum): The period to roll up to.
+        by (list[str] | None): Other columns to keep the sales by, e.g. a grouping column.
+
+    Returns:
+        pd.DataFrame: Sales by the columns in by, period label (e.g. "2023-01",
+            "2023-Q1" or "2023") and entity currency, sorted by period.
+    """
+    by = by or []
+    years = monthly_sales[INVOICE_YEAR_COLUMN].astype(int).astype(str)
+    months = monthly_sales[INVOICE_MONTH_COLUMN].astype(int)
+    if period == KpiPeriodsEnum.MONTHLY:
+        periods = years + "-" + months.map("{:02d}".format)
+    elif period == KpiPeriodsEnum.QUARTERLY:
+        periods = years + "-Q" + ((months - 1) // 3 + 1).astype(str)
+    else:
+        periods = years
+
+    period_column = PERIOD_COLUMNS[period]
+    rolled_up = monthly_sales[[*by, ENTITY_CURRENCY_COLUMN, *CUBE_MEASURES]].copy()
+    rolled_up.insert(len(by), period_column, periods)
+    return rolled_up.groupby(
+        [*by, period_column, ENTITY_CURRENCY_COLUMN],
+        as_index=False,
+        sort=True,
+        dropna=False,
+    )[CUBE_MEASURES].sum()
+
+
+class SalesCube:
+    """
+    Sales aggregated by the dimensions of the cube, indexed by grouping value.
+
+    The monthly sales of each grouping value (and the total, with grouping None)
+    are computed when the cube is created, so getting them is a dict lookup.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+        self._monthly_sales: dict[
+            SalesGroupingsEnum | None, dict[str | None, pd.DataFrame]
+        ] = {}
+
+        monthly_dimensions = [
+            INVOICE_YEAR_COLUMN,
+            INVOICE_MONTH_COLUMN,
+            ENTITY_CURRENCY_COLUMN,
+        ]
+        self._monthly_sales[None] = {
+            None: data.groupby(
+                monthly_dimensions, as_index=False, sort=True, dropna=False
+            )[CUBE_MEASURES].sum()
+        }
+        for grouping, column in SALES_GROUPING_COLUMNS.items():
+            grouping_values = data[column].astype(object).str.strip().str.upper()
+            grouped = data.assign(**{column: grouping_values}).groupby(
+                [column, *monthly_dimensions], as_index=False, sort=True, dropna=False
+            )[CUBE_MEASURES].sum()
+            self._monthly_sales[grouping] = {
+                value: sales.drop(columns=column).reset_index(drop=True)
+                for value, sales in grouped.groupby(column, sort=False)
+                if pd.notna(value)
+            }
+
+    def get_grouping_values(self, grouping: SalesGroupingsEnum) -> list[str]:
+        """Normalized values available for a grouping."""
+        return sorted(self._monthly_sales[grouping])
+
+    def get_monthly_sales(
+        self,
+        grouping: SalesGroupingsEnum | None = None,
+        grouping_value: str | None = None,
+    ) -> pd.DataFrame:
+        """
+        Get the monthly sales of a grouping value, or the total sales if grouping is None.
+
+        Returns:
+            pd.DataFrame: Sales by year, month and entity currency.
+
+        Raises:
+            ValueError: If there is no data for the grouping value.
+        """
+        if grouping is None:
+            return self._monthly_sales[None][None]
+
+        sales = self._monthly_sales[grouping].get(
+            normalize_grouping_value(grouping_value)
+        )
+        if sales is None:
+            raise ValueError(f"No sales data found for {grouping.value} {grouping_value}.")
+        return sales
+
+    def get_sales(
+        self,
+        grouping: SalesGroupingsEnum | None,
+        grouping_value: str | None,
+        period: KpiPeriodsEnum,
+        start_month: int | None = None,
+        end_month: int | None = None,
+    ) -> pd.DataFrame:
+        """
+        Get the sales of a grouping value, rolled up to the given period.
+
+        Args:
+            grouping (SalesGroupingsEnum | None): The grouping, None for total sales.
+            grouping_value (str | None): The value of the grouping.
+            period (KpiPeriodsEnum): The period to roll up to.
+            start_month (int | None): First month included, as a month index.
+            end_month (int | None): First month excluded, as a month index.
+
+        Returns:
+            pd.DataFrame: Sales by period label and entity currency.
+        """
+        monthly_sales = self.get_monthly_sales(grouping, grouping_value)
+        month_index = get_month_index(
+            monthly_sales[INVOICE_YEAR_COLUMN], monthly_sales[INVOICE_MONTH_COLUMN]
+        )
+        mask = pd.Series(True, index=monthly_sales.index)
+        if start_month is not None:
+            mask &= month_index >= start_month
+        if end_month is not None:
+            mask &= month_index < end_month
+        return rollup_sales(monthly_sales.loc[mask], period)
+
+    def get_grouped_sales(
+        self,
+        grouping: SalesGroupingsEnum,
+        grouping_values: list[str] | None,
+        period: KpiPeriodsEnum,
+        start_month: int | None = None,
+        end_month: int | None = None,
+    ) -> pd.DataFrame:
+        """
+        Get the sales of several values of a grouping in a single groupby, rolled
+        up to the given period.
+
+        Args:
+            grouping (SalesGroupingsEnum): The grouping.
+            grouping_values (list[str] | None): The values to keep, all of them if
+                None or empty.
+            period (KpiPeriodsEnum): The period to roll up to.
+            start_month (int | None): First month included, as a month index.
+            end_month (int | None): First month excluded, as a month index.
+
+        Returns:
+            pd.DataFrame: Sales by normalized grouping value (in the column of the
+                grouping), period label and entity currency.
+        """
+        column = SALES_GROUPING_COLUMNS[grouping]
+        values = self.data[column].astype(object).str.strip().str.upper()
+        month_index = get_month_index(
+            self.data[INVOICE_YEAR_COLUMN], self.data[INVOICE_MONTH_COLUMN]
+        )
+        mask = values.notna()
+        if grouping_values:
+            mask &= values.isin([normalize_grouping_value(v) for v in grouping_values])
+        if start_month is not None:
+            mask &= month_index >= start_month
+        if end_month is not None:
+            mask &= month_index < end_month
+
+        monthly_sales = self.data.loc[
+            mask,
+            [
+                INVOICE_YEAR_COLUMN,
+                INVOICE_MONTH_COLUMN,
+                ENTITY_CURRENCY_COLUMN,
+                *CUBE_MEASURES,
+            ],
+        ].assign(**{column: values[mask]})
+        return rollup_sales(monthly_sales, period, by=[column])
+
+
+def get_sales_cube_path(data_source: LocalDataSource) -> Path:
+    """Path of the stored sales cube of a data source."""
+    return data_source.cache_location / f"{data_source.cache_path.stem}_sales_cube.parquet"
+
+
+def get_sales_cube_manifest_path(data_source: LocalDataSource) -> Path:
+    """Path of the file describing the version of the data the stored cube was built from."""
+    return get_sales_cube_path(data_source).with_suffix(".json")
+
+
+def get_partition_keys(data: pd.DataFrame, partition_columns: list[str]) -> pd.Series:
+    """Key of the partition of the cache each row of the cube was aggregated from."""
+    keys = [f"{column}=" + data[column].astype(str) for column in partition_columns]
+    return pd.concat(keys, axis=1).agg("/".join, axis=1) if keys else pd.Series()
+
+
+def build_sales_cube(
+    data_source: LocalDataSource, partitions: set[str] | None = None
+) -> pd.DataFrame:
+    """
+    Aggregate the data of a source by the dimensions of the cube, chunk by chunk.
+
+    Args:
+        data_source (LocalDataSource): The data source to aggregate.
+        partitions (set[str] | None): Keys of the partitions of the cache to
+            aggregate, all of them if None.
+    """
+    return aggregate_in_chunks(
+        data_source,
+        aggregate=aggregate_sales,
+        combine=combine_sales_aggregates,
+        columns=CUBE_SOURCE_COLUMNS,
+        partition_filter=None
+        if partitions is None
+        else lambda partition_values: get_partition_key(partition_values)
+        in partitions,
+    )
+
+
+def refresh_sales_cube(
+    data_source: LocalDataSource, partition_hashes: dict[str, str]
+) -> pd.DataFrame:
+    """
+    Bring the stored cube up to date with the Parquet cache of a data source.
+
+    Must be called holding lock_cache of the stored cube.
+
+    The rows of the partitions that changed or were removed are dropped from the
+    stored cube, and only the new and changed partitions are aggregated again.
+    The whole cube is built if there is no stored cube, or if the cache is not
+    partitioned by dimensions of the cube.
+
+    Args:
+        data_source (LocalDataSource): The data source to aggregate.
+        partition_hashes (dict[str, str]): Hash of each partition of the cache.
+
+    Returns:
+        pd.DataFrame: The up to date cube.
+    """
+    cube_path = get_sales_cube_path(data_source)
+    manifest_path = get_sales_cube_manifest_path(data_source)
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else None
+
+    partition_columns = data_source.partition_columns
+    if (
+        manifest is None
+        or not cube_path.exists()
+        or not partition_columns
+        or not set(partition_columns) <= set(CUBE_DIMENSIONS)
+        or manifest["partition_columns"] != partition_columns
+    ):
+        default_logger.info(f"Building the sales cube of {data_source.name}.")
+        data = build_sales_cube(data_source)
+    else:
+        stored_hashes = manifest["partitions"]
+        changed_partitions = {
+            key
+            for key, partition_hash in partition_hashes.items()
+            if stored_hashes.get(key) != partition_hash
+        }
+        outdated_partitions = changed_partitions | (
+            stored_hashes.keys() - partition_hashes.keys()
+        )
+        default_logger.info(
+            f"Refreshing the sales cube of {data_source.name}: aggregating "
+            f"{len(changed_partitions)} of {len(partition_hashes)} partitions."
+        )
+        data = pd.read_parquet(cube_path)
+        data = data.loc[
+            ~get_partition_keys(data, partition_columns).isin(outdated_partitions)
+        ]
+        if changed_partitions:
+            changed_data = build_sales_cube(data_source, changed_partitions)
+            if not changed_data.empty:
+                data = combine_sales_aggregates([data, changed_data])
+
+    # Without a manifest, a partially written cube is built again from scratch
+    manifest_path.unlink(missing_ok=True)
+    temp_path = cube_path.with_name(f"{cube_path.name}.tmp")
+    data.to_parquet(temp_path, index=False, compression="zstd")
+    temp_path.replace(cube_path)
+    manifest_path.write_text(
+        json.dumps(
+            {
+                "sha256": get_cache_hash(data_source.cache_path),
+                "partition_columns": partition_columns,
+                "partitions": partition_hashes,
+            }
+        )
+    )
+    return data
+
+
+def get_sales_cube(data_source: LocalDataSource = INTERNAL_DATA) -> SalesCube:
+    """
+    Get the sales cube of a data source, refreshing it when the data changes.
+
+    The cube is kept in memory and stored next to the Parquet cache, so it is
+    only refreshed when the source file changes, and then only for the
+    partitions that changed.
+
+    Args:
+        data_source (LocalDataSource): The data source to aggregate.
+
+    Returns:
+        SalesCube: The cube for the current version of the data.
+
+    Raises:
+        FileNotFoundError: If the data source file does not exist.
+    """
+    with _cubes_lock:
+        cache_path = data_source.ensure_cache()
+        cache_hash = get_cache_hash(cache_path)
+        cached = _cubes.get(data_source.cache_path)
+        if cached is not None and cached[0] == cache_hash:
+            return cached[1]
+
+        cube_path = get_sales_cube_path(data_source)
+        manifest_path = get_sales_cube_manifest_path(data_source)
+        # The stored cube is shared by the processes, e.g. the kernels of the code tool
+        with lock_cache(cube_path):
+            if (
+                cube_path.exists()
+                and manifest_path.exists()
+                and json.loads(manifest_path.read_text())["sha256"] == cache_hash
+            ):
+                data = pd.read_parquet(cube_path)
+            else:
+                data = refresh_sales_cube(data_source, get_cache_partitions(cache_path))
+
+        cube = SalesCube(data)
+        _cubes[data_source.cache_path] = (cache_hash, cube)
+        return cube
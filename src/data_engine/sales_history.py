@@ -0,0 +1,147 @@
+"""
+Deterministic extraction of the sales history of a request from the internal data.
+
+This replaces the code the internal data agent used to write for the
+retrieve_sales_history step: the last three years of sales of the request's
+grouping value are read from the sales cube and rolled up to its period.
+"""
+
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+from src.configuration.constants import (
+    ENTITY_CURRENCY_COLUMN,
+    FUNCTIONAL_SALES_COLUMN,
+    INTERNAL_DATA,
+    REPORTING_SALES_COLUMN,
+    LocalDataSource,
+)
+from src.configuration.db_models import (
+    KpiPeriodsEnum,
+    SalesCurrencyEnum,
+    SalesReportRequest,
+)
+from src.data_engine.sales_cube import (
+    PERIOD_COLUMNS,
+    PERIOD_MONTHS,
+    get_month_index,
+    get_sales_cube,
+)
+
+HISTORY_YEARS = 3
+
+
+def get_sales_column(currency: SalesCurrencyEnum) -> str:
+    """Name of the sales column for the given currency."""
+    if currency == SalesCurrencyEnum.FUNCTIONAL:
+        return FUNCTIONAL_SALES_COLUMN
+    return REPORTING_SALES_COLUMN
+
+
+def get_history_window(period: KpiPeriodsEnum, analysis_date: date) -> tuple[int, int]:
+    """
+    Get the months included in the history, as month indexes (year * 12 + month - 1).
+
+    The history ends before the month of the analysis date, as it is not complete,
+    and starts three years before, aligned to the start of a period.
+
+    Returns:
+        tuple[int, int]: The first month included and the first month excluded.
+    """
+    end = get_month_index(analysis_date.year, analysis_date.month)
+    start = end - HISTORY_YEARS * 12
+    start -= start % PERIOD_MONTHS[period]
+    return start, end
+
+
+def format_sales_history(
+    sales: pd.DataFrame, request: SalesReportRequest, by: list[str] | None = None
+) -> pd.DataFrame:
+    """
+    Keep the sales in the currency of the request, per period and the columns in by.
+
+    Functional currency sales are also split by entity currency when there is
+    more than one, as they cannot be added together.
+    """
+    sales_column = get_sales_column(request.currency)
+    group_columns = [*(by or []), PERIOD_COLUMNS[request.period]]
+    if (
+        request.currency == SalesCurrencyEnum.FUNCTIONAL
+        and sales[ENTITY_CURRENCY_COLUMN].nunique() > 1
+    ):
+        group_columns.append(ENTITY_CURRENCY_COLUMN)
+
+    return sales.groupby(group_columns, as_index=False, sort=True)[sales_column].sum()
+
+
+def extract_sales_history(
+    request: SalesReportRequest,
+    analysis_date: date,
+    data_source: LocalDataSource = INTERNAL_DATA,
+) -> pd.DataFrame:
+    """
+    Extract the last three years of sales of a request from the internal data.
+
+    Args:
+        request (SalesReportRequest): The request defining grouping, period and currency.
+        analysis_date (date): The date of the analysis; its month is not included.
+        data_source (LocalDataSource): The internal data source.
+
+    Returns:
+        pd.DataFrame: The sales per period, sorted by period.
+
+    Raises:
+        FileNotFoundError: If the internal data file does not exist.
+        ValueError: If there is no data for the request in the history window.
+    """
+    start, end = get_history_window(request.period, analysis_date)
+    sales = get_sales_cube(data_source).get_sales(
+        request.grouping, request.grouping_value, request.period, start, end
+    )
+    if sales.empty:
+        raise ValueError(f"No sales data found for {request.name}.")
+
+    return format_sales_history(sales, request)
+
+
+def store_sales_history(
+    request: SalesReportRequest,
+    analysis_date: date,
+    output_location: Path,
+    data_source: LocalDataSource = INTERNAL_DATA,
+) -> pd.DataFrame:
+    """
+    Extract the sales history of a request and store it as a csv file.
+
+    Args:
+        request (SalesReportRequest): The request defining grouping, period and currency.
+        analysis_date (date): The date of the analysis; its month is not included.
+        output_location (Path): Path of the csv file to create.
+        data_source (LocalDataSource): The internal data source.
+
+    Returns:
+        pd.DataFrame: The stored sales history.
+    """
+    sales_history = extract_sales_history(request, analysis_date, data_source)
+    sales_history.to_csv(output_location, index=False)
+    return sales_history
+
+
+def describe_sales_history(
+    request: SalesReportRequest, sales_history: pd.DataFrame, output_location: Path
+) -> str:
+    """
+    Describe the stored sales history, in the same terms the internal data agent would.
+    """
+    period_column = PERIOD_COLUMNS[request.period]
+    first_period = sales_history[period_column].iloc[0]
+    last_period = sales_history[period_column].iloc[-1]
+
+    return (
+        f"The {request.description} was retrieved and saved to {output_location.name}.\n\n"
+        f"It contains one row per period from {first_period} to {last_period}, "
+        f"with columns: {', '.join(sales_history.columns)}.\n\n"
+        f"{sales_history.to_string(index=False)}"
+    )
@@ -0,0 +1,281 @@
+"""
+Internal data loaded once per process and shared, read-only, by every REPL.
+
+Each code agent used to start by parsing the financials file, often more than
+once per conversation. Instead, the data is loaded from its Parquet cache the
+first time it is needed, its arrays are made read-only, and each REPL gets a
+shallow copy: columns can be added or replaced in a REPL without affecting the
+others, but modifying values in place raises an error instead of leaking
+changes between requests.
+
+The kernels of the code tool are separate processes, so each would hold a
+private copy of the data. prepare_shared_data, called before the kernels are
+started, writes the data to an uncompressed Arrow file, which the kernels
+memory-map: the numeric and categorical columns are then backed by the same
+pages of the OS cache in every kernel, and only the other columns are copied.
+The Arrow file is written from the Parquet cache batch by batch, so preparing
+it uses no more memory than reading a chunk of the source. It also builds the
+sales cube, which the kernels can't aggregate in parallel as they are daemon
+processes.
+"""
+
+import os
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.logger import default_logger
+from src.configuration.settings import app_settings
+from src.data_engine.parquet_cache import get_cache_hash
+from src.data_engine.sales_cube import get_sales_cube
+
+_shared_data: dict[Path, tuple[str, pd.DataFrame]] = {}
+_shared_data_lock = Lock()
+
+
+def make_read_only(data: pd.DataFrame) -> pd.DataFrame:
+    """Mark the arrays backing a dataframe as read-only, in place."""
+    for block in data._mgr.blocks:
+        values = block.values
+        # Categoricals store their codes in a separate array
+        array = values._codes if isinstance(values, pd.Categorical) else values
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+    return data
+
+
+def get_shared_data_path(data_source: LocalDataSource, cache_hash: str) -> Path:
+    """Path of the Arrow file of a version of the data, memory-mapped by the kernels."""
+    return (
+        data_source.cache_location
+        / f"{data_source.cache_path.stem}_shared_{cache_hash[:16]}.arrow"
+    )
+
+
+def _get_smallest_integer_type(minimum: int, maximum: int) -> pa.DataType:
+    """Smallest signed integer type holding the values, as in downcast_integers."""
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= minimum and maximum <= info.max:
+            return pa.from_numpy_dtype(dtype)
+    return pa.int64()
+
+
+def write_shared_data(data_source: LocalDataSource, path: Path) -> None:
+    """
+    Write the Parquet cache of a source to an uncompressed Arrow file, batch by batch.
+
+    The file has the types data_source.load() returns: the categorical columns
+    are dictionary encoded, with one dictionary for the whole file, and the
+    integer columns are downcast. Both are found in a first pass reading only
+    those columns.
+    """
+    dataset = ds.dataset(
+        data_source.ensure_cache(), format="parquet", partitioning="hive"
+    )
+    categorical_columns = [
+        name for name in data_source.categorical_columns if name in dataset.schema.names
+    ]
+    integer_columns = [
+        field.name for field in dataset.schema if pa.types.is_integer(field.type)
+    ]
+
+    dictionaries: dict[str, dict] = {name: {} for name in categorical_columns}
+    ranges: dict[str, list[int]] = {}
+    for batch in dataset.to_batches(
+        columns=categorical_columns + integer_columns,
+        batch_size=app_settings.data_chunk_rows,
+    ):
+        for name in categorical_columns:
+            # In order of appearance, as the categories of data_source.load()
+            for value in pc.unique(batch[name]).drop_null().to_pylist():
+                dictionaries[name].setdefault(value, None)
+        for name in integer_columns:
+            minimum, maximum = (
+                value.as_py() for value in pc.min_max(batch[name]).values()
+            )
+            if minimum is not None:
+                bounds = ranges.setdefault(name, (minimum, maximum))
+                ranges[name] = (min(bounds[0], minimum), max(bounds[1], maximum))
+
+    dictionary_arrays = {
+        name: pa.array(list(values), type=dataset.schema.field(name).type)
+        for name, values in dictionaries.items()
+    }
+    fields = []
+    for field in dataset.schema:
+        if field.name in dictionary_arrays:
+            field = field.with_type(pa.dictionary(pa.int32(), field.type))
+        elif field.name in ranges:
+            field = field.with_type(_get_smallest_integer_type(*ranges[field.name]))
+        fields.append(field)
+    schema = pa.schema(fields)
+
+    with ipc.new_file(path, schema) as writer:
+        for batch in dataset.to_batches(batch_size=app_settings.data_chunk_rows):
+            arrays = []
+            for field in schema:
+                column = batch[field.name]
+                if field.name in dictionary_arrays:
+                    dictionary = dictionary_arrays[field.name]
+                    indices = pc.index_in(column, value_set=dictionary).cast(pa.int32())
+                    column = pa.DictionaryArray.from_arrays(indices, dictionary)
+                else:
+                    column = column.cast(field.type)
+                arrays.append(column)
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+
+def prepare_shared_data(data_source: LocalDataSource = INTERNAL_DATA) -> None:
+    """
+    Prepare the data of a source for the processes sharing it, see the module docstring.
+
+    Builds the Parquet cache and the sales cube if needed, and writes the Arrow
+    file of the current version of the data, removing the ones of previous
+    versions. Errors are logged: the processes then load the data themselves.
+    """
+    try:
+        cache_hash = get_cache_hash(data_source.ensure_cache())
+        path = get_shared_data_path(data_source, cache_hash)
+        if not path.exists():
+            default_logger.info(f"Writing {data_source.name} to {path.name}.")
+            temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            try:
+                write_shared_data(data_source, temp_path)
+            except BaseException:
+                temp_path.unlink(missing_ok=True)
+                raise
+            temp_path.replace(path)
+        for previous_path in path.parent.glob(
+            f"{data_source.cache_path.stem}_shared_*.arrow"
+        ):
+            if previous_path != path:
+                # Processes still mapping it keep their pages until they unmap it
+                previous_path.unlink(missing_ok=True)
+    except Exception as e:
+        default_logger.warning(f"Could not prepare {data_source.name} to be shared: {e}")
+    try:
+        get_sales_cube(data_source)
+    except Exception as e:
+        default_logger.warning(f"Could not build the sales cube of {data_source.name}: {e}")
+
+
+def load_shared_data(data_source: LocalDataSource, cache_hash: str) -> pd.DataFrame:
+    """
+    Load a version of the data, memory-mapping its Arrow file if it was prepared,
+    from the Parquet cache otherwise.
+    """
+    path = get_shared_data_path(data_source, cache_hash)
+    if path.exists():
+        try:
+            table = feather.read_table(path, memory_map=True)
+            # One block per column, so the columns stay backed by the mapped file
+            return table.to_pandas(split_blocks=True)
+        except (OSError, pa.ArrowException) as e:
+            default_logger.warning(f"Could not map {path.name}: {e}")
+    return data_source.load()
+
+
+def get_shared_data(data_source: LocalDataSource = INTERNAL_DATA) -> pd.DataFrame:
+    """
+    Get the read-only dataframe of a data source, loading it only once per process.
+
+    The data is loaded again if the source file changed since it was loaded.
+
+    Args:
+        data_source (LocalDataSource): The data source to load.
+
+    Returns:
+        pd.DataFrame: A read-only dataframe; use .copy() before modifying values.
+
+    Raises:
+        FileNotFoundError: If the data source file does not exist.
+    """
+    with _shared_data_lock:
+        cache_hash = get_cache_hash(data_source.ensure_cache())
+        cached = _shared_data.get(data_source.cache_path)
+        if cached is None or cached[0] != cache_hash:
+            default_logger.info(f"Loading {data_source.name} in shared memory.")
+            data = make_read_only(load_shared_data(data_source, cache_hash))
+            _shared_data[data_source.cache_path] = (cache_hash, data)
+        return _shared_data[data_source.cache_path][1]
+
+
+def _get_column_array(column: pd.Series) -> np.ndarray | None:
+    values = column._values
+    array = values._codes if isinstance(values, pd.Categorical) else values
+    return array if isinstance(array, np.ndarray) else None
+
+
+def get_shared_data_fingerprint(data: pd.DataFrame) -> str | None:
+    """
+    Fingerprint of a dataframe whose columns are all columns of the shared data,
+    e.g. the internal data of a REPL, without hashing its values.
+
+    The shared arrays are read-only, so they can only change with the version of
+    the data; the fingerprint is that version and the names of the columns.
+
+    Returns:
+        str | None: The fingerprint, or None if a column is not shared.
+    """
+    with _shared_data_lock:
+        entries = list(_shared_data.values())
+    for cache_hash, shared_data in entries:
+        if len(data) != len(shared_data) or not data.index.equals(shared_data.index):
+            continue
+        for column in data.columns:
+            if column not in shared_data.columns:
+                break
+            array = _get_column_array(data[column])
+            shared_array = _get_column_array(shared_data[column])
+            if (
+                array is None
+                or shared_array is None
+                or array.flags.writeable
+                or array.shape != shared_array.shape
+                or array.dtype != shared_array.dtype
+                or not np.may_share_memory(array, shared_array)
+            ):
+                break
+        else:
+            return f"shared:{cache_hash}:{list(data.columns)}"
+    return None
+
+
+def get_repl_data(data_source: LocalDataSource = INTERNAL_DATA) -> pd.DataFrame | None:
+    """
+    Get a shallow, memory-sharing copy of the shared data for a new REPL.
+
+    Returns:
+        pd.DataFrame | None: The data, or None if it could not be loaded; the REPL
+            then starts without it and agents read the file themselves.
+    """
+    try:
+        return get_shared_data(data_source).copy(deep=False)
+    except Exception as e:
+        default_logger.warning(f"Could not preload {data_source.name}: {e}")
+        return None
+
+
+def get_repl_sales_cube(
+    data_source: LocalDataSource = INTERNAL_DATA,
+) -> pd.DataFrame | None:
+    """
+    Get a shallow, memory-sharing copy of the sales cube data for a new REPL.
+
+    Returns:
+        pd.DataFrame | None: The cube data, or None if it could not be built.
+    """
+    try:
+        return make_read_only(get_sales_cube(data_source).data).copy(deep=False)
+    except Exception as e:
+        default_logger.warning(f"Could not preload the sales cube: {e}")
+        return None
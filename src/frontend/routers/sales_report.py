@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Request, Form, HTTPException, status
 from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional, List, Annotated
 from pydantic import ValidationError
 
@@ -12,6 +13,8 @@ from src.configuration.db_models import (
     SalesGroupingsEnum,
     SalesCurrencyEnum,
 )
+from src.configuration.logger import default_logger
+from src.data_engine.grouping_value_index import get_grouping_value_index
 from src.frontend.templates_config import templates
 
 router = APIRouter()
@@ -39,6 +42,32 @@ async def create_form(request: Request):
     )
 
 
+@router.get("/grouping_values")
+def search_grouping_values(
+    grouping: SalesGroupingsEnum, query: str = "", limit: int = 10
+) -> dict:
+    """Suggest values of a grouping matching the text typed so far, as JSON."""
+    try:
+        index = get_grouping_value_index()
+    except FileNotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
+    return {
+        "grouping": grouping.value,
+        "query": query,
+        "values": index.search(grouping, query, limit=max(1, min(limit, 50))),
+    }
+
+
+async def warm_grouping_value_index() -> None:
+    """Build the grouping value index at startup, so the first search is fast."""
+    try:
+        await run_in_threadpool(get_grouping_value_index)
+    except Exception as e:
+        default_logger.warning(f"Could not build the grouping value index: {str(e)}")
+
+
 @router.get("/edit/{request_id}", response_class=HTMLResponse)
 async def edit_form(request: Request, request_id: int):
     """Show form to edit an existing sales report request."""
@@ -1,38 +1,133 @@
+import time
+from unittest.mock import AsyncMock
+
 import pytest
+from langchain_core.messages import AIMessage
 
+from src.agents.code_agent_with_review import assess_continue_condition
 from src.agents.models import AppChatModels
+from src.agents.utils.continue_classifier import ContinueDecision, classify_continue
 from src.agents.utils.prompt_utils import MessageTypes, render_prompt_template
+from src.configuration.settings import app_settings
 
 from . import continue_condition_helpers
 
+SCENARIOS = [
+    ("agent clearly finalizes", "finalized_text", "RESPOND"),
+    ("agent returns introspection", "introspection_text", "RESPOND"),
+    ("agent requests user input", "user_request_text", "RESPOND"),
+    ("agent implicitly requests user input", "user_request_implicit", "RESPOND"),
+    ("agent needs to proceed with task", "proceeding_text", "CONTINUE"),
+    ("agent implicitly needs to proceed", "proceeding_implicit", "CONTINUE"),
+]
 
-@pytest.mark.asyncio
-@pytest.mark.parametrize(
-    "scenario,helper_attr,expected",
-    [
-        ("agent clearly finalizes", "finalized_text", "RESPOND"),
-        ("agent returns introspection", "introspection_text", "RESPOND"),
-        ("agent requests user input", "user_request_text", "RESPOND"),
-        ("agent implicitly requests user input", "user_request_implicit", "RESPOND"),
-        ("agent needs to proceed with task", "proceeding_text", "CONTINUE"),
-        ("agent implicitly needs to proceed", "proceeding_implicit", "CONTINUE"),
-    ],
-)
-async def test_continue_condition_scenarios(
-    models_client: AppChatModels, scenario: str, helper_attr: str, expected: str
-):
-    """Test continue condition prompt correctly identifies when agent should continue vs respond."""
-    test_message = getattr(continue_condition_helpers, helper_attr)
+
+async def ask_model(models_client: AppChatModels, message: str) -> str:
     assessment_message = render_prompt_template(
         "code_agent/continue_condition_prompt.md",
         context={
-            "last_message": test_message,
+            "last_message": message,
         },
         type=MessageTypes.HUMAN,
     )
     review_response = await models_client.default_non_reasoning_model.ainvoke(
         [assessment_message]
     )
+    return review_response.content
+
 
-    actual = review_response.content
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scenario,helper_attr,expected", SCENARIOS)
+async def test_continue_condition_scenarios(
+    models_client: AppChatModels, scenario: str, helper_attr: str, expected: str
+):
+    """Test continue condition prompt correctly identifies when agent should continue vs respond."""
+    test_message = getattr(continue_condition_helpers, helper_attr)
+
+    actual = await ask_model(models_client, test_message)
     assert actual == expected, f"Failed for scenario: {scenario}"
+
+
+@pytest.mark.parametrize("scenario,helper_attr,expected", SCENARIOS)
+def test_classifier_is_confident_on_scenarios(
+    scenario: str, helper_attr: str, expected: str
+):
+    """The local classifier decides the clear scenarios without the model."""
+    classification = classify_continue(getattr(continue_condition_helpers, helper_attr))
+
+    assert classification.decision.value == expected, f"Failed for scenario: {scenario}"
+    assert classification.confidence >= app_settings.continue_min_confidence
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "Should I proceed? If you confirm, I will generate the plots.",
+        "The totals are computed. I will create a chart next. Let me know!",
+    ],
+)
+def test_classifier_is_inconclusive_on_commitments_with_questions(message: str):
+    """A question to the user is not outweighed by a commitment to a next step."""
+    classification = classify_continue(message)
+
+    assert classification.confidence < app_settings.continue_min_confidence
+
+
+def test_classifier_ignores_offers_of_extra_work():
+    classification = classify_continue(
+        "The chart is saved. Let me know if you'd like any additional charts."
+    )
+
+    assert "question" not in classification.cues
+    assert "waiting for user" not in classification.cues
+
+
+@pytest.mark.asyncio
+async def test_model_is_only_asked_in_ambiguous_cases():
+    model = AsyncMock()
+    model.ainvoke.return_value = AIMessage(content="`CONTINUE`")
+
+    clear = await assess_continue_condition(
+        continue_condition_helpers.user_request_text, model
+    )
+    model.ainvoke.assert_not_awaited()
+    ambiguous = await assess_continue_condition("The totals were computed.", model)
+
+    assert clear == ContinueDecision.RESPOND
+    assert ambiguous == ContinueDecision.CONTINUE
+    model.ainvoke.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_classifier_agreement_and_latency_saved(
+    models_client: AppChatModels, record_property
+):
+    """
+    Measure how often the classifier agrees with the model on the confident
+    decisions, and the latency saved by not asking the model for them.
+    """
+    agreements = 0
+    confident = 0
+    classifier_seconds = 0.0
+    model_seconds = 0.0
+    for _, helper_attr, _ in SCENARIOS:
+        message = getattr(continue_condition_helpers, helper_attr)
+
+        start = time.perf_counter()
+        classification = classify_continue(message)
+        classifier_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        model_decision = await ask_model(models_client, message)
+        model_seconds += time.perf_counter() - start
+
+        if classification.confidence >= app_settings.continue_min_confidence:
+            confident += 1
+            agreements += classification.decision.value == model_decision
+
+    agreement = agreements / confident if confident else 1.0
+    record_property("continue_agreement", agreement)
+    record_property("continue_model_calls_saved", f"{confident}/{len(SCENARIOS)}")
+    record_property("continue_latency_saved_seconds", model_seconds - classifier_seconds)
+
+    assert agreement >= 5 / 6
+    assert classifier_seconds < model_seconds / 100
@@ -0,0 +1,42 @@
+from langchain_core.messages import ToolMessage
+
+from src.agents.code_agent_with_review import (
+    get_mechanical_error_hint,
+    is_invalid_code_tool_message,
+)
+from src.agents.tools.execution_result import ExecutionResult
+
+
+def create_tool_message(result: ExecutionResult) -> ToolMessage:
+    return ToolMessage(content=result.to_text(), artifact=result, tool_call_id="1")
+
+
+def test_output_mentioning_errors_is_valid():
+    message = create_tool_message(ExecutionResult(output="Error_rate    0.1\n"))
+
+    assert not is_invalid_code_tool_message(message)
+
+
+def test_failed_execution_is_invalid():
+    try:
+        {}["SALES"]
+    except KeyError as e:
+        result = ExecutionResult.from_exception("", e)
+
+    assert is_invalid_code_tool_message(create_tool_message(result))
+
+
+def test_mechanical_errors_get_a_hint():
+    key_error = ExecutionResult(
+        error_type="KeyError",
+        error="KeyError('SALES')",
+        error_line=2,
+        error_code="df['SALES']",
+    )
+    value_error = ExecutionResult(error_type="ValueError", error="ValueError()")
+
+    hint = get_mechanical_error_hint(create_tool_message(key_error))
+
+    assert "KeyError('SALES') on line 2: `df['SALES']`" in hint.content
+    assert "Print the columns" in hint.content
+    assert get_mechanical_error_hint(create_tool_message(value_error)) is None
@@ -4,10 +4,22 @@ import pytest
 import pandas as pd
 
 from src.agents.models import default_models, AppChatModels
+from src.agents.utils.runnable_registry import default_registry
 from src.configuration.db_models import SalesReportRequest
 from .helpers import test_temp_dir
 
 
+@pytest.fixture(autouse=True)
+def clear_runnable_registry():
+    """
+    Clear the compiled graphs before each test, so graphs are rebuilt
+    with any nodes or models patched by the test.
+    """
+    default_registry.clear()
+    yield
+    default_registry.clear()
+
+
 @pytest.fixture(scope="session")
 def models_client() -> AppChatModels:
     return default_models
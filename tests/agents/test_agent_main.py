@@ -1,8 +1,22 @@
+import asyncio
+from pathlib import Path
+from contextlib import asynccontextmanager
 from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 
-from src.configuration.db_models import RecipientEmail
-from agent_main import execute_sales_report_request, main
+from src.configuration.checkpointer import get_report_thread_id
+from src.configuration.db_models import (
+    KpiPeriodsEnum,
+    RecipientEmail,
+    SalesCurrencyEnum,
+)
+from src.data_engine.dataset_profile import InvalidRequestError
+from agent_main import (
+    execute_sales_report_request,
+    execute_sales_report_requests,
+    group_requests_by_task,
+    main,
+)
 
 
 @pytest.fixture
@@ -15,6 +29,43 @@ def default_request_with_recipients(default_request):
     return default_request
 
 
+@pytest.fixture(autouse=True)
+def mock_checkpointer():
+    """Replace the SQLite checkpointer so tests don't write checkpoints to disk."""
+    checkpointer = MagicMock()
+    checkpointer.adelete_thread = AsyncMock()
+
+    @asynccontextmanager
+    async def _get_checkpointer():
+        yield checkpointer
+
+    with patch("agent_main.get_checkpointer", _get_checkpointer):
+        yield checkpointer
+
+
+@pytest.fixture(autouse=True)
+def mock_validate_request():
+    """Accept every request as it is, so tests don't need the internal data."""
+    with patch(
+        "agent_main.validate_sales_report_request", side_effect=lambda request: request
+    ) as mock_validate:
+        yield mock_validate
+
+
+@pytest.fixture(autouse=True)
+def mock_kernel_pool():
+    """Don't start Python kernels in tests that don't run any code."""
+    with patch("agent_main.get_kernel_pool") as mock_get_kernel_pool:
+        yield mock_get_kernel_pool
+
+
+def create_mock_graph() -> AsyncMock:
+    """Create a mock report graph without any pending checkpoint to resume."""
+    mock_graph = AsyncMock()
+    mock_graph.aget_state.return_value = MagicMock(next=())
+    return mock_graph
+
+
 class TestExecuteSalesReportRequest:
     """Test suite for execute_sales_report_request function."""
 
@@ -22,26 +73,15 @@ class TestExecuteSalesReportRequest:
     async def test_successful_report_generation(self, default_request_with_recipients):
         """Test successful report generation and email sending."""
         # Mock the entire pipeline
-        mock_graph = AsyncMock()
+        mock_graph = create_mock_graph()
         mock_graph.ainvoke.return_value = {
             "report": "# Test Report\n\nThis is a test report.",
+            "report_pdf_path": "/storage/report.pdf",
             "email_template": "Dear RECIPIENT,\n\nYour report is ready.\n\nBest regards,\nAI Agent",
         }
 
         with (
             patch("agent_main.create_report_graph", return_value=mock_graph),
-            patch("agent_main.get_request_temp_dir", return_value="/tmp/test"),
-            patch(
-                "agent_main.store_response_with_timestamp",
-                return_value="/tmp/test/report.md",
-            ),
-            patch(
-                "agent_main.convert_markdown_to_pdf",
-                return_value="/tmp/test/report.pdf",
-            ),
-            patch(
-                "agent_main.move_file_to_storage", return_value="/storage/report.pdf"
-            ),
             patch("agent_main.MailingService") as mock_mailing_class,
             patch("agent_main.default_logger"),
         ):
@@ -52,7 +92,14 @@ class TestExecuteSalesReportRequest:
 
             # Verify the report graph was invoked with correct request
             mock_graph.ainvoke.assert_called_once_with(
-                {"request": default_request_with_recipients}
+                {"request": default_request_with_recipients},
+                {
+                    "configurable": {
+                        "thread_id": get_report_thread_id(
+                            default_request_with_recipients
+                        )
+                    }
+                },
             )
 
             # Verify email was sent with correct parameters
@@ -60,14 +107,14 @@ class TestExecuteSalesReportRequest:
                 recipients=["test@example.com", "manager@example.com"],
                 subject="AI Analyst - Sales Report Generated",
                 body="Dear Test User, Manager User,\n\nYour report is ready.\n\nBest regards,\nAI Agent",
-                attachments=["/storage/report.pdf"],
+                attachments=[Path("/storage/report.pdf")],
             )
 
     @pytest.mark.asyncio
     async def test_report_generation_failure(self, default_request_with_recipients):
         """Test handling of report generation failure."""
         # Mock graph to raise an exception
-        mock_graph = AsyncMock()
+        mock_graph = create_mock_graph()
         mock_graph.ainvoke.side_effect = Exception("Graph processing failed")
 
         with (
@@ -92,31 +139,20 @@ class TestExecuteSalesReportRequest:
     @pytest.mark.asyncio
     async def test_retry_logic_eventual_success(self, default_request_with_recipients):
         """Test retry logic with eventual success."""
-        mock_graph = AsyncMock()
+        mock_graph = create_mock_graph()
         # Fail twice, then succeed
         mock_graph.ainvoke.side_effect = [
             Exception("First failure"),
             Exception("Second failure"),
             {
                 "report": "# Success Report",
+                "report_pdf_path": "/storage/report.pdf",
                 "email_template": "Dear RECIPIENT,\n\nSuccess!\n\nAI Agent",
             },
         ]
 
         with (
             patch("agent_main.create_report_graph", return_value=mock_graph),
-            patch("agent_main.get_request_temp_dir", return_value="/tmp/test"),
-            patch(
-                "agent_main.store_response_with_timestamp",
-                return_value="/tmp/test/report.md",
-            ),
-            patch(
-                "agent_main.convert_markdown_to_pdf",
-                return_value="/tmp/test/report.pdf",
-            ),
-            patch(
-                "agent_main.move_file_to_storage", return_value="/storage/report.pdf"
-            ),
             patch("agent_main.MailingService") as mock_mailing_class,
             patch("agent_main.default_logger"),
             patch("agent_main.app_settings") as mock_settings,
@@ -135,7 +171,135 @@ class TestExecuteSalesReportRequest:
                 recipients=["test@example.com", "manager@example.com"],
                 subject="AI Analyst - Sales Report Generated",
                 body="Dear Test User, Manager User,\n\nSuccess!\n\nAI Agent",
-                attachments=["/storage/report.pdf"],
+                attachments=[Path("/storage/report.pdf")],
+            )
+
+    @pytest.mark.asyncio
+    async def test_resumes_from_pending_checkpoint(
+        self, default_request_with_recipients, mock_checkpointer
+    ):
+        """Test that a run with a pending checkpoint resumes instead of restarting."""
+        mock_graph = create_mock_graph()
+        mock_graph.aget_state.return_value = MagicMock(next=("process_sales_data",))
+        mock_graph.ainvoke.return_value = {
+            "report": "# Resumed Report",
+            "report_pdf_path": "/storage/report.pdf",
+            "email_template": "Dear RECIPIENT,\n\nResumed!\n\nAI Agent",
+        }
+
+        with (
+            patch(
+                "agent_main.create_report_graph", return_value=mock_graph
+            ) as mock_create_graph,
+            patch("agent_main.MailingService"),
+            patch("agent_main.default_logger"),
+        ):
+            await execute_sales_report_request(default_request_with_recipients)
+
+            thread_id = get_report_thread_id(default_request_with_recipients)
+
+            # The graph is compiled with the checkpointer and resumed with no input
+            mock_create_graph.assert_called_with(checkpointer=mock_checkpointer)
+            mock_graph.ainvoke.assert_called_once_with(
+                None, {"configurable": {"thread_id": thread_id}}
+            )
+
+            # Completed runs are removed from the checkpoints
+            mock_checkpointer.adelete_thread.assert_awaited_once_with(thread_id)
+
+    @pytest.mark.asyncio
+    async def test_invalid_grouping_value_fails_fast(
+        self, default_request_with_recipients, mock_validate_request
+    ):
+        """Test that a grouping value not in the data fails before running the graph."""
+        mock_validate_request.side_effect = InvalidRequestError(
+            "There is no Country 'Spian' in financials.csv. Did you mean: SPAIN?"
+        )
+
+        with (
+            patch("agent_main.create_report_graph") as mock_create_graph,
+            patch("agent_main.MailingService") as mock_mailing_class,
+            patch("agent_main.default_logger"),
+        ):
+            mock_mailing = MagicMock()
+            mock_mailing_class.return_value = mock_mailing
+
+            await execute_sales_report_request(default_request_with_recipients)
+
+            mock_create_graph.assert_not_called()
+            mock_mailing.send_email.assert_called_once_with(
+                recipients=["test@example.com", "manager@example.com"],
+                subject="AI Analyst Agent Run - Failed",
+                body="The AI Analyst agent could not generate your report: "
+                "There is no Country 'Spian' in financials.csv. Did you mean: SPAIN?",
+            )
+
+    @pytest.mark.asyncio
+    async def test_grouping_value_is_written_as_in_the_data(
+        self, default_request_with_recipients, mock_validate_request
+    ):
+        """Test that the graph runs with the grouping value as written in the data."""
+        validated_request = default_request_with_recipients.model_copy(
+            update={"grouping_value": "SPAIN"}
+        )
+        mock_validate_request.side_effect = lambda request: validated_request
+        mock_graph = create_mock_graph()
+        mock_graph.ainvoke.side_effect = Exception("Graph processing failed")
+
+        with (
+            patch("agent_main.create_report_graph", return_value=mock_graph),
+            patch("agent_main.MailingService"),
+            patch("agent_main.default_logger"),
+            patch("agent_main.app_settings") as mock_settings,
+        ):
+            mock_settings.retry_limit = 1
+
+            await execute_sales_report_request(default_request_with_recipients)
+
+            mock_graph.ainvoke.assert_called_with(
+                {"request": validated_request},
+                {"configurable": {"thread_id": get_report_thread_id(validated_request)}},
+            )
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "error",
+        [
+            OSError("Corrupted Parquet cache"),
+            ValueError("Cannot convert non-finite values (NA or inf) to integer"),
+        ],
+    )
+    async def test_request_runs_unvalidated_when_validation_fails(
+        self, default_request_with_recipients, mock_validate_request, error
+    ):
+        """Test that an error while validating the request does not stop the report."""
+        mock_validate_request.side_effect = error
+        mock_graph = create_mock_graph()
+        mock_graph.ainvoke.side_effect = Exception("Graph processing failed")
+
+        with (
+            patch("agent_main.create_report_graph", return_value=mock_graph),
+            patch("agent_main.MailingService"),
+            patch("agent_main.default_logger") as mock_logger,
+            patch("agent_main.app_settings") as mock_settings,
+        ):
+            mock_settings.retry_limit = 1
+
+            await execute_sales_report_request(default_request_with_recipients)
+
+            mock_logger.warning.assert_any_call(
+                f"Could not validate request {default_request_with_recipients.name}: "
+                f"{error}"
+            )
+            mock_graph.ainvoke.assert_called_with(
+                {"request": default_request_with_recipients},
+                {
+                    "configurable": {
+                        "thread_id": get_report_thread_id(
+                            default_request_with_recipients
+                        )
+                    }
+                },
             )
 
     @pytest.mark.asyncio
@@ -146,26 +310,15 @@ class TestExecuteSalesReportRequest:
             RecipientEmail(email="user@example.com", name="User")
         ]
 
-        mock_graph = AsyncMock()
+        mock_graph = create_mock_graph()
         mock_graph.ainvoke.return_value = {
             "report": "# Single User Report",
+            "report_pdf_path": "/storage/report.pdf",
             "email_template": "Hello RECIPIENT,\n\nYour report is ready.\n\nAI Agent",
         }
 
         with (
             patch("agent_main.create_report_graph", return_value=mock_graph),
-            patch("agent_main.get_request_temp_dir", return_value="/tmp/test"),
-            patch(
-                "agent_main.store_response_with_timestamp",
-                return_value="/tmp/test/report.md",
-            ),
-            patch(
-                "agent_main.convert_markdown_to_pdf",
-                return_value="/tmp/test/report.pdf",
-            ),
-            patch(
-                "agent_main.move_file_to_storage", return_value="/storage/report.pdf"
-            ),
             patch("agent_main.MailingService") as mock_mailing_class,
         ):
             mock_mailing = MagicMock()
@@ -178,7 +331,51 @@ class TestExecuteSalesReportRequest:
                 recipients=["user@example.com"],
                 subject="AI Analyst - Sales Report Generated",
                 body="Hello User,\n\nYour report is ready.\n\nAI Agent",
-                attachments=["/storage/report.pdf"],
+                attachments=[Path("/storage/report.pdf")],
+            )
+
+    @pytest.mark.asyncio
+    async def test_report_sent_to_each_recipient_list(self, default_request):
+        """Test that a shared report is generated once and emailed to every recipient list."""
+        first_recipients = [RecipientEmail(email="first@example.com", name="First")]
+        second_recipients = [RecipientEmail(email="second@example.com", name="Second")]
+
+        mock_graph = create_mock_graph()
+        mock_graph.ainvoke.return_value = {
+            "report": "# Shared Report",
+            "report_pdf_path": "/storage/report.pdf",
+            "email_template": "Hello RECIPIENT,\n\nYour report is ready.",
+        }
+
+        with (
+            patch("agent_main.create_report_graph", return_value=mock_graph),
+            patch("agent_main.MailingService") as mock_mailing_class,
+            patch("agent_main.default_logger"),
+        ):
+            mock_mailing = MagicMock()
+            mock_mailing_class.return_value = mock_mailing
+
+            await execute_sales_report_request(
+                default_request,
+                recipient_lists=[first_recipients, second_recipients],
+            )
+
+            # The report is generated and stored once
+            mock_graph.ainvoke.assert_called_once()
+
+            # Each recipient list gets its own personalized email
+            assert mock_mailing.send_email.call_count == 2
+            mock_mailing.send_email.assert_any_call(
+                recipients=["first@example.com"],
+                subject="AI Analyst - Sales Report Generated",
+                body="Hello First,\n\nYour report is ready.",
+                attachments=[Path("/storage/report.pdf")],
+            )
+            mock_mailing.send_email.assert_any_call(
+                recipients=["second@example.com"],
+                subject="AI Analyst - Sales Report Generated",
+                body="Hello Second,\n\nYour report is ready.",
+                attachments=[Path("/storage/report.pdf")],
             )
 
 
@@ -211,11 +408,14 @@ class TestMain:
             await main()
 
             # Verify request was processed
-            mock_execute.assert_called_once_with(default_request_with_recipients)
+            mock_execute.assert_called_once_with(
+                default_request_with_recipients,
+                recipient_lists=[default_request_with_recipients.recipients],
+            )
 
     @pytest.mark.asyncio
     async def test_main_multiple_requests(self, default_request_with_recipients):
-        """Test main function with multiple requests processes them sequentially."""
+        """Test main function with multiple requests processes all of them."""
         # Create a second request by modifying a copy of the default request
         second_request = default_request_with_recipients.__class__(
             **default_request_with_recipients.model_dump()
@@ -235,7 +435,125 @@ class TestMain:
 
             await main()
 
-            # Verify both requests were processed in order
+            # Verify both requests were processed
             assert mock_execute.call_count == 2
-            mock_execute.assert_any_call(default_request_with_recipients)
-            mock_execute.assert_any_call(second_request)
+            mock_execute.assert_any_call(
+                default_request_with_recipients,
+                recipient_lists=[default_request_with_recipients.recipients],
+            )
+            mock_execute.assert_any_call(
+                second_request, recipient_lists=[second_request.recipients]
+            )
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_respect_limit(
+        self, default_request_with_recipients
+    ):
+        """Test that requests run concurrently without exceeding the concurrency cap."""
+        requests = []
+        for request_id in range(6):
+            request = default_request_with_recipients.model_copy()
+            request.id = request_id
+            request.grouping_value = f"Country {request_id}"
+            requests.append(request)
+
+        running = 0
+        max_running = 0
+
+        async def fake_execute(request, recipient_lists=None):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        with (
+            patch("agent_main.execute_sales_report_request", side_effect=fake_execute),
+            patch("agent_main.default_logger"),
+        ):
+            await execute_sales_report_requests(requests, max_concurrent_requests=2)
+
+        assert max_running == 2
+
+    @pytest.mark.asyncio
+    async def test_failing_request_does_not_stop_others(
+        self, default_request_with_recipients
+    ):
+        """Test that an unexpected error in one request does not cancel the rest."""
+        second_request = default_request_with_recipients.model_copy()
+        second_request.id = 2
+        second_request.grouping_value = "Italy"
+
+        with (
+            patch(
+                "agent_main.execute_sales_report_request",
+                side_effect=[Exception("Unexpected failure"), None],
+            ) as mock_execute,
+            patch("agent_main.default_logger"),
+        ):
+            await execute_sales_report_requests(
+                [default_request_with_recipients, second_request],
+                max_concurrent_requests=2,
+            )
+
+            assert mock_execute.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_requests_with_same_task_are_coalesced(
+        self, default_request_with_recipients
+    ):
+        """Test that requests only differing in recipients generate one report."""
+        second_request = default_request_with_recipients.model_copy()
+        second_request.id = 2
+        second_request.recipients = [
+            RecipientEmail(email="other@example.com", name="Other User")
+        ]
+        # Different period means different data work
+        third_request = default_request_with_recipients.model_copy()
+        third_request.id = 3
+        third_request.period = KpiPeriodsEnum.QUARTERLY
+
+        with (
+            patch("agent_main.execute_sales_report_request") as mock_execute,
+            patch("agent_main.default_logger"),
+        ):
+            await execute_sales_report_requests(
+                [default_request_with_recipients, second_request, third_request],
+                max_concurrent_requests=2,
+            )
+
+            assert mock_execute.call_count == 2
+            mock_execute.assert_any_call(
+                default_request_with_recipients,
+                recipient_lists=[
+                    default_request_with_recipients.recipients,
+                    second_request.recipients,
+                ],
+            )
+            mock_execute.assert_any_call(
+                third_request, recipient_lists=[third_request.recipients]
+            )
+
+
+class TestGroupRequestsByTask:
+    """Test suite for group_requests_by_task function."""
+
+    def test_groups_only_requests_with_same_work(self, default_request):
+        """Test that only the recipients may differ within a group."""
+        same_work = default_request.model_copy(update={"id": 2, "recipients": []})
+        other_currency = default_request.model_copy(
+            update={"id": 3, "currency": SalesCurrencyEnum.REPORTING}
+        )
+        other_value = default_request.model_copy(
+            update={"id": 4, "grouping_value": "Italy"}
+        )
+
+        groups = group_requests_by_task(
+            [default_request, other_currency, same_work, other_value]
+        )
+
+        assert groups == [
+            [default_request, same_work],
+            [other_currency],
+            [other_value],
+        ]
@@ -1,4 +1,19 @@
-from src.agents.tools.python_interpreter import CustomPythonREPL
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from src.agents.tools.python_interpreter import (
+    INTERNAL_DATA_VARIABLE,
+    CustomPythonREPL,
+    close_request_python_repl,
+    create_python_repl_tool,
+    describe_repl_dataframes,
+    get_python_repl_config,
+    get_request_python_repl,
+)
 
 
 def test_output_without_errors_with_two_print_statements():
@@ -49,3 +64,113 @@ result = 10 / 0  # This will cause a ZeroDivisionError
         "ZeroDivisionError('division by zero')" in result
         or "ZeroDivisionError:" in result
     )
+
+
+def test_tool_uses_repl_from_config():
+    """Test that a shared tool executes code in the REPL provided in the run config."""
+    tool = create_python_repl_tool()
+    first_repl = CustomPythonREPL()
+    second_repl = CustomPythonREPL()
+
+    tool.invoke("x = 1", config=get_python_repl_config(first_repl))
+    tool.invoke("x = 2", config=get_python_repl_config(second_repl))
+
+    # Each REPL keeps its own namespace
+    assert "1" in tool.invoke("print(x)", config=get_python_repl_config(first_repl))
+    assert "2" in tool.invoke("print(x)", config=get_python_repl_config(second_repl))
+
+
+def test_repl_starts_with_imports_and_internal_data():
+    """Test that a new REPL has the standard imports and the internal data preloaded."""
+    internal_data = pd.DataFrame({"SALES_FUNCTIONAL_CURRENCY": [1.0, 2.0]})
+    with patch(
+        "src.agents.tools.python_interpreter.get_repl_data",
+        return_value=internal_data,
+    ):
+        repl = CustomPythonREPL()
+
+    result = repl.run(
+        f"print(pd.__name__, np.__name__, plt.__name__)\n"
+        f"print({INTERNAL_DATA_VARIABLE}['SALES_FUNCTIONAL_CURRENCY'].sum())"
+    )
+
+    assert "pandas numpy matplotlib.pyplot" in result
+    assert "3.0" in result
+
+
+def test_concurrent_executions_capture_their_own_output():
+    """Test that executions running in parallel threads don't mix their outputs."""
+    repls = [CustomPythonREPL() for _ in range(4)]
+    command = """
+import time
+for i in range(20):
+    print(f"{name}-{i}")
+    time.sleep(0.001)
+"""
+
+    def run(index: int) -> str:
+        repls[index].run(f"name = 'repl{index}'")
+        return repls[index].run(command)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(run, range(4)))
+
+    for index, result in enumerate(results):
+        assert result.split() == [f"repl{index}-{i}" for i in range(20)]
+
+
+@pytest.mark.asyncio
+async def test_output_outside_executions_is_not_captured(capsys):
+    """Test that output of other code running during an execution is not captured."""
+    repl = CustomPythonREPL()
+
+    async def print_meanwhile():
+        for _ in range(5):
+            print("unrelated output")
+            await asyncio.sleep(0.01)
+
+    command = "import time\nfor _ in range(5):\n    print('repl output')\n    time.sleep(0.01)"
+    result, _ = await asyncio.gather(repl.arun(command), print_meanwhile())
+
+    assert "unrelated output" not in result
+    assert result.count("repl output") == 5
+    assert capsys.readouterr().out.count("unrelated output") == 5
+
+
+def test_tool_message_holds_structured_result(tmp_path):
+    """Test that the tool message has the exception and the files produced as its artifact."""
+    tool = create_python_repl_tool()
+    config = get_python_repl_config(CustomPythonREPL(), output_dir=tmp_path)
+    command = (
+        f"pd.DataFrame({{'Error_rate': [0.1]}}).to_csv('{tmp_path}/rates.csv')\n"
+        "print(pd.read_csv('missing.csv'))"
+    )
+
+    message = tool.invoke(
+        {"name": "python_repl", "args": {"query": command}, "id": "1", "type": "tool_call"},
+        config=config,
+    )
+
+    assert message.artifact.error_type == "FileNotFoundError"
+    assert message.artifact.error_line == 2
+    assert message.artifact.error_code == "print(pd.read_csv('missing.csv'))"
+    assert message.artifact.files == [str(tmp_path / "rates.csv")]
+    assert "FileNotFoundError" in message.content
+
+
+def test_agents_of_a_request_share_its_repl():
+    """Test that dataframes computed by an agent stay loaded for the next agents of the request."""
+    with patch("src.agents.tools.python_interpreter.app_settings.repl_isolated_kernels", False):
+        repl = get_request_python_repl("task-1")
+        repl.run("history = pd.DataFrame({'MONTH': [1, 2], 'SALES': [3.0, 4.0]})")
+
+        assert get_request_python_repl("task-1") is repl
+        assert get_request_python_repl("task-2") is not repl
+        assert describe_repl_dataframes(repl) == "- `history`: MONTH, SALES"
+
+        close_request_python_repl("task-1")
+        close_request_python_repl("task-2")
+
+        assert "history" not in repl.locals
+        assert get_request_python_repl("task-1") is not repl
+        close_request_python_repl("task-1")
@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.agents.tools.code_preflight import (
+    PreflightContext,
+    check_code,
+    get_preflight_context,
+    is_preflight_error,
+)
+from src.agents.tools.python_interpreter import (
+    CustomPythonREPL,
+    create_python_repl_tool,
+    get_python_repl_config,
+)
+
+
+@pytest.fixture()
+def context() -> PreflightContext:
+    sales = pd.DataFrame({"SOLD_TO_CITY": ["MADRID"], "GROSS_AMOUNT": [10.0]})
+    return get_preflight_context({"pd": pd, "sales": sales}, {"threshold": 5})
+
+
+def test_valid_code_passes(context: PreflightContext, tmp_path: Path):
+    code = f"""
+import numpy as np
+sales["NET_AMOUNT"] = sales["GROSS_AMOUNT"] * 0.9
+totals = sales.groupby("SOLD_TO_CITY")[["NET_AMOUNT"]].sum()
+big = [value for value in totals["NET_AMOUNT"] if value > threshold]
+totals.to_csv("{tmp_path}/totals.csv")
+print(len(big), np.pi)
+"""
+    assert check_code(code, context, tmp_path) is None
+
+
+def test_syntax_error_is_reported_with_its_line():
+    error = check_code("x = 1\nprint(x", PreflightContext()).to_text()
+
+    assert is_preflight_error(error)
+    assert "SyntaxError" in error
+    assert "line 2" in error
+
+
+def test_undefined_name_suggests_close_names(context: PreflightContext):
+    error = check_code("print(sale.shape)", context).to_text()
+
+    assert is_preflight_error(error)
+    assert "NameError: name 'sale' is not defined (line 1). Did you mean: sales?" in error
+
+
+def test_missing_column_suggests_close_columns(context: PreflightContext):
+    result = check_code('print(sales.groupby("SOLD_TO_CTY").size())', context)
+    error = result.to_text()
+
+    assert (result.error_type, result.executed) == ("KeyError", False)
+    assert "KeyError: 'SOLD_TO_CTY' is not a column of sales" in error
+    assert "Did you mean: SOLD_TO_CITY?" in error
+
+
+def test_index_levels_are_known_columns():
+    sales = pd.DataFrame(
+        {"SOLD_TO_CITY": ["MADRID"], "GROSS_AMOUNT": [10.0]}
+    ).set_index("SOLD_TO_CITY")
+    context = get_preflight_context({"sales": sales})
+
+    assert check_code('print(sales.groupby("SOLD_TO_CITY").sum())', context) is None
+    assert check_code('print(sales.sort_values(by="SOLD_TO_CITY"))', context) is None
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        'sales.rename(columns={"SOLD_TO_CITY": "CITY"}, inplace=True)\nprint(sales["CITY"])',
+        'sales.columns = ["CITY", "AMOUNT"]\nprint(sales.groupby("CITY").sum())',
+        'sales.loc[:, "NET"] = 1.0\nprint(sales["NET"])',
+        'sales.insert(0, "NET", 1.0)\nprint(sales["NET"])',
+        'sales.reset_index(inplace=True)\nprint(sales["index"])',
+        'column = "NET"\nsales[column] = 1.0\nprint(sales["NET"])',
+        'alias = sales\nalias["NET"] = 1.0\nprint(sales["NET"])',
+    ],
+)
+def test_changed_dataframes_are_not_checked(context: PreflightContext, code: str):
+    assert check_code(code, context) is None
+
+
+def test_rebound_dataframes_are_not_checked(context: PreflightContext):
+    code = 'sales = pd.read_csv("other.csv")\nprint(sales["OTHER"])'
+
+    assert check_code(code, context) is None
+
+
+def test_dynamic_code_is_not_checked_for_names(context: PreflightContext):
+    assert check_code("exec('y = 1')\nprint(y)", context) is None
+
+
+def test_writes_outside_output_dir_are_rejected(tmp_path: Path):
+    error = check_code(
+        "import matplotlib.pyplot as plt\nplt.savefig('/tmp/chart.png')",
+        output_dir=tmp_path,
+    ).to_text()
+
+    assert "PermissionError: '/tmp/chart.png' is outside of the directory" in error
+    assert check_code(f"open('{tmp_path}/notes.txt', 'w')", output_dir=tmp_path) is None
+    assert check_code("open('/etc/hosts').read()", output_dir=tmp_path) is None
+    # Relative paths depend on the working directory of the REPL
+    assert check_code("sales.to_csv('out.csv')", output_dir=tmp_path) is None
+
+
+def test_tool_does_not_execute_code_failing_checks(tmp_path: Path):
+    python_repl = CustomPythonREPL()
+    tool = create_python_repl_tool()
+    config = get_python_repl_config(python_repl, output_dir=tmp_path)
+
+    output = tool.invoke("x = 1\nprint(undefined_value)", config=config)
+
+    assert is_preflight_error(output)
+    assert "x" not in python_repl.locals
@@ -0,0 +1,66 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph.message import add_messages
+
+from src.agents.utils.context_compaction import (
+    COMPACTED_MARKER,
+    compact_messages,
+    estimate_tokens,
+)
+
+
+def create_history(turns: int) -> list:
+    """A history of turns, each with a tool call and a long output saving a file."""
+    messages = [HumanMessage(content="Compute the monthly sales.", id="request")]
+    for turn in range(turns):
+        messages += [
+            AIMessage(
+                content="",
+                id=f"call_{turn}",
+                tool_calls=[
+                    {"name": "python_repl", "args": {"query": "print(df)"}, "id": f"{turn}"}
+                ],
+            ),
+            ToolMessage(
+                content="\n".join(f"row {row}: {'x' * 50}" for row in range(100))
+                + f"\nSaved /tmp/request/monthly_{turn}.csv",
+                tool_call_id=f"{turn}",
+                id=f"output_{turn}",
+            ),
+        ]
+    return messages
+
+
+def test_history_within_budget_is_kept():
+    messages = create_history(2)
+
+    assert compact_messages(messages, max_tokens=100_000, keep_recent=2) == []
+
+
+def test_oldest_outputs_are_compacted_within_budget():
+    messages = create_history(10)
+    max_tokens = sum(map(estimate_tokens, messages)) // 2
+
+    compacted = compact_messages(messages, max_tokens, keep_recent=4)
+    messages = add_messages(messages, compacted)
+
+    assert sum(map(estimate_tokens, messages)) <= max_tokens
+    assert [message.id for message in compacted][:2] == ["output_0", "output_1"]
+    # Recent turns are intact, compacted outputs keep the files they mention
+    assert not messages[-1].content.startswith(COMPACTED_MARKER)
+    assert messages[2].content.startswith(COMPACTED_MARKER)
+    assert "/tmp/request/monthly_0.csv" in messages[2].content
+    assert messages[2].tool_call_id == "0"
+
+
+def test_size_of_compacted_history_stays_flat():
+    """The tokens sent per turn stop growing once over the budget."""
+    sizes = []
+    messages = []
+    for turns in (10, 20, 40):
+        messages = create_history(turns)
+        messages = add_messages(
+            messages, compact_messages(messages, max_tokens=10_000, keep_recent=4)
+        )
+        sizes.append(sum(map(estimate_tokens, messages)))
+
+    assert max(sizes) <= 10_000
@@ -0,0 +1,152 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from src.agents.tools.execution_cache import ExecutionCache
+from src.agents.tools.execution_result import ExecutionResult
+from src.agents.tools.python_interpreter import CustomPythonREPL
+
+
+@pytest.fixture()
+def execution_cache(tmp_path: Path) -> ExecutionCache:
+    return ExecutionCache(tmp_path / "executions")
+
+
+class CountingREPL(CustomPythonREPL):
+    """REPL running code through a given cache, counting the actual executions."""
+
+    executions: int = 0
+
+    def run_cached(self, execution_cache: ExecutionCache, command: str) -> str:
+        return execution_cache.run(
+            command, (self.globals, self.locals), self._execute
+        ).to_text()
+
+    def _execute(self, command: str) -> ExecutionResult:
+        self.executions += 1
+        return super()._execute(command)
+
+
+def test_code_already_executed_is_restored(execution_cache: ExecutionCache):
+    first_repl, second_repl = CountingREPL(), CountingREPL()
+
+    first_output = first_repl.run_cached(execution_cache, "x = 41\nprint(x + 1)")
+    # Formatting and comments don't change the key
+    second_output = second_repl.run_cached(
+        execution_cache, "x  =  41  # the answer\nprint( x + 1 )"
+    )
+
+    assert first_output == second_output == "42\n"
+    assert (first_repl.executions, second_repl.executions) == (1, 0)
+    assert second_repl.locals["x"] == 41
+
+
+def test_namespace_state_is_part_of_the_key(execution_cache: ExecutionCache):
+    repl = CountingREPL()
+
+    repl.run_cached(execution_cache, "x = 1")
+    assert repl.run_cached(execution_cache, "print(x * 2)") == "2\n"
+    repl.run_cached(execution_cache, "x = 2")
+
+    assert repl.run_cached(execution_cache, "print(x * 2)") == "4\n"
+
+
+def test_changed_input_file_is_read_again(
+    execution_cache: ExecutionCache, tmp_path: Path
+):
+    input_path = tmp_path / "input.csv"
+    command = f"print(pd.read_csv('{input_path}')['a'].sum())"
+    repl = CountingREPL()
+
+    pd.DataFrame({"a": [1, 2]}).to_csv(input_path, index=False)
+    assert repl.run_cached(execution_cache, command) == "3\n"
+    pd.DataFrame({"a": [1, 2, 3]}).to_csv(input_path, index=False)
+
+    assert repl.run_cached(execution_cache, command) == "6\n"
+    assert repl.executions == 2
+
+
+def test_written_files_are_restored(execution_cache: ExecutionCache, tmp_path: Path):
+    output_path = tmp_path / "output.csv"
+    command = f"pd.DataFrame({{'a': [1, 2]}}).to_csv('{output_path}', index=False)"
+    repl = CountingREPL()
+
+    repl.run_cached(execution_cache, command)
+    output_path.unlink()
+    repl.run_cached(execution_cache, command)
+
+    assert repl.executions == 1
+    assert pd.read_csv(output_path)["a"].tolist() == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        # The file read can't be known before the execution
+        "path = 'data.csv'\nprint(pd.read_csv(path) if False else 1)",
+        # Failed executions are not stored
+        "print(undefined_name)",
+        # Modifying a variable in place can't be restored
+        "values.append(1)",
+        # Functions defined in the REPL can't be fingerprinted
+        "print(square(2))",
+        # The result changes from one run to the next
+        "import datetime\nprint(datetime.date.today())",
+        "print(np.random.rand())",
+        # Only the variables are restored, not the state of the modules
+        "import matplotlib.pyplot as plt\nplt.figure()\nplt.plot([1, 2])",
+        "pd.DataFrame({'a': [1, 2]}).plot()",
+        "pd.options.display.max_rows = 5",
+    ],
+)
+def test_uncacheable_code_is_always_executed(
+    execution_cache: ExecutionCache, command: str
+):
+    repl = CountingREPL()
+    repl.run_cached(execution_cache, "values = []\ndef square(x):\n    return x * x")
+    repl.executions = 0
+
+    repl.run_cached(execution_cache, command)
+    repl.run_cached(execution_cache, command)
+
+    assert repl.executions == 2
+
+
+def test_large_effects_are_not_stored(execution_cache: ExecutionCache):
+    repl = CountingREPL()
+    command = "values = np.zeros(1_000_000)"
+
+    with patch(
+        "src.agents.tools.execution_cache.app_settings.repl_memoize_max_entry_mb", 1
+    ):
+        repl.run_cached(execution_cache, command)
+        repl.run_cached(execution_cache, command)
+
+    assert repl.executions == 2
+
+
+def test_least_recently_used_entries_are_evicted(
+    execution_cache: ExecutionCache, tmp_path: Path
+):
+    repl = CountingREPL()
+    commands = [f"values_{index} = np.full(100_000, {index})" for index in range(3)]
+
+    # Each entry uses about 0.8 MB, so the cache holds two of them
+    with patch(
+        "src.agents.tools.execution_cache.app_settings.repl_memoize_max_size_mb", 2
+    ):
+        repl.run_cached(execution_cache, commands[0])
+        repl.run_cached(execution_cache, commands[1])
+        # Using the first entry again makes the second the least recently used
+        repl.run_cached(execution_cache, commands[0])
+        repl.run_cached(execution_cache, commands[2])
+        assert len(list((tmp_path / "executions").glob("*/*"))) == 2
+        repl.executions = 0
+        repl.run_cached(execution_cache, commands[0])
+        repl.run_cached(execution_cache, commands[2])
+        assert repl.executions == 0
+        repl.run_cached(execution_cache, commands[1])
+
+    assert repl.executions == 1
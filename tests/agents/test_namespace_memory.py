@@ -0,0 +1,113 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.agents.tools.namespace_memory import NamespaceLocals, get_value_size
+from src.agents.tools.python_interpreter import CustomPythonREPL
+
+# Each frame of the tests uses about 8 MB
+CREATE_FRAME = "pd.DataFrame({{'VALUE': np.arange(1_000_000, dtype='float64') * {factor}}})"
+
+
+@pytest.fixture(autouse=True)
+def spill_dir(tmp_path: Path):
+    with patch("src.agents.tools.namespace_memory.SPILL_DIR", tmp_path):
+        yield tmp_path
+
+
+@pytest.fixture()
+def repl() -> CustomPythonREPL:
+    with patch(
+        "src.agents.tools.python_interpreter.app_settings.repl_namespace_max_memory_mb",
+        20,
+    ):
+        yield CustomPythonREPL()
+
+
+def test_namespace_within_budget_is_kept(repl: CustomPythonREPL):
+    output = repl.run(f"first = {CREATE_FRAME.format(factor=1)}")
+
+    assert output == ""
+    assert not repl.locals.spilled
+
+
+def test_stale_frames_are_spilled_and_reloaded(repl: CustomPythonREPL, spill_dir: Path):
+    repl.run(f"first = {CREATE_FRAME.format(factor=1)}")
+    repl.run(f"second = {CREATE_FRAME.format(factor=2)}")
+    output = repl.run(f"third = {CREATE_FRAME.format(factor=3)}")
+
+    # The least recently used frame goes to disk, and the agent is told
+    assert list(repl.locals.spilled) == ["first"]
+    assert "Spilled to disk, reloaded automatically when used: first (7.6 MB)" in output
+    assert len(list(spill_dir.rglob("*.parquet"))) == 1
+
+    output = repl.run("print(first['VALUE'].iloc[-1])")
+
+    # Reloading it goes over the budget again, so the next stale frame is spilled
+    assert output.startswith("999999.0\n")
+    assert list(repl.locals.spilled) == ["second"]
+
+
+def test_spilled_frames_are_still_known_to_the_checks(repl: CustomPythonREPL):
+    for index in range(3):
+        repl.run(f"frame_{index} = {CREATE_FRAME.format(factor=index)}")
+
+    context = repl.get_preflight_context()
+
+    assert "frame_0" in repl.locals.spilled
+    assert context.columns["frame_0"] == {"VALUE"}
+
+
+def test_replaced_or_deleted_spilled_frames_are_discarded(repl: CustomPythonREPL):
+    for index in range(3):
+        repl.run(f"frame_{index} = {CREATE_FRAME.format(factor=index)}")
+
+    repl.run("frame_0 = 1\ndel frame_1")
+
+    assert repl.locals["frame_0"] == 1
+    assert "frame_1" not in repl.locals
+    assert "NameError" in repl.run("print(frame_1)")
+
+
+def test_values_that_cant_be_spilled_stay_in_memory():
+    namespace = NamespaceLocals(
+        values=np.zeros(2_000_000),
+        pivoted=pd.DataFrame(np.zeros((1_000_000, 2)), columns=[1, 2]),
+    )
+
+    report = namespace.enforce_budget(set(), max_bytes=2**20)
+
+    assert not namespace.spilled
+    assert "Nothing could be spilled to disk" in report
+    assert get_value_size(namespace["values"]) == 16_000_000
+
+
+def test_series_are_restored_as_series():
+    units = pd.Series(np.arange(1_000_000), name="UNITS")
+    unnamed = pd.Series(np.arange(1_000_000), index=np.arange(1_000_000) * 2)
+    namespace = NamespaceLocals(units=units, unnamed=unnamed, other=1)
+
+    namespace.enforce_budget({"other"}, max_bytes=2**20)
+
+    assert set(namespace.spilled) == {"units", "unnamed"}
+    pd.testing.assert_series_equal(namespace["units"], units)
+    pd.testing.assert_series_equal(namespace["unnamed"], unnamed)
+
+
+def test_values_bound_to_several_names_are_counted_once_and_kept(
+    repl: CustomPythonREPL,
+):
+    repl.run(f"first = {CREATE_FRAME.format(factor=1)}\nalias = first")
+    repl.run(f"second = {CREATE_FRAME.format(factor=2)}")
+    output = repl.run(f"third = {CREATE_FRAME.format(factor=3)}")
+
+    # first is the least recently used, but spilling it would not free memory
+    assert list(repl.locals.spilled) == ["second"]
+    # alias and first are counted once
+    assert "Memory: the variables use 15.3 MB" in output
+    repl.run("alias.loc[0, 'VALUE'] = -1.0")
+    assert repl.locals["first"] is repl.locals["alias"]
+    assert repl.locals["first"]["VALUE"].iloc[0] == -1.0
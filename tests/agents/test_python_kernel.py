@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from src.agents.tools.python_kernel import KernelPool, KernelPythonREPL
+
+
+@pytest.fixture(scope="module")
+def kernel_pool():
+    """Pool shared by the tests, as starting a kernel takes a few seconds."""
+    pool = KernelPool(size=1)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture()
+def python_repl(kernel_pool: KernelPool):
+    python_repl = KernelPythonREPL(kernel_pool)
+    yield python_repl
+    python_repl.close()
+
+
+def test_kernel_keeps_state_and_has_imports(python_repl: KernelPythonREPL):
+    python_repl.run("x = pd.Series([1, 2, 3])")
+
+    result = python_repl.run("print(x.sum(), np.__name__, plt.__name__)")
+
+    assert "6 numpy matplotlib.pyplot" in result
+
+
+def test_preflight_context_comes_from_kernel(python_repl: KernelPythonREPL):
+    python_repl.run("sales = pd.DataFrame({'CITY': ['MADRID']})")
+
+    context = python_repl.get_preflight_context()
+
+    assert {"pd", "np", "plt", "sales"} <= context.defined_names
+    assert context.columns["sales"] == {"CITY"}
+
+
+def test_errors_are_returned(python_repl: KernelPythonREPL):
+    result = python_repl.run("print('before')\n1 / 0")
+
+    assert "before" in result
+    assert "ZeroDivisionError" in result
+
+
+def test_timeout_restarts_kernel(
+    python_repl: KernelPythonREPL, monkeypatch: pytest.MonkeyPatch
+):
+    python_repl.run("x = 1")
+    monkeypatch.setattr(
+        "src.agents.tools.python_kernel.app_settings.repl_timeout_seconds", 1
+    )
+
+    result = python_repl.run("while True:\n    pass")
+
+    assert "TimeoutError" in result
+    assert "restarted" in result
+    # The next execution runs in a fresh kernel
+    assert "NameError" in python_repl.run("print(x)")
+
+
+def test_memory_cap_restarts_kernel(
+    python_repl: KernelPythonREPL, monkeypatch: pytest.MonkeyPatch
+):
+    python_repl.run("x = 1")
+    monkeypatch.setattr(
+        "src.agents.tools.python_kernel.app_settings.repl_max_memory_mb", 300
+    )
+
+    result = python_repl.run(
+        "import time\nblocks = []\n"
+        "for _ in range(100):\n"
+        "    blocks.append(bytearray(50 * 2**20))\n"
+        "    time.sleep(0.05)"
+    )
+
+    assert "MemoryError" in result
+    assert "1" in python_repl.run("print(1)")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_execution_does_not_block_event_loop(
+    python_repl: KernelPythonREPL,
+):
+    python_repl.run("x = 1")
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker = asyncio.create_task(tick())
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(python_repl.arun("while True:\n    pass"), timeout=0.5)
+    ticker.cancel()
+
+    # The event loop kept running and the execution was stopped
+    assert ticks > 10
+    assert "NameError" in await python_repl.arun("print(x)")
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.agents.tools.python_interpreter import (
+    CustomPythonREPL,
+    create_python_repl_tool,
+    get_python_repl_config,
+)
+from src.agents.tools.repl_output import limit_output
+from src.configuration.settings import app_settings
+
+
+def test_large_dataframes_are_summarized_when_printed():
+    repl = CustomPythonREPL()
+    repl.run("df = pd.DataFrame({'MONTH': range(1000), 'SALES': [1.0] * 1000})")
+
+    result = repl.run("print(df)")
+
+    assert "DataFrame with 1000 rows and 2 columns" in result
+    assert "Column types: MONTH (int64), SALES (float64)" in result
+    assert "Summary statistics:" in result
+    # Only the first and last rows are shown
+    assert " 999 " in result and " 500 " not in result
+
+
+def test_small_dataframes_are_printed_as_usual():
+    repl = CustomPythonREPL()
+    repl.run("df = pd.DataFrame({'SALES': [1.0, 2.0]})")
+
+    result = repl.run("print(df)")
+
+    assert result == str(pd.DataFrame({"SALES": [1.0, 2.0]})) + "\n"
+
+
+def test_printing_to_files_is_not_summarized(tmp_path: Path):
+    repl = CustomPythonREPL()
+
+    repl.run(
+        f"with open(r'{tmp_path / 'out.txt'}', 'w') as file:\n"
+        "    print(pd.Series(range(100)).to_list(), file=file)"
+    )
+
+    assert (tmp_path / "out.txt").read_text().count(",") == 99
+
+
+def test_short_output_is_kept():
+    assert limit_output("short output") == "short output"
+
+
+def test_long_output_is_saved_to_file(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(app_settings, "repl_output_max_bytes", 100)
+    output = "start\n" + "x" * 1000 + "\nZeroDivisionError('division by zero')"
+
+    limited = limit_output(output, tmp_path)
+
+    assert len(limited) < 300
+    assert limited.startswith("start")
+    # Errors at the end of the output are kept
+    assert limited.endswith("ZeroDivisionError('division by zero')")
+    (saved_file,) = tmp_path.glob("python_output_*.txt")
+    assert saved_file.read_text() == output
+    assert str(saved_file) in limited
+
+
+def test_tool_limits_output(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(app_settings, "repl_output_max_bytes", 100)
+    tool = create_python_repl_tool()
+
+    result = tool.invoke(
+        "print('x' * 1000)",
+        config=get_python_repl_config(CustomPythonREPL(), output_dir=tmp_path),
+    )
+
+    assert "bytes omitted" in result
+    assert len(list(tmp_path.glob("python_output_*.txt"))) == 1
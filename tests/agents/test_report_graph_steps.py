@@ -49,6 +49,10 @@ def patch_graph_environment(
         "src.agents.internal_data_agent.get_request_temp_dir",
         patched_get_request_temp_dir,
     )
+    monkeypatch.setattr(
+        "src.agents.report_graph.get_request_temp_dir",
+        patched_get_request_temp_dir,
+    )
 
 
 @pytest.fixture()
@@ -394,3 +398,130 @@ async def test_email_template_generation(
     assert "RECIPIENT" in step_result["email_template"], (
         "Expected the email template to contain the 'RECIPIENT' tag."
     )
+
+
+@pytest.mark.asyncio
+async def test_independent_steps_run_concurrently(
+    monkeypatch: pytest.MonkeyPatch, default_request: SalesReportRequest
+):
+    """Test that the graph runs the independent steps at the same time, and joins them."""
+    import asyncio
+
+    from src.agents import report_graph
+
+    events = []
+
+    def create_step(name: str, update: dict):
+        async def step(state):
+            events.append(f"start {name}")
+            await asyncio.sleep(0.05)
+            events.append(f"end {name}")
+            return update
+
+        return step
+
+    steps = {
+        "retrieve_sales_history": {"sales_history": "history"},
+        "process_sales_data": {"sales_analysis": "analysis"},
+        "retrieve_operational_data": {"sales_operational_data": "operations"},
+        "review_special_cases": {"is_special_case": False},
+        "generate_report": {"report": "report"},
+        "generate_email_template": {"email_template": "email"},
+        "store_report": {"report_pdf_path": "report.pdf"},
+    }
+    for name, update in steps.items():
+        monkeypatch.setattr(report_graph, name, create_step(name, update))
+
+    result = await report_graph.compile_report_graph().ainvoke(
+        {"request": default_request}
+    )
+
+    # Both branches start before either ends, and the review waits for both
+    assert set(events[2:4]) == {"start process_sales_data", "start retrieve_operational_data"}
+    assert events.index("start review_special_cases") == 6
+    assert set(events[-4:-2]) == {"start generate_email_template", "start store_report"}
+    assert (result["sales_operational_data"], result["report_pdf_path"]) == (
+        "operations",
+        "report.pdf",
+    )
+
+
+@pytest.mark.asyncio
+async def test_sub_analyses_run_concurrently_up_to_the_limit(
+    monkeypatch: pytest.MonkeyPatch,
+    default_request: SalesReportRequest,
+    tmp_path: Path,
+):
+    """Test that the values of a multi-value request are analysed in parallel, but bounded."""
+    import asyncio
+
+    from src.agents import report_graph
+
+    request = default_request.model_copy(update={"grouping_value": "all"})
+    values = ["SPAIN", "GERMANY", "FRANCE", "ITALY"]
+    running, max_running = 0, 0
+
+    async def analyse_sales_history(
+        request, kpi_description, input_location, output_dir
+    ):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        # Every agent saves a chart with the same name, in its own directory
+        (output_dir / "sales_trend.png").write_bytes(input_location.name.encode())
+        await asyncio.sleep(0.05)
+        running -= 1
+        return f"Analysis of {input_location.name}, see sales_trend.png"
+
+    def store_sub_analysis_histories(request, input_location, max_values):
+        return {value: Path(f"{value.lower()}.csv") for value in values[:max_values]}
+
+    monkeypatch.setattr(report_graph, "analyse_sales_history", analyse_sales_history)
+    monkeypatch.setattr(
+        report_graph, "store_sub_analysis_histories", store_sub_analysis_histories
+    )
+    monkeypatch.setattr(
+        report_graph, "get_sales_history_location", lambda request: tmp_path / "all.csv"
+    )
+    monkeypatch.setattr(report_graph.app_settings, "grouped_report_max_sub_analyses", 3)
+    monkeypatch.setattr(report_graph.app_settings, "grouped_report_max_concurrency", 2)
+
+    analysis = await report_graph.analyse_grouped_sales_history(request)
+
+    assert max_running == 2
+    assert (
+        "## FRANCE\n\nAnalysis of france.csv, see france_sales_trend.png" in analysis
+    )
+    assert (tmp_path / "france_sales_trend.png").read_text() == "france.csv"
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "france_sales_trend.png",
+        "germany_sales_trend.png",
+        "spain_sales_trend.png",
+    ]
+    assert "ITALY" not in analysis
+
+
+@pytest.mark.asyncio
+async def test_sales_analysis_runs_concurrently_in_a_repl_of_its_own(
+    monkeypatch: pytest.MonkeyPatch, default_request: SalesReportRequest
+):
+    """Test that the analysis does not share the REPL of the operational data, running concurrently."""
+    from unittest.mock import AsyncMock, MagicMock
+
+    from src.agents import report_graph
+
+    python_repl = MagicMock()
+    get_quantitative_agent = MagicMock()
+    get_quantitative_agent.return_value.ainvoke = AsyncMock(
+        return_value={"messages": [MagicMock(content="analysis")]}
+    )
+    monkeypatch.setattr(report_graph, "create_python_repl", lambda: python_repl)
+    monkeypatch.setattr(report_graph, "get_quantitative_agent", get_quantitative_agent)
+    monkeypatch.setattr(report_graph, "render_prompt_template", MagicMock())
+
+    await report_graph.analyse_sales_history(
+        default_request, default_request.description, Path("history.csv")
+    )
+
+    assert get_quantitative_agent.call_args.kwargs["python_repl"] is python_repl
+    python_repl.close.assert_called_once()
@@ -0,0 +1,209 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import os
+import time
+
+import pandas as pd
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.agents.code_agent_with_review import PreConfiguredCodeAgent
+from src.agents.tools.python_interpreter import (
+    CustomPythonREPL,
+    create_python_repl_tool,
+    get_python_repl_config,
+)
+from src.agents.utils.trajectory_replay import (
+    Trajectory,
+    TrajectoryStore,
+    ainvoke_with_replay,
+    covers_last_period,
+    extract_trajectory,
+    find_date_literals,
+    replay_trajectory,
+)
+
+NODE = "retrieve_operational_data"
+
+
+class ScriptedAgent:
+    """Agent writing the same code on each run, through the python tool."""
+
+    succeeded = staticmethod(PreConfiguredCodeAgent.succeeded)
+
+    def __init__(self, code: str, output_dir: Path):
+        self.python_repl = CustomPythonREPL()
+        self.code = code
+        self.output_dir = output_dir
+        self.invocations = 0
+
+    async def ainvoke(self, messages: list) -> dict:
+        self.invocations += 1
+        tool_call = {"name": "python_repl", "args": {"query": self.code}, "id": "1"}
+        tool_message = await create_python_repl_tool().ainvoke(
+            {**tool_call, "type": "tool_call"},
+            config=get_python_repl_config(self.python_repl, self.output_dir),
+        )
+        return {
+            "messages": [
+                *messages,
+                AIMessage(content="", tool_calls=[tool_call]),
+                tool_message,
+                AIMessage(content="The history is saved in history.csv."),
+            ],
+            "errors_counter": 0,
+            "max_errors": 5,
+            "iterations_counter": 1,
+            "max_iterations": 25,
+        }
+
+
+@pytest.fixture()
+def store(tmp_path: Path) -> TrajectoryStore:
+    return TrajectoryStore(tmp_path / "trajectories")
+
+
+@pytest.fixture()
+def output_dir(tmp_path: Path) -> Path:
+    output_dir = tmp_path / "request"
+    output_dir.mkdir()
+    pd.DataFrame({"SALES": [1.0, 2.0]}).to_csv(output_dir / "input.csv", index=False)
+    return output_dir
+
+
+def create_agent(output_dir: Path) -> ScriptedAgent:
+    code = (
+        f"history = pd.read_csv('{output_dir}/input.csv')\n"
+        f"history.to_csv('{output_dir}/history.csv', index=False)\n"
+        "print(history['SALES'].sum())"
+    )
+    return ScriptedAgent(code, output_dir)
+
+
+async def run_step(agent: ScriptedAgent, store: TrajectoryStore, output_dir: Path) -> str:
+    return await ainvoke_with_replay(
+        agent,
+        [HumanMessage("Retrieve the operational data.")],
+        task_id="sales_report_total",
+        node=NODE,
+        output_dir=output_dir,
+        trajectory_store=store,
+    )
+
+
+@pytest.mark.asyncio
+async def test_trajectory_is_stored_with_placeholders(
+    store: TrajectoryStore, output_dir: Path
+):
+    agent = create_agent(output_dir)
+
+    response = await run_step(agent, store, output_dir)
+    trajectory = store.load("sales_report_total", NODE)
+
+    assert response == "The history is saved in history.csv."
+    assert trajectory.files == ["<<output_dir>>/history.csv"]
+    assert "pd.read_csv('<<output_dir>>/input.csv')" in trajectory.steps[0]
+
+
+@pytest.mark.asyncio
+async def test_next_run_replays_the_code_on_the_new_data(
+    store: TrajectoryStore, output_dir: Path
+):
+    await run_step(create_agent(output_dir), store, output_dir)
+    (output_dir / "history.csv").unlink()
+    pd.DataFrame({"SALES": [1.0, 2.0, 4.0]}).to_csv(output_dir / "input.csv", index=False)
+    agent = create_agent(output_dir)
+
+    response = await run_step(agent, store, output_dir)
+
+    assert agent.invocations == 0
+    assert "7.0" in response
+    assert "- history.csv" in response
+    assert pd.read_csv(output_dir / "history.csv")["SALES"].sum() == 7.0
+
+
+@pytest.mark.asyncio
+async def test_failed_replay_falls_back_to_the_agent(
+    store: TrajectoryStore, output_dir: Path
+):
+    await run_step(create_agent(output_dir), store, output_dir)
+    pd.DataFrame({"AMOUNT": [1.0]}).to_csv(output_dir / "input.csv", index=False)
+    agent = create_agent(output_dir)
+
+    await run_step(agent, store, output_dir)
+
+    # The agent failed too, so there is no trajectory to replay anymore
+    assert agent.invocations == 1
+    assert store.load("sales_report_total", NODE) is None
+
+
+def test_failed_executions_are_not_part_of_the_trajectory(tmp_path: Path):
+    repl = CustomPythonREPL()
+    tool = create_python_repl_tool()
+    config = get_python_repl_config(repl, tmp_path)
+    messages = []
+    for index, code in enumerate(["print(missing_name)", "x = 1\nprint(x)"]):
+        tool_call = {"name": "python_repl", "args": {"query": code}, "id": str(index)}
+        messages += [
+            AIMessage(content="", tool_calls=[tool_call]),
+            tool.invoke({**tool_call, "type": "tool_call"}, config=config),
+        ]
+
+    assert extract_trajectory(messages, tmp_path).steps == ["x = 1\nprint(x)"]
+
+
+@pytest.mark.parametrize(
+    "code, literals",
+    [
+        ("last = df[df['INVOICE_MONTH'] == 9]", ["9"]),
+        ("last = df[(df.INVOICE_YEAR >= 2021) & (df.INVOICE_MONTH < 10)]", ["2021", "10"]),
+        ("last = df[df['MONTH_YEAR'] == '2023-11']", ["'2023-11'"]),
+        ("last = df[df['INVOICE_MONTH'].isin([10, 11])]", ["10", "11"]),
+        ("last = df[df['MONTH_YEAR'] == '<<last_month>>'].head(5)", []),
+    ],
+)
+def test_date_literals_are_found(code: str, literals: list[str]):
+    assert sorted(find_date_literals(code)) == sorted(literals)
+
+
+@pytest.mark.asyncio
+async def test_code_with_dates_is_not_replayed(output_dir: Path):
+    trajectory = Trajectory(
+        steps=[
+            "sales = pd.read_csv('<<output_dir>>/input.csv')\n"
+            "sales['INVOICE_MONTH'] = 11\n"
+            "print(sales[sales['INVOICE_MONTH'] == 11])"
+        ],
+        files=[],
+    )
+
+    assert await replay_trajectory(trajectory, CustomPythonREPL(), output_dir) is None
+
+
+@pytest.mark.asyncio
+async def test_files_of_the_previous_run_are_not_accepted(output_dir: Path):
+    trajectory = Trajectory(
+        steps=["print(pd.read_csv('<<output_dir>>/input.csv').shape)"],
+        files=["<<output_dir>>/history.csv"],
+    )
+    history_path = output_dir / "history.csv"
+    pd.DataFrame({"SALES": [1.0]}).to_csv(history_path, index=False)
+    a_month_ago = time.time() - 30 * 24 * 3600
+    os.utime(history_path, (a_month_ago, a_month_ago))
+
+    assert await replay_trajectory(trajectory, CustomPythonREPL(), output_dir) is None
+
+
+def test_outputs_must_end_with_the_last_period(output_dir: Path):
+    history_path = output_dir / "history.csv"
+
+    with patch(
+        "src.agents.utils.trajectory_replay.app_settings.is_data_current", False
+    ):
+        # The analysis date is 2023-12-01, so the history must end in 2023-11
+        pd.DataFrame({"MONTH_YEAR": ["2023-10", "2023-11"]}).to_csv(history_path)
+        assert covers_last_period(history_path)
+        pd.DataFrame({"MONTH_YEAR": ["2023-09", "2023-10"]}).to_csv(history_path)
+        assert not covers_last_period(history_path)
+        assert covers_last_period(output_dir / "input.csv")
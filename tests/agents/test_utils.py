@@ -1,3 +1,4 @@
+import pytest
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from src.agents.utils.prompt_utils import MessageTypes
@@ -188,3 +189,45 @@ def test_multimodal_prompt_with_system_and_human():
     assert isinstance(prompt.messages[0], SystemMessage)
     assert isinstance(prompt.messages[1], HumanMessage)
     assert isinstance(prompt.messages[2], HumanMessage)
+
+
+def test_runnable_registry_creates_each_runnable_once():
+    from src.agents.utils.runnable_registry import RunnableRegistry
+
+    registry = RunnableRegistry()
+    created = []
+
+    def factory():
+        created.append(object())
+        return created[-1]
+
+    first = registry.get_or_create("graph", factory)
+    second = registry.get_or_create("graph", factory)
+
+    assert first is second
+    assert len(created) == 1
+
+    # Clearing the registry forces the runnable to be created again
+    registry.clear()
+    assert registry.get_or_create("graph", factory) is not first
+    assert len(created) == 2
+
+
+@pytest.mark.asyncio
+async def test_report_graph_is_compiled_once():
+    from src.agents.report_graph import create_report_graph
+
+    assert await create_report_graph() is await create_report_graph()
+
+
+def test_structured_output_models_are_bound_once_per_model():
+    from src.agents import report_editor_graph, report_graph, research_graph
+
+    getters = [
+        report_graph.get_review_response_model,
+        research_graph.get_progress_ledger_model,
+        report_editor_graph.get_router_model,
+    ]
+    for getter in getters:
+        # The models are not hashable, so they must not be part of the registry key
+        assert getter() is getter()
@@ -2,6 +2,7 @@ import pytest
 
 from src.configuration.db_models import (
     KpiPeriodsEnum,
+    SalesCurrencyEnum,
     SalesGroupingsEnum,
     SalesReportRequestCreateDto,
     SalesReportRequestUpdateDto,
@@ -100,3 +101,56 @@ def test_sales_report_update_successful():
     assert update_request.grouping == SalesGroupingsEnum.COUNTRY
     assert update_request.grouping_value == "Spain"
     assert len(update_request.recipients) == 1
+
+
+def test_sales_report_task_id_depends_on_work_not_recipients():
+    """Test that task_id only changes with the data work needed for the report."""
+    report = SalesReportRequestCreateDto(
+        grouping=SalesGroupingsEnum.COUNTRY,
+        grouping_value="Spain",
+        period=KpiPeriodsEnum.MONTHLY,
+        recipients=default_recipients,
+    )
+    other_recipients = report.model_copy(
+        update={"recipients": [RecipientEmail(email="a@example.com", name="A")]}
+    )
+    other_period = report.model_copy(update={"period": KpiPeriodsEnum.YEARLY})
+    other_currency = report.model_copy(
+        update={"currency": SalesCurrencyEnum.REPORTING}
+    )
+
+    assert report.task_id == "sales_report_country_spain_monthly_functional"
+    assert other_recipients.task_id == report.task_id
+    assert other_period.task_id != report.task_id
+    assert other_currency.task_id != report.task_id
+
+
+def test_sales_report_list_of_grouping_values():
+    """Test that a list of grouping values makes a single multi-value request."""
+    report = SalesReportRequestCreateDto(
+        grouping=SalesGroupingsEnum.COUNTRY,
+        grouping_value=["Spain", " France "],
+        period=KpiPeriodsEnum.MONTHLY,
+        recipients=default_recipients,
+    )
+    assert report.grouping_value == "Spain; France"
+    assert report.is_multi_value
+    assert report.grouping_values == ["Spain", "France"]
+    assert report.name == "Sales Report - Country - Spain, France"
+    # Identifiers don't depend on the order of the values
+    reordered = report.model_copy(update={"grouping_value": "France; Spain"})
+    assert reordered.task_id == report.task_id
+
+
+def test_sales_report_all_grouping_values():
+    """Test that "all" covers every value of the grouping."""
+    report = SalesReportRequestCreateDto(
+        grouping=SalesGroupingsEnum.PRODUCT_FAMILY,
+        grouping_value="All",
+        period=KpiPeriodsEnum.MONTHLY,
+        recipients=default_recipients,
+    )
+    assert report.is_multi_value
+    assert report.grouping_values == []
+    assert report.short_name == "all"
+    assert report.task_id == "sales_report_product_family_all_monthly_functional"
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import LocalDataSource
+from src.configuration.settings import app_settings
+from src.data_engine.chunked_aggregation import (
+    aggregate_in_chunks,
+    get_dataset_files,
+    read_dataset_file,
+)
+
+
+def sum_sales_by_year(data: pd.DataFrame) -> pd.DataFrame:
+    return data.groupby("INVOICE_YEAR", as_index=False)["SALES"].sum()
+
+
+def combine_sales_by_year(aggregates: list[pd.DataFrame]) -> pd.DataFrame:
+    return sum_sales_by_year(pd.concat(aggregates, ignore_index=True))
+
+
+@pytest.fixture()
+def data_source(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> LocalDataSource:
+    """Data source with 30 rows over 3 years, cached in chunks of 4 rows."""
+    monkeypatch.setattr(app_settings, "data_chunk_rows", 4)
+    pd.DataFrame(
+        {
+            "INVOICE_YEAR": [2021 + i % 3 for i in range(30)],
+            "COUNTRY": ["SPAIN" if i % 2 else "GERMANY" for i in range(30)],
+            # Missing values in later chunks only
+            "SALES": [float(i) if i < 25 else None for i in range(30)],
+            "QUANTITY": list(range(30)),
+        }
+    ).to_csv(tmp_path / "chunked.csv", index=False, encoding="ISO-8859-1")
+    return LocalDataSource(
+        name="chunked.csv",
+        description="Test data",
+        location=tmp_path,
+        categorical_columns=["COUNTRY"],
+        partition_columns=["INVOICE_YEAR"],
+        cache_location=tmp_path / "cache",
+    )
+
+
+def test_cache_is_written_in_chunks_with_consistent_types(
+    data_source: LocalDataSource,
+):
+    files = get_dataset_files(data_source)
+
+    assert len(files) > 3
+    for file in files:
+        data = read_dataset_file(file, data_source.cache_path)
+        assert data["SALES"].dtype == "float64"
+    assert data_source.load()["SALES"].sum() == sum(range(25))
+
+
+def test_chunked_aggregation_matches_full_aggregation(data_source: LocalDataSource):
+    chunked = aggregate_in_chunks(
+        data_source,
+        aggregate=sum_sales_by_year,
+        combine=combine_sales_by_year,
+        columns=["INVOICE_YEAR", "SALES"],
+    )
+
+    pd.testing.assert_frame_equal(
+        chunked, sum_sales_by_year(data_source.load()), check_dtype=False
+    )
+
+
+def test_partition_filter_skips_files(data_source: LocalDataSource):
+    aggregated = aggregate_in_chunks(
+        data_source,
+        aggregate=sum_sales_by_year,
+        combine=combine_sales_by_year,
+        columns=["INVOICE_YEAR", "SALES"],
+        partition_filter=lambda partition: partition["INVOICE_YEAR"] >= 2023,
+    )
+
+    assert list(aggregated["INVOICE_YEAR"]) == [2023]
+
+
+def test_daemon_processes_aggregate_serially(
+    data_source: LocalDataSource, monkeypatch: pytest.MonkeyPatch
+):
+    from src.data_engine import chunked_aggregation
+
+    class DaemonProcess:
+        daemon = True
+
+    def get_executor():
+        raise AssertionError("daemonic processes are not allowed to have children")
+
+    monkeypatch.setattr(
+        chunked_aggregation.multiprocessing, "current_process", DaemonProcess
+    )
+    monkeypatch.setattr(chunked_aggregation, "get_executor", get_executor)
+
+    aggregated = aggregate_in_chunks(
+        data_source,
+        aggregate=sum_sales_by_year,
+        combine=combine_sales_by_year,
+        columns=["INVOICE_YEAR", "SALES"],
+    )
+
+    assert list(aggregated["INVOICE_YEAR"]) == [2021, 2022, 2023]
@@ -0,0 +1,119 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.db_models import (
+    KpiPeriodsEnum,
+    SalesCurrencyEnum,
+    SalesGroupingsEnum,
+    SalesReportRequest,
+)
+from src.data_engine.dataset_profile import (
+    InvalidRequestError,
+    get_dataset_profile,
+    validate_sales_report_request,
+)
+
+
+@pytest.fixture()
+def data_source(tmp_path: Path) -> LocalDataSource:
+    """Invoices from November 2022 to February 2023, in two cities of the US and Spain."""
+    rows = [
+        # year, month, country, city, currency, sales
+        (2022, 11, "UNITED STATES", "LOS ANGELES", "USD", 100.0),
+        (2022, 12, "UNITED STATES", "SAN FRANCISCO", "USD", 50.0),
+        (2023, 1, "SPAIN", "MADRID", "EUR", 30.0),
+        (2023, 2, "SPAIN", "MADRID", "EUR", 20.0),
+    ]
+    pd.DataFrame(
+        [
+            {
+                "INVOICE_YEAR": year,
+                "INVOICE_MONTH": month,
+                "SOLD_TO_COUNTRY": country,
+                "SOLD_TO_CITY": city,
+                "ITEM_EU_FAMILY": "Office Chairs",
+                "ENTITY_CURRENCY": currency,
+                "SALES_FUNCTIONAL_CURRENCY": sales,
+                "GROSS_AMOUNT": sales,
+                "DISCOUNT_AMOUNT": 0.0,
+            }
+            for year, month, country, city, currency, sales in rows
+        ]
+    ).to_csv(tmp_path / "financials.csv", index=False, encoding="ISO-8859-1")
+    return INTERNAL_DATA.model_copy(
+        update={
+            "name": "financials.csv",
+            "location": tmp_path,
+            "cache_location": tmp_path / "cache",
+        }
+    )
+
+
+def create_request(grouping_value: str) -> SalesReportRequest:
+    return SalesReportRequest(
+        id=1,
+        period=KpiPeriodsEnum.MONTHLY,
+        currency=SalesCurrencyEnum.FUNCTIONAL,
+        grouping=SalesGroupingsEnum.CITY,
+        grouping_value=grouping_value,
+        recipients=[],
+    )
+
+
+def test_profile_summarizes_data(data_source: LocalDataSource):
+    profile = get_dataset_profile(data_source)
+
+    assert profile.row_count == 4
+    assert profile.functional_sales == {"EUR": 50.0, "USD": 150.0}
+    assert profile.grouping_values[SalesGroupingsEnum.COUNTRY] == {
+        "UNITED STATES": "UNITED STATES",
+        "SPAIN": "SPAIN",
+    }
+    description = profile.describe()
+    assert "Invoices from 2022-11 to 2023-02" in description
+    assert "SOLD_TO_CITY: 3 distinct values: LOS ANGELES, MADRID, SAN FRANCISCO" in (
+        description
+    )
+
+
+def test_profile_is_built_once_per_data_version(data_source: LocalDataSource):
+    profile = get_dataset_profile(data_source)
+    assert get_dataset_profile(data_source) is profile
+
+    with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+        file.write("2023,3,FRANCE,PARIS,Office Chairs,EUR,5.0,5.0,0.0\n")
+
+    assert "PARIS" in get_dataset_profile(data_source).grouping_values[
+        SalesGroupingsEnum.CITY
+    ]
+
+
+def test_casing_of_grouping_value_is_fixed(data_source: LocalDataSource):
+    request = validate_sales_report_request(create_request(" los angeles"), data_source)
+
+    assert request.grouping_value == "LOS ANGELES"
+
+
+def test_grouping_value_as_in_data_is_kept(data_source: LocalDataSource):
+    request = create_request("MADRID")
+
+    assert validate_sales_report_request(request, data_source) is request
+
+
+def test_unknown_grouping_value_suggests_close_matches(data_source: LocalDataSource):
+    with pytest.raises(InvalidRequestError, match="Did you mean: LOS ANGELES"):
+        validate_sales_report_request(create_request("Los Angels"), data_source)
+
+
+def test_each_value_of_a_list_is_checked(data_source: LocalDataSource):
+    request = validate_sales_report_request(
+        create_request("madrid; los angeles"), data_source
+    )
+
+    assert request.grouping_values == ["MADRID", "LOS ANGELES"]
+    with pytest.raises(InvalidRequestError, match="Did you mean: LOS ANGELES"):
+        validate_sales_report_request(create_request("Madrid; Los Angels"), data_source)
+    assert validate_sales_report_request(create_request("all"), data_source).is_multi_value
@@ -0,0 +1,179 @@
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.db_models import (
+    KpiPeriodsEnum,
+    SalesCurrencyEnum,
+    SalesGroupingsEnum,
+    SalesReportRequest,
+)
+from src.data_engine.grouped_sales import (
+    collect_sub_analysis_files,
+    describe_grouped_sales_history,
+    extract_grouped_sales_history,
+    get_sub_analysis_dir,
+    select_sub_analysis_values,
+    store_grouped_sales_history,
+    store_sub_analysis_histories,
+    summarize_grouped_sales_history,
+)
+
+ANALYSIS_DATE = date(2023, 12, 1)
+# Monthly sales of each country, and their sales in November 2023
+MONTHLY_SALES = {"SPAIN": 100.0, "GERMANY": 300.0, "FRANCE": 50.0}
+LAST_MONTH_SALES = {"SPAIN": 100.0, "GERMANY": 330.0, "FRANCE": 10.0}
+
+
+def create_request(
+    grouping_value: str | list[str] = "all",
+    period: KpiPeriodsEnum = KpiPeriodsEnum.MONTHLY,
+) -> SalesReportRequest:
+    return SalesReportRequest(
+        id=1,
+        period=period,
+        currency=SalesCurrencyEnum.FUNCTIONAL,
+        grouping=SalesGroupingsEnum.COUNTRY,
+        grouping_value=grouping_value,
+        recipients=[],
+    )
+
+
+@pytest.fixture()
+def financials_source(tmp_path: Path) -> LocalDataSource:
+    """Small financials file with one invoice per country and month from 2020 to 2023."""
+    rows = []
+    for year in range(2020, 2024):
+        for month in range(1, 13):
+            for country, sales in MONTHLY_SALES.items():
+                if (year, month) == (2023, 11):
+                    sales = LAST_MONTH_SALES[country]
+                rows.append(
+                    {
+                        "INVOICE_YEAR": year,
+                        "INVOICE_MONTH": month,
+                        "SOLD_TO_COUNTRY": country.title(),
+                        "SOLD_TO_CITY": f"{country} CITY",
+                        "ITEM_EU_FAMILY": "CHAIRS",
+                        "ENTITY_CURRENCY": "EUR",
+                        "SALES_FUNCTIONAL_CURRENCY": sales,
+                        "GROSS_AMOUNT": sales,
+                        "DISCOUNT_AMOUNT": 0.0,
+                        "SoldToID": 1,
+                    }
+                )
+    pd.DataFrame(rows).to_csv(
+        tmp_path / "financials.csv", index=False, encoding="ISO-8859-1"
+    )
+    return INTERNAL_DATA.model_copy(
+        update={
+            "name": "financials.csv",
+            "location": tmp_path,
+            "cache_location": tmp_path / "cache",
+        }
+    )
+
+
+def test_history_of_all_values_in_one_table(financials_source: LocalDataSource):
+    history = extract_grouped_sales_history(
+        create_request(), ANALYSIS_DATE, financials_source
+    )
+
+    assert list(history.columns) == [
+        "SOLD_TO_COUNTRY",
+        "MONTH_YEAR",
+        "SALES_FUNCTIONAL_CURRENCY",
+    ]
+    assert len(history) == 3 * 36
+    assert history.groupby("SOLD_TO_COUNTRY")["MONTH_YEAR"].max().eq("2023-11").all()
+
+
+def test_history_of_listed_values(financials_source: LocalDataSource):
+    history = extract_grouped_sales_history(
+        create_request(["spain", "France"], period=KpiPeriodsEnum.YEARLY),
+        ANALYSIS_DATE,
+        financials_source,
+    )
+
+    assert set(history["SOLD_TO_COUNTRY"]) == {"SPAIN", "FRANCE"}
+    spain = history.loc[history["SOLD_TO_COUNTRY"] == "SPAIN"]
+    # 2023 only has the 11 months before the analysis date
+    assert list(spain["SALES_FUNCTIONAL_CURRENCY"]) == [1200.0, 1200.0, 1200.0, 1100.0]
+
+
+def test_summary_of_each_value(financials_source: LocalDataSource):
+    request = create_request()
+    history = extract_grouped_sales_history(request, ANALYSIS_DATE, financials_source)
+
+    summary = summarize_grouped_sales_history(history, request).set_index(
+        "SOLD_TO_COUNTRY"
+    )
+
+    assert list(summary.index) == ["GERMANY", "SPAIN", "FRANCE"]
+    assert summary.loc["GERMANY", "PREVIOUS_PERIOD_CHANGE_PCT"] == 10.0
+    assert summary.loc["FRANCE", "YEAR_OVER_YEAR_CHANGE_PCT"] == -80.0
+    assert summary.loc["SPAIN", "SHARE_OF_TOTAL_PCT"] == round(100 / 440 * 100, 2)
+
+
+def test_largest_values_alternate_with_the_ones_that_changed_most(
+    financials_source: LocalDataSource,
+):
+    request = create_request()
+    history = extract_grouped_sales_history(request, ANALYSIS_DATE, financials_source)
+    summary = summarize_grouped_sales_history(history, request)
+
+    assert select_sub_analysis_values(summary, request, max_values=2) == [
+        "GERMANY",
+        "FRANCE",
+    ]
+    assert select_sub_analysis_values(summary, request, max_values=5) == [
+        "GERMANY",
+        "FRANCE",
+        "SPAIN",
+    ]
+
+
+def test_store_and_split_for_sub_analyses(
+    financials_source: LocalDataSource, tmp_path: Path
+):
+    request = create_request()
+    output_location = tmp_path / f"{request.short_name}_sales_history.csv"
+
+    history, summary = store_grouped_sales_history(
+        request, ANALYSIS_DATE, output_location, financials_source
+    )
+    description = describe_grouped_sales_history(
+        request, history, summary, output_location
+    )
+    locations = store_sub_analysis_histories(request, output_location, max_values=2)
+
+    assert "all_sales_summary.csv" in description
+    assert "for 3 values of SOLD_TO_COUNTRY from 2020-12 to 2023-11" in description
+    assert list(locations) == ["GERMANY", "FRANCE"]
+    assert locations["FRANCE"].name == "all_france_sales_history.csv"
+    france = pd.read_csv(locations["FRANCE"], dtype={"MONTH_YEAR": str})
+    assert list(france.columns) == ["MONTH_YEAR", "SALES_FUNCTIONAL_CURRENCY"]
+    assert france["SALES_FUNCTIONAL_CURRENCY"].iloc[-1] == 10.0
+
+
+def test_files_of_sub_analyses_are_prefixed_with_their_value(tmp_path: Path):
+    output_dir = get_sub_analysis_dir("United Kingdom", tmp_path)
+    (output_dir / "trend.png").write_bytes(b"chart")
+    (output_dir / "united_kingdom_summary.csv").write_text("a\n1\n")
+
+    analysis = collect_sub_analysis_files(
+        "United Kingdom",
+        "See trend.png, sales_trend.png and united_kingdom_summary.csv.",
+        output_dir,
+    )
+
+    assert analysis == (
+        "See united_kingdom_trend.png, sales_trend.png and united_kingdom_summary.csv."
+    )
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "united_kingdom_summary.csv",
+        "united_kingdom_trend.png",
+    ]
@@ -0,0 +1,95 @@
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.db_models import SalesGroupingsEnum
+from src.data_engine.grouping_value_index import (
+    GroupingValueIndex,
+    get_grouping_value_index,
+)
+
+
+@pytest.fixture()
+def index() -> GroupingValueIndex:
+    cities = ["LOS ANGELES", "LOS GATOS", "SAN FRANCISCO", "MADRID", "SANTANDER"]
+    return GroupingValueIndex(
+        {
+            SalesGroupingsEnum.CITY: {city: city for city in cities},
+            SalesGroupingsEnum.PRODUCT_FAMILY: {"OFFICE CHAIRS": "Office Chairs"},
+        }
+    )
+
+
+def test_prefix_matches_come_first(index: GroupingValueIndex):
+    assert index.search(SalesGroupingsEnum.CITY, "los", limit=2) == [
+        "LOS ANGELES",
+        "LOS GATOS",
+    ]
+    assert index.search(SalesGroupingsEnum.CITY, "San")[:2] == [
+        "SAN FRANCISCO",
+        "SANTANDER",
+    ]
+
+
+def test_fuzzy_matches(index: GroupingValueIndex):
+    assert index.search(SalesGroupingsEnum.CITY, "Madird")[0] == "MADRID"
+    assert index.search(SalesGroupingsEnum.CITY, "sna francisco")[0] == "SAN FRANCISCO"
+
+
+def test_values_are_returned_as_in_data(index: GroupingValueIndex):
+    assert index.search(SalesGroupingsEnum.PRODUCT_FAMILY, "office") == [
+        "Office Chairs"
+    ]
+
+
+def test_search_is_fast_with_many_values():
+    cities = {f"CITY {i:05d} {'NORTH' if i % 2 else 'SOUTH'}": "" for i in range(50_000)}
+    index = GroupingValueIndex({SalesGroupingsEnum.CITY: cities})
+
+    start = time.perf_counter()
+    for query in ["city 123", "ctiy 4567 nrth", "south"]:
+        assert index.search(SalesGroupingsEnum.CITY, query)
+    # Generous bound for slow test machines, typical searches take a few ms
+    assert (time.perf_counter() - start) / 3 < 0.05
+
+
+def test_index_is_rebuilt_when_data_changes(tmp_path: Path):
+    pd.DataFrame(
+        {
+            "INVOICE_YEAR": [2023],
+            "INVOICE_MONTH": [1],
+            "SOLD_TO_COUNTRY": ["SPAIN"],
+            "SOLD_TO_CITY": ["MADRID"],
+            "ITEM_EU_FAMILY": ["CHAIRS"],
+            "ENTITY_CURRENCY": ["EUR"],
+            "SALES_FUNCTIONAL_CURRENCY": [10.0],
+            "GROSS_AMOUNT": [10.0],
+            "DISCOUNT_AMOUNT": [0.0],
+        }
+    ).to_csv(tmp_path / "financials.csv", index=False, encoding="ISO-8859-1")
+    data_source: LocalDataSource = INTERNAL_DATA.model_copy(
+        update={
+            "name": "financials.csv",
+            "location": tmp_path,
+            "cache_location": tmp_path / "cache",
+        }
+    )
+
+    index = get_grouping_value_index(data_source)
+    assert get_grouping_value_index(data_source) is index
+
+    with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+        file.write("2023,2,FRANCE,PARIS,CHAIRS,EUR,5.0,5.0,0.0\n")
+
+    # The previous index is used while the new one is built in the background
+    assert get_grouping_value_index(data_source) is index
+    deadline = time.monotonic() + 30
+    while get_grouping_value_index(data_source) is index:
+        assert time.monotonic() < deadline, "The index was not rebuilt"
+        time.sleep(0.01)
+    assert get_grouping_value_index(data_source).search(
+        SalesGroupingsEnum.CITY, "par"
+    ) == ["PARIS"]
@@ -0,0 +1,135 @@
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.db_models import (
+    KpiPeriodsEnum,
+    SalesCurrencyEnum,
+    SalesGroupingsEnum,
+    SalesReportRequest,
+)
+from src.data_engine.operational_data import (
+    describe_operational_breakdowns,
+    get_last_period_window,
+    store_operational_breakdowns,
+)
+
+ANALYSIS_DATE = date(2023, 12, 1)
+
+
+@pytest.fixture()
+def request_spain() -> SalesReportRequest:
+    return SalesReportRequest(
+        id=1,
+        period=KpiPeriodsEnum.MONTHLY,
+        currency=SalesCurrencyEnum.FUNCTIONAL,
+        grouping=SalesGroupingsEnum.COUNTRY,
+        grouping_value="Spain",
+        recipients=[],
+    )
+
+
+@pytest.fixture()
+def data_source(tmp_path: Path) -> LocalDataSource:
+    """Invoices of October and November 2023, in Spain and Germany."""
+    rows = [
+        # month, country, city, item, customer, sales
+        (10, "SPAIN", "MADRID", "A1", 1, 50.0),
+        (11, "SPAIN", "MADRID", "A1", 1, 30.0),
+        (11, "SPAIN", "SEVILLA", "B2", 2, 10.0),
+        (11, "SPAIN", "MADRID", "B2", 2, 60.0),
+        (11, "GERMANY", "BERLIN", "A1", 3, 1000.0),
+    ]
+    pd.DataFrame(
+        [
+            {
+                "INVOICE_YEAR": 2023,
+                "INVOICE_MONTH": month,
+                "SOLD_TO_COUNTRY": country,
+                "SOLD_TO_CITY": city,
+                "ITEM_EU_FAMILY": "CHAIRS",
+                "ITEM_CODE": item,
+                "SoldToID": customer,
+                "ENTITY_CURRENCY": "EUR",
+                "SALES_FUNCTIONAL_CURRENCY": sales,
+                "GROSS_AMOUNT": sales,
+                "DISCOUNT_AMOUNT": 0.0,
+            }
+            for month, country, city, item, customer, sales in rows
+        ]
+    ).to_csv(tmp_path / "financials.csv", index=False, encoding="ISO-8859-1")
+    return INTERNAL_DATA.model_copy(
+        update={
+            "name": "financials.csv",
+            "location": tmp_path,
+            "cache_location": tmp_path / "cache",
+        }
+    )
+
+
+def test_last_period_window():
+    assert get_last_period_window(KpiPeriodsEnum.MONTHLY, ANALYSIS_DATE) == (
+        2023 * 12 + 10,
+        2023 * 12 + 11,
+    )
+    # October and November, as December is not complete
+    assert get_last_period_window(KpiPeriodsEnum.QUARTERLY, ANALYSIS_DATE) == (
+        2023 * 12 + 9,
+        2023 * 12 + 11,
+    )
+
+
+def test_breakdowns_of_last_period(
+    data_source: LocalDataSource, request_spain: SalesReportRequest, tmp_path: Path
+):
+    breakdowns = store_operational_breakdowns(
+        request_spain, ANALYSIS_DATE, tmp_path, data_source
+    )
+
+    # The grouping itself is not broken down
+    assert "SOLD_TO_COUNTRY" not in breakdowns
+    by_city = breakdowns["SOLD_TO_CITY"]
+    assert list(by_city["SOLD_TO_CITY"]) == ["MADRID", "SEVILLA"]
+    assert list(by_city["SALES_FUNCTIONAL_CURRENCY"]) == [90.0, 10.0]
+    assert list(by_city["SHARE_OF_TOTAL_PCT"]) == [90.0, 10.0]
+    assert (tmp_path / "spain_last_period_sales_by_sold_to_city.csv").exists()
+
+
+def test_description_lists_files(
+    data_source: LocalDataSource, request_spain: SalesReportRequest, tmp_path: Path
+):
+    breakdowns = store_operational_breakdowns(
+        request_spain, ANALYSIS_DATE, tmp_path, data_source
+    )
+
+    description = describe_operational_breakdowns(request_spain, breakdowns, tmp_path)
+
+    assert "spain_last_period_sales_by_item_code.csv" in description
+    assert "spain_last_period_sales_by_soldtoid.csv" in description
+
+
+def test_no_sales_in_last_period_raises(
+    data_source: LocalDataSource, request_spain: SalesReportRequest, tmp_path: Path
+):
+    with pytest.raises(ValueError):
+        store_operational_breakdowns(
+            request_spain, date(2024, 6, 1), tmp_path, data_source
+        )
+
+
+def test_breakdowns_of_several_grouping_values(
+    data_source: LocalDataSource, request_spain: SalesReportRequest, tmp_path: Path
+):
+    request = request_spain.model_copy(update={"grouping_value": "all"})
+
+    breakdowns = store_operational_breakdowns(
+        request, ANALYSIS_DATE, tmp_path, data_source
+    )
+
+    # The values are compared with each other, so the grouping is broken down too
+    by_country = breakdowns["SOLD_TO_COUNTRY"]
+    assert list(by_country["SOLD_TO_COUNTRY"]) == ["GERMANY", "SPAIN"]
+    assert list(by_country["SALES_FUNCTIONAL_CURRENCY"]) == [1000.0, 100.0]
@@ -0,0 +1,185 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import LocalDataSource
+from src.configuration.settings import app_settings
+from src.data_engine import parquet_cache
+from src.data_engine.parquet_cache import MANIFEST_FILE_NAME, get_cache_partitions
+
+
+@pytest.fixture()
+def data_source(tmp_path: Path) -> LocalDataSource:
+    pd.DataFrame(
+        {
+            "INVOICE_YEAR": [2021, 2021, 2022, 2023],
+            "INVOICE_MONTH": [1, 2, 3, 4],
+            "SOLD_TO_COUNTRY": ["SPAIN", "GERMANY", "SPAIN", "SPAIN"],
+            "SALES_FUNCTIONAL_CURRENCY": [10.5, 20.0, 30.0, 40.0],
+        }
+    ).to_csv(tmp_path / "financials.csv", index=False, encoding="ISO-8859-1")
+    return LocalDataSource(
+        name="financials.csv",
+        description="Test data",
+        location=tmp_path,
+        categorical_columns=["SOLD_TO_COUNTRY"],
+        partition_columns=["INVOICE_YEAR"],
+        cache_location=tmp_path / "cache",
+    )
+
+
+def test_cache_is_partitioned_and_typed(data_source: LocalDataSource):
+    data = data_source.load()
+
+    assert sorted(p.name for p in data_source.cache_path.glob("INVOICE_YEAR=*")) == [
+        "INVOICE_YEAR=2021",
+        "INVOICE_YEAR=2022",
+        "INVOICE_YEAR=2023",
+    ]
+    assert isinstance(data["SOLD_TO_COUNTRY"].dtype, pd.CategoricalDtype)
+    assert data["INVOICE_MONTH"].dtype == "int8"
+    assert pd.api.types.is_integer_dtype(data["INVOICE_YEAR"])
+    assert data["SALES_FUNCTIONAL_CURRENCY"].sum() == 100.5
+
+
+def test_load_filters_columns_and_partitions(data_source: LocalDataSource):
+    data = data_source.load(
+        columns=["INVOICE_YEAR", "SALES_FUNCTIONAL_CURRENCY"],
+        filters=[("INVOICE_YEAR", ">=", 2022)],
+    )
+
+    assert list(data.columns) == ["INVOICE_YEAR", "SALES_FUNCTIONAL_CURRENCY"]
+    assert sorted(data["INVOICE_YEAR"]) == [2022, 2023]
+
+
+def test_cache_is_reused_while_source_is_unchanged(data_source: LocalDataSource):
+    data_source.load()
+
+    with patch("src.data_engine.parquet_cache.build_parquet_cache") as mock_build:
+        data_source.load()
+        # Touching the file without changing its content does not rebuild it either
+        data_source.path.touch()
+        data_source.load()
+
+    mock_build.assert_not_called()
+
+
+def test_cache_is_rebuilt_when_source_changes(data_source: LocalDataSource):
+    data_source.load()
+    manifest = (data_source.cache_path / MANIFEST_FILE_NAME).read_text()
+
+    with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+        file.write("2024,5,FRANCE,50.0\n")
+    data = data_source.load()
+
+    assert (data_source.cache_path / MANIFEST_FILE_NAME).read_text() != manifest
+    assert 2024 in set(data["INVOICE_YEAR"])
+
+
+def test_missing_source_raises(data_source: LocalDataSource):
+    data_source.path.unlink()
+
+    with pytest.raises(FileNotFoundError):
+        data_source.load()
+
+
+def test_only_changed_partitions_are_rewritten(data_source: LocalDataSource):
+    data_source.load()
+    unchanged_files = {
+        file: file.stat().st_ino
+        for file in data_source.cache_path.glob("INVOICE_YEAR=202[12]/*.parquet")
+    }
+
+    # Correct the 2023 invoice and remove nothing else
+    source = pd.read_csv(data_source.path, encoding="ISO-8859-1")
+    source.loc[source["INVOICE_YEAR"] == 2023, "SALES_FUNCTIONAL_CURRENCY"] = 45.0
+    source.to_csv(data_source.path, index=False, encoding="ISO-8859-1")
+    data = data_source.load()
+
+    assert data["SALES_FUNCTIONAL_CURRENCY"].sum() == 105.5
+    # Files of unchanged partitions are reused as they are
+    for file, inode in unchanged_files.items():
+        assert file.stat().st_ino == inode
+    assert set(get_cache_partitions(data_source.cache_path)) == {
+        "INVOICE_YEAR=2021",
+        "INVOICE_YEAR=2022",
+        "INVOICE_YEAR=2023",
+    }
+
+
+def test_refresh_parses_the_source_once(data_source: LocalDataSource, monkeypatch):
+    monkeypatch.setattr(app_settings, "data_chunk_rows", 2)
+    data_source.load()
+
+    with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+        file.write("2024,5,FRANCE,50.0\n")
+    with patch.object(
+        parquet_cache, "read_csv_chunks", wraps=parquet_cache.read_csv_chunks
+    ) as mock_read:
+        data = data_source.load()
+
+    mock_read.assert_called_once()
+    assert data["SALES_FUNCTIONAL_CURRENCY"].sum() == 150.5
+    assert not (data_source.cache_path / parquet_cache.SPOOL_DIR_NAME).exists()
+
+
+@pytest.mark.parametrize(
+    "codes",
+    [
+        # Parsed as numbers in the first chunk, so the csv is parsed again
+        ["007", "010", "A1"],
+        # Read back from the spool
+        ["A7", "B0", "C1"],
+    ],
+)
+def test_column_types_are_kept_across_chunks(
+    tmp_path: Path, monkeypatch, codes: list[str]
+):
+    monkeypatch.setattr(app_settings, "data_chunk_rows", 2)
+    (tmp_path / "codes.csv").write_text(
+        f"INVOICE_YEAR,CODE,NOTE\n2021,{codes[0]},\n2021,{codes[1]},\n"
+        f"2022,{codes[2]},late\n"
+    )
+    data_source = LocalDataSource(
+        name="codes.csv",
+        description="Test data",
+        location=tmp_path,
+        partition_columns=["INVOICE_YEAR"],
+        cache_location=tmp_path / "cache",
+    )
+
+    data = data_source.load().sort_values("CODE")
+
+    assert list(data["CODE"]) == codes
+    assert list(data["NOTE"].fillna("")) == ["", "", "late"]
+
+
+def test_removed_partitions_are_dropped(data_source: LocalDataSource):
+    data_source.load()
+
+    source = pd.read_csv(data_source.path, encoding="ISO-8859-1")
+    source.loc[source["INVOICE_YEAR"] != 2021].to_csv(
+        data_source.path, index=False, encoding="ISO-8859-1"
+    )
+    data = data_source.load()
+
+    assert sorted(set(data["INVOICE_YEAR"])) == [2022, 2023]
+    assert not (data_source.cache_path / "INVOICE_YEAR=2021").exists()
+
+
+def test_failed_build_leaves_the_cache_as_it_was(data_source: LocalDataSource):
+    data_source.load()
+    manifest = (data_source.cache_path / MANIFEST_FILE_NAME).read_text()
+
+    with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+        file.write("2024,5,FRANCE,50.0\n")
+    with (
+        patch.object(pd.DataFrame, "to_parquet", side_effect=OSError("Disk full")),
+        pytest.raises(OSError),
+    ):
+        data_source.load()
+
+    assert (data_source.cache_path / MANIFEST_FILE_NAME).read_text() == manifest
+    assert not list(data_source.cache_path.parent.glob("*.tmp"))
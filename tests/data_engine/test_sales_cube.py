@@ -0,0 +1,166 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.db_models import KpiPeriodsEnum, SalesGroupingsEnum
+from src.data_engine.sales_cube import (
+    SalesCube,
+    aggregate_sales,
+    build_sales_cube,
+    combine_sales_aggregates,
+    get_month_index,
+    get_sales_cube,
+)
+
+
+@pytest.fixture()
+def invoices() -> pd.DataFrame:
+    """Two invoices per month in 2023, one for Madrid and one for Berlin."""
+    rows = []
+    for month in range(1, 13):
+        for country, city in [("SPAIN", "MADRID"), ("GERMANY", "BERLIN")]:
+            rows.append(
+                {
+                    "INVOICE_YEAR": 2023,
+                    "INVOICE_MONTH": month,
+                    "SOLD_TO_COUNTRY": country,
+                    "SOLD_TO_CITY": city,
+                    "ITEM_EU_FAMILY": "CHAIRS",
+                    "ENTITY_CURRENCY": "EUR",
+                    "SALES_FUNCTIONAL_CURRENCY": float(month),
+                    "GROSS_AMOUNT": float(month) + 1,
+                    "DISCOUNT_AMOUNT": 1.0,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture()
+def data_source(tmp_path: Path, invoices: pd.DataFrame) -> LocalDataSource:
+    invoices.to_csv(tmp_path / "financials.csv", index=False, encoding="ISO-8859-1")
+    return INTERNAL_DATA.model_copy(
+        update={
+            "name": "financials.csv",
+            "location": tmp_path,
+            "cache_location": tmp_path / "cache",
+        }
+    )
+
+
+def test_aggregate_sales_sums_by_dimensions(invoices: pd.DataFrame):
+    cube_data = aggregate_sales(pd.concat([invoices, invoices]))
+
+    assert len(cube_data) == 24
+    assert cube_data["SALES_FUNCTIONAL_CURRENCY"].sum() == 2 * 2 * 78
+    assert (
+        cube_data["SALES_FUNCTIONAL_CURRENCY"] == cube_data["SALES_REPORTING_CURRENCY"]
+    ).all()
+
+
+def test_combined_aggregates_match_full_aggregate(invoices: pd.DataFrame):
+    first_half, second_half = invoices.iloc[:10], invoices.iloc[10:]
+
+    combined = combine_sales_aggregates(
+        [aggregate_sales(first_half), aggregate_sales(second_half)]
+    )
+
+    pd.testing.assert_frame_equal(combined, aggregate_sales(invoices))
+
+
+class TestSalesCube:
+    def test_monthly_sales_by_grouping_value(self, invoices: pd.DataFrame):
+        cube = SalesCube(aggregate_sales(invoices))
+
+        sales = cube.get_monthly_sales(SalesGroupingsEnum.CITY, " madrid ")
+
+        assert len(sales) == 12
+        assert sales["SALES_FUNCTIONAL_CURRENCY"].sum() == 78
+
+    def test_total_sales(self, invoices: pd.DataFrame):
+        cube = SalesCube(aggregate_sales(invoices))
+
+        sales = cube.get_monthly_sales()
+
+        assert sales["SALES_FUNCTIONAL_CURRENCY"].sum() == 2 * 78
+
+    def test_unknown_grouping_value_raises(self, invoices: pd.DataFrame):
+        cube = SalesCube(aggregate_sales(invoices))
+
+        with pytest.raises(ValueError):
+            cube.get_monthly_sales(SalesGroupingsEnum.COUNTRY, "France")
+
+    def test_grouping_values(self, invoices: pd.DataFrame):
+        cube = SalesCube(aggregate_sales(invoices))
+
+        assert cube.get_grouping_values(SalesGroupingsEnum.COUNTRY) == [
+            "GERMANY",
+            "SPAIN",
+        ]
+
+    def test_quarterly_rollup_within_window(self, invoices: pd.DataFrame):
+        cube = SalesCube(aggregate_sales(invoices))
+
+        sales = cube.get_sales(
+            SalesGroupingsEnum.COUNTRY,
+            "Spain",
+            KpiPeriodsEnum.QUARTERLY,
+            start_month=get_month_index(2023, 1),
+            end_month=get_month_index(2023, 12),
+        )
+
+        assert list(sales["QUARTER_YEAR"]) == ["2023-Q1", "2023-Q2", "2023-Q3", "2023-Q4"]
+        # December is outside the window
+        assert list(sales["SALES_FUNCTIONAL_CURRENCY"]) == [6, 15, 24, 21]
+
+
+class TestGetSalesCube:
+    def test_cube_is_built_once_per_data_version(self, data_source: LocalDataSource):
+        cube = get_sales_cube(data_source)
+
+        with patch("src.data_engine.sales_cube.build_sales_cube") as mock_build:
+            assert get_sales_cube(data_source) is cube
+        mock_build.assert_not_called()
+        assert len(list(data_source.cache_location.glob("*_sales_cube*.parquet"))) == 1
+
+    def test_cube_is_rebuilt_when_source_changes(self, data_source: LocalDataSource):
+        cube = get_sales_cube(data_source)
+        with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+            file.write("2024,1,FRANCE,PARIS,CHAIRS,EUR,5.0,6.0,1.0\n")
+
+        new_cube = get_sales_cube(data_source)
+
+        assert new_cube is not cube
+        assert new_cube.get_monthly_sales(SalesGroupingsEnum.COUNTRY, "France") is not None
+        # The stored cube is updated in place
+        assert len(list(data_source.cache_location.glob("*_sales_cube*.parquet"))) == 1
+
+    def test_only_changed_partitions_are_aggregated(
+        self, data_source: LocalDataSource, invoices: pd.DataFrame
+    ):
+        get_sales_cube(data_source)
+        # Correct the invoices of March and add a new month
+        invoices.loc[invoices["INVOICE_MONTH"] == 3, "SALES_FUNCTIONAL_CURRENCY"] = 100.0
+        new_invoices = invoices.iloc[:2].assign(INVOICE_YEAR=2024, INVOICE_MONTH=1)
+        pd.concat([invoices, new_invoices]).to_csv(
+            data_source.path, index=False, encoding="ISO-8859-1"
+        )
+
+        with patch(
+            "src.data_engine.sales_cube.build_sales_cube", wraps=build_sales_cube
+        ) as mock_build:
+            cube = get_sales_cube(data_source)
+
+        mock_build.assert_called_once_with(
+            data_source,
+            {"INVOICE_YEAR=2023/INVOICE_MONTH=3", "INVOICE_YEAR=2024/INVOICE_MONTH=1"},
+        )
+        sales = cube.get_monthly_sales(SalesGroupingsEnum.CITY, "Madrid")
+        assert sales["SALES_FUNCTIONAL_CURRENCY"].sum() == 78 - 3 + 100 + 1
+        pd.testing.assert_frame_equal(
+            cube.data.reset_index(drop=True),
+            build_sales_cube(data_source),
+            check_dtype=False,
+        )
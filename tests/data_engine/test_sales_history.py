@@ -0,0 +1,168 @@
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import INTERNAL_DATA, LocalDataSource
+from src.configuration.db_models import (
+    KpiPeriodsEnum,
+    SalesCurrencyEnum,
+    SalesGroupingsEnum,
+    SalesReportRequest,
+)
+from src.data_engine.sales_history import (
+    describe_sales_history,
+    extract_sales_history,
+    get_history_window,
+    store_sales_history,
+)
+
+ANALYSIS_DATE = date(2023, 12, 1)
+
+
+def create_request(
+    period: KpiPeriodsEnum = KpiPeriodsEnum.MONTHLY,
+    currency: SalesCurrencyEnum = SalesCurrencyEnum.FUNCTIONAL,
+    grouping: SalesGroupingsEnum | None = SalesGroupingsEnum.COUNTRY,
+    grouping_value: str | None = "Spain",
+) -> SalesReportRequest:
+    return SalesReportRequest(
+        id=1,
+        period=period,
+        currency=currency,
+        grouping=grouping,
+        grouping_value=grouping_value,
+        recipients=[],
+    )
+
+
+@pytest.fixture()
+def financials_source(tmp_path: Path) -> LocalDataSource:
+    """Small financials file with two invoices per month from 2019 to 2023."""
+    rows = []
+    for year in range(2019, 2024):
+        for month in range(1, 13):
+            for country in ["SPAIN", "GERMANY"]:
+                rows.append(
+                    {
+                        "INVOICE_YEAR": year,
+                        "INVOICE_MONTH": month,
+                        "SOLD_TO_COUNTRY": country,
+                        "SOLD_TO_CITY": "MADRID" if country == "SPAIN" else "BERLIN",
+                        "ITEM_EU_FAMILY": "CHAIRS",
+                        "ENTITY_CURRENCY": "EUR",
+                        "SALES_FUNCTIONAL_CURRENCY": 100.0,
+                        "GROSS_AMOUNT": 120.0,
+                        "DISCOUNT_AMOUNT": 20.0,
+                        "SoldToID": 1,
+                    }
+                )
+    pd.DataFrame(rows).to_csv(
+        tmp_path / "financials.csv", index=False, encoding="ISO-8859-1"
+    )
+    return INTERNAL_DATA.model_copy(
+        update={
+            "name": "financials.csv",
+            "location": tmp_path,
+            "cache_location": tmp_path / "cache",
+        }
+    )
+
+
+class TestGetHistoryWindow:
+    def test_monthly_window_covers_last_36_months(self):
+        start, end = get_history_window(KpiPeriodsEnum.MONTHLY, ANALYSIS_DATE)
+
+        assert end - start == 36
+        assert divmod(start, 12) == (2020, 11)  # December 2020
+        assert divmod(end, 12) == (2023, 11)  # December 2023, excluded
+
+    def test_quarterly_window_starts_at_quarter(self):
+        start, _ = get_history_window(KpiPeriodsEnum.QUARTERLY, date(2023, 11, 15))
+
+        assert start % 3 == 0
+
+    def test_yearly_window_starts_at_year(self):
+        start, _ = get_history_window(KpiPeriodsEnum.YEARLY, ANALYSIS_DATE)
+
+        assert divmod(start, 12) == (2020, 0)
+
+
+class TestExtractSalesHistory:
+    def test_monthly_functional_history(self, financials_source: LocalDataSource):
+        history = extract_sales_history(create_request(), ANALYSIS_DATE, financials_source)
+
+        assert list(history.columns) == ["MONTH_YEAR", "SALES_FUNCTIONAL_CURRENCY"]
+        assert len(history) == 36
+        assert history["MONTH_YEAR"].iloc[0] == "2020-12"
+        assert history["MONTH_YEAR"].iloc[-1] == "2023-11"
+        assert (history["SALES_FUNCTIONAL_CURRENCY"] == 100.0).all()
+
+    def test_grouping_value_is_case_insensitive(self, financials_source: LocalDataSource):
+        history = extract_sales_history(
+            create_request(grouping_value=" spain "), ANALYSIS_DATE, financials_source
+        )
+
+        assert len(history) == 36
+
+    def test_reporting_currency_is_net_of_discounts(self, financials_source: LocalDataSource):
+        history = extract_sales_history(
+            create_request(currency=SalesCurrencyEnum.REPORTING),
+            ANALYSIS_DATE,
+            financials_source,
+        )
+
+        assert (history["SALES_REPORTING_CURRENCY"] == 100.0).all()
+
+    def test_quarterly_history(self, financials_source: LocalDataSource):
+        history = extract_sales_history(
+            create_request(period=KpiPeriodsEnum.QUARTERLY),
+            ANALYSIS_DATE,
+            financials_source,
+        )
+
+        assert history["QUARTER_YEAR"].iloc[0] == "2020-Q4"
+        assert history["QUARTER_YEAR"].iloc[-1] == "2023-Q4"
+        assert history["SALES_FUNCTIONAL_CURRENCY"].iloc[0] == 300.0
+        # Only October and November of the current quarter are complete
+        assert history["SALES_FUNCTIONAL_CURRENCY"].iloc[-1] == 200.0
+
+    def test_total_sales_include_all_groupings(self, financials_source: LocalDataSource):
+        history = extract_sales_history(
+            create_request(
+                period=KpiPeriodsEnum.YEARLY, grouping=None, grouping_value=None
+            ),
+            ANALYSIS_DATE,
+            financials_source,
+        )
+
+        assert list(history["YEAR"]) == ["2020", "2021", "2022", "2023"]
+        assert history["SALES_FUNCTIONAL_CURRENCY"].iloc[1] == 2400.0
+
+    def test_unknown_grouping_value_raises(self, financials_source: LocalDataSource):
+        with pytest.raises(ValueError):
+            extract_sales_history(
+                create_request(grouping_value="France"), ANALYSIS_DATE, financials_source
+            )
+
+    def test_missing_file_raises(self, financials_source: LocalDataSource):
+        missing_source = financials_source.model_copy(update={"name": "missing.csv"})
+        with pytest.raises(FileNotFoundError):
+            extract_sales_history(create_request(), ANALYSIS_DATE, missing_source)
+
+
+def test_store_and_describe_sales_history(financials_source: LocalDataSource, tmp_path: Path):
+    request = create_request()
+    output_location = tmp_path / "spain_sales_history.csv"
+
+    history = store_sales_history(
+        request, ANALYSIS_DATE, output_location, financials_source
+    )
+    description = describe_sales_history(request, history, output_location)
+
+    pd.testing.assert_frame_equal(
+        pd.read_csv(output_location, dtype={"MONTH_YEAR": str}), history
+    )
+    assert "spain_sales_history.csv" in description
+    assert "from 2020-12 to 2023-11" in description
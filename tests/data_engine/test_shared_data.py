@@ -0,0 +1,141 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.configuration.constants import LocalDataSource
+from src.data_engine.parquet_cache import get_cache_hash
+from src.data_engine.shared_data import (
+    get_repl_data,
+    get_shared_data,
+    get_shared_data_fingerprint,
+    get_shared_data_path,
+    prepare_shared_data,
+)
+
+
+@pytest.fixture()
+def data_source(tmp_path: Path) -> LocalDataSource:
+    pd.DataFrame(
+        {
+            "INVOICE_YEAR": [2022, 2023],
+            "SOLD_TO_COUNTRY": ["SPAIN", "GERMANY"],
+            "SALES_FUNCTIONAL_CURRENCY": [10.0, 20.0],
+        }
+    ).to_csv(tmp_path / "shared.csv", index=False, encoding="ISO-8859-1")
+    return LocalDataSource(
+        name="shared.csv",
+        description="Test data",
+        location=tmp_path,
+        categorical_columns=["SOLD_TO_COUNTRY"],
+        cache_location=tmp_path / "cache",
+    )
+
+
+def test_shared_data_is_loaded_once(data_source: LocalDataSource):
+    assert get_shared_data(data_source) is get_shared_data(data_source)
+
+
+def test_shared_data_is_reloaded_when_source_changes(data_source: LocalDataSource):
+    first = get_shared_data(data_source)
+    with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+        file.write("2024,FRANCE,30.0\n")
+
+    second = get_shared_data(data_source)
+
+    assert second is not first
+    assert len(second) == 3
+
+
+def test_repl_data_cannot_be_modified_in_place(data_source: LocalDataSource):
+    repl_data = get_repl_data(data_source)
+
+    with pytest.raises(ValueError):
+        repl_data.loc[0, "SALES_FUNCTIONAL_CURRENCY"] = 100.0
+    assert get_shared_data(data_source)["SALES_FUNCTIONAL_CURRENCY"].iloc[0] == 10.0
+
+
+def test_repl_data_columns_are_local_to_each_repl(data_source: LocalDataSource):
+    repl_data = get_repl_data(data_source)
+    repl_data["DOUBLE_SALES"] = repl_data["SALES_FUNCTIONAL_CURRENCY"] * 2
+
+    assert "DOUBLE_SALES" not in get_repl_data(data_source).columns
+    assert "DOUBLE_SALES" not in get_shared_data(data_source).columns
+
+
+def test_repl_data_is_none_without_source(data_source: LocalDataSource):
+    data_source.path.unlink()
+
+    assert get_repl_data(data_source) is None
+
+
+def test_fingerprint_of_repl_data_changes_with_its_columns(
+    data_source: LocalDataSource,
+):
+    repl_data = get_repl_data(data_source)
+    fingerprint = get_shared_data_fingerprint(repl_data)
+
+    assert fingerprint is not None
+    assert get_shared_data_fingerprint(get_repl_data(data_source)) == fingerprint
+    repl_data["DOUBLE_SALES"] = repl_data["SALES_FUNCTIONAL_CURRENCY"] * 2
+    assert get_shared_data_fingerprint(repl_data) is None
+    assert get_shared_data_fingerprint(repl_data.copy()) is None
+
+
+def test_prepared_data_is_memory_mapped(
+    data_source: LocalDataSource, monkeypatch: pytest.MonkeyPatch
+):
+    prepare_shared_data(data_source)
+    expected = data_source.load()
+
+    def load(self, *args, **kwargs):
+        raise AssertionError("The prepared data should not be loaded again")
+
+    monkeypatch.setattr(LocalDataSource, "load", load)
+    data = get_shared_data(data_source)
+
+    pd.testing.assert_frame_equal(data, expected)
+
+
+def test_files_of_previous_versions_are_removed(data_source: LocalDataSource):
+    prepare_shared_data(data_source)
+    with open(data_source.path, "a", encoding="ISO-8859-1") as file:
+        file.write("2024,FRANCE,30.0\n")
+
+    prepare_shared_data(data_source)
+
+    assert [path.name for path in data_source.cache_location.glob("*.arrow")] == [
+        get_shared_data_path(
+            data_source, get_cache_hash(data_source.ensure_cache())
+        ).name
+    ]
+
+
+def test_prepared_data_is_written_in_batches(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    pd.DataFrame(
+        {
+            "INVOICE_YEAR": [2021, 2022, 2022, 2023, 2023],
+            "INVOICE_MONTH": [1, 2, 3, 4, 5],
+            "SOLD_TO_COUNTRY": ["SPAIN", None, "GERMANY", "FRANCE", "SPAIN"],
+            "SALES_FUNCTIONAL_CURRENCY": [10.0, 20.0, 30.0, 40.0, 50.0],
+        }
+    ).to_csv(tmp_path / "partitioned.csv", index=False, encoding="ISO-8859-1")
+    data_source = LocalDataSource(
+        name="partitioned.csv",
+        description="Test data",
+        location=tmp_path,
+        categorical_columns=["SOLD_TO_COUNTRY"],
+        partition_columns=["INVOICE_YEAR"],
+        cache_location=tmp_path / "cache",
+    )
+    # Every batch has a part of the categories
+    monkeypatch.setattr("src.data_engine.shared_data.app_settings.data_chunk_rows", 2)
+    prepare_shared_data(data_source)
+    expected = data_source.load()
+
+    monkeypatch.setattr(LocalDataSource, "load", None)
+    data = get_shared_data(data_source)
+
+    pd.testing.assert_frame_equal(data, expected)
@@ -10,6 +10,7 @@ from src.configuration.db_models import (
     RecipientEmail,
     KpiPeriodsEnum,
     SalesCurrencyEnum,
+    SalesGroupingsEnum,
 )
 from src.configuration.crontab import CrontabFrequency, JobFrequency
 
@@ -99,6 +100,38 @@ class TestSalesReportRoutes:
         # Assert - only check that the function was called
         mock_db.get_all_sales_report_requests.assert_called_once()
 
+    @patch("src.frontend.routers.sales_report.get_grouping_value_index")
+    def test_grouping_values_searches_index(self, mock_get_index, test_client):
+        """Test grouping_values route searches the grouping value index."""
+        # Arrange
+        mock_get_index.return_value.search.return_value = ["SPAIN"]
+
+        # Act
+        response = test_client.get(
+            "/sales_report/grouping_values", params={"grouping": "Country", "query": "spa"}
+        )
+
+        # Assert
+        assert response.json() == {
+            "grouping": "Country",
+            "query": "spa",
+            "values": ["SPAIN"],
+        }
+        mock_get_index.return_value.search.assert_called_once_with(
+            SalesGroupingsEnum.COUNTRY, "spa", limit=10
+        )
+
+    @patch("src.frontend.routers.sales_report.get_grouping_value_index")
+    def test_grouping_values_without_data(self, mock_get_index, test_client):
+        """Test grouping_values route reports missing data as unavailable."""
+        mock_get_index.side_effect = FileNotFoundError("No data")
+
+        response = test_client.get(
+            "/sales_report/grouping_values", params={"grouping": "City"}
+        )
+
+        assert response.status_code == 503
+
 
 class TestCronjobRoutes:
     """Test cronjob router calls correct configuration functions."""